@@ -1,133 +1,558 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Blueprint, Flask, render_template, request, jsonify, Response
 from flask_cors import CORS
+import json
 import os
 import sys
+import time
 
 # パスを追加してollama_clientをインポート可能にする
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from ollama_client import OllamaClient
+from ollama_router import parse_backends
+from chat_sessions import ChatSessionStore
+from prompt_templates import PromptRegistry
+from sensor_analysis import SensorAnalyzer
 from document_search import DocumentSearch
+from parallel_index import default_workers
+from response_cache import ResponseCache
+from startup import Readiness
+from metrics import Metrics
+from context_builder import ContextBuilder
+from generation_scheduler import GenerationScheduler, QueueFullError
+from batch import BATCH_FUNCTION_TYPES, BatchError, parse_records, run_batch
 
 # テンプレートと静的ファイルのパスを設定
 template_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'template')
 static_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static')
 
-app = Flask(__name__, template_folder=template_dir, static_folder=static_dir, static_url_path='/static')
-CORS(app)
-
-# 静的ファイルのルートを明示的に追加（Vercel対応）
-@app.route('/static/<path:filename>')
-def static_files(filename):
-    """静的ファイルを配信"""
-    from flask import send_from_directory
-    return send_from_directory(static_dir, filename)
-
 # 環境判定
 IS_VERCEL = os.getenv('VERCEL') == '1'
 
+# 応答キャッシュ（同じ質問への回答を再利用）
+response_cache = ResponseCache(
+    max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', '256')),
+    ttl=float(os.getenv('RESPONSE_CACHE_TTL', '3600')),
+    path=os.getenv('RESPONSE_CACHE_PATH') or None
+)
+
+# チャットボットの会話セッション（前回までのやり取りを引き継ぎ、新しい質問の部分だけを評価させる）
+chat_sessions = ChatSessionStore(
+    max_sessions=int(os.getenv('CHAT_SESSION_MAX', '1000')),
+    idle_timeout=float(os.getenv('CHAT_SESSION_IDLE_TIMEOUT', '1800')),
+    max_total_tokens=int(os.getenv('CHAT_SESSION_MAX_TOKENS', '2000000')),
+    # 未設定ならチャットボットのモデルのコンテキスト長から計算（context_builder の作成後に設定）
+    context_limit=int(os.getenv('CHAT_SESSION_CONTEXT_LIMIT', '0'))
+)
+
+# レイテンシ計測（REQUEST_LOG=1 でリクエストごとの計測結果をログ出力）
+metrics = Metrics(request_log=os.getenv('REQUEST_LOG') == '1')
+
+# 生成リクエストの同時実行数と待ち行列の制限（超えた分は429/503ですぐに返す）
+generation_scheduler = GenerationScheduler(
+    workers=int(os.getenv('OLLAMA_WORKERS', '1')),
+    max_queue=int(os.getenv('OLLAMA_QUEUE_SIZE', '8')),
+    queue_timeout=float(os.getenv('OLLAMA_QUEUE_TIMEOUT', '120'))
+)
+
+# Ollamaの停止を検知したときの動作（停止中はタイムアウトを待たずにデモ応答を返す）
+ollama_options = {
+    'model_cache_ttl': float(os.getenv('OLLAMA_MODEL_CACHE_TTL', '60')),
+    'failure_threshold': int(os.getenv('OLLAMA_FAILURE_THRESHOLD', '3')),
+    'retry_interval': float(os.getenv('OLLAMA_RETRY_INTERVAL', '30'))
+}
+# 複数のOllamaサーバーへの振り分け（未設定なら OLLAMA_API_URL の1台のみ）
+ollama_options.update({
+    'backends': parse_backends(os.getenv('OLLAMA_BACKENDS', ''), ollama_options['failure_threshold'],
+                               ollama_options['retry_interval']),
+    'strategy': os.getenv('OLLAMA_ROUTING', 'least_outstanding'),
+    'routes': json.loads(os.getenv('OLLAMA_FUNCTION_ROUTES') or '{}'),
+    'sessions': chat_sessions
+})
+# 死活確認の間隔（秒、0で無効）
+OLLAMA_HEALTH_INTERVAL = float(os.getenv('OLLAMA_HEALTH_INTERVAL', '10'))
+
+def _keep_alive(value):
+    """OLLAMA_KEEP_ALIVE の値（数値なら秒数、それ以外は "30m" などの期間の文字列。未設定ならNone）"""
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+# 機能タイプごとのプロンプトと生成オプション（OLLAMA_FUNCTION_OPTIONS で num_predict / temperature / num_ctx を上書き）
+prompt_registry = PromptRegistry(options=json.loads(os.getenv('OLLAMA_FUNCTION_OPTIONS') or '{}'))
+ollama_options.update({
+    'prompts': prompt_registry,
+    'keep_alive': _keep_alive(os.getenv('OLLAMA_KEEP_ALIVE')),
+    # 異常検知の前処理（数値の時系列から異常の候補を絞り込み、要約だけをモデルに渡す）
+    'sensor_analyzer': SensorAnalyzer(
+        window=int(os.getenv('SENSOR_WINDOW', '30')),
+        z_threshold=float(os.getenv('SENSOR_Z_THRESHOLD', '4.0'))
+    )
+})
+# 起動時にモデルを読み込んでおくか、と読み込み直す間隔（秒、0なら起動時のみ）
+OLLAMA_WARMUP = os.getenv('OLLAMA_WARMUP', '1') == '1'
+OLLAMA_WARMUP_INTERVAL = float(os.getenv('OLLAMA_WARMUP_INTERVAL', '0'))
+
 # Ollamaクライアントの初期化
 if IS_VERCEL:
     # Vercel環境: 外部Ollamaサーバーを使用
     ollama_api_url = os.getenv('OLLAMA_API_URL', 'http://localhost:11434')
-    ollama_client = OllamaClient(None, api_url=ollama_api_url)
+    ollama_client = OllamaClient(None, api_url=ollama_api_url, cache=response_cache, metrics=metrics,
+                                 scheduler=generation_scheduler, **ollama_options)
     print(f"Vercel環境: Ollama API URL = {ollama_api_url}")
 else:
     # ローカル環境
     ollama_path = r"C:\Users\e9uch\AppData\Local\Programs\Ollama\ollama.exe"
-    ollama_client = OllamaClient(ollama_path)
+    # OLLAMA_API_URLを設定すると別のポート・ホストのOllama（ベンチマーク用のスタブなど）を使用する
+    ollama_client = OllamaClient(ollama_path, api_url=os.getenv('OLLAMA_API_URL'), cache=response_cache,
+                                 metrics=metrics, scheduler=generation_scheduler, **ollama_options)
     print("ローカル環境: ローカルのOllamaを使用")
 
-# ドキュメント検索の初期化
-docs_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'docs')
-document_search = DocumentSearch(docs_dir)
+# 検索方式（keyword / semantic / hybrid）。semantic・hybridはOllamaの埋め込みモデルを使用する
+search_mode = os.getenv('SEARCH_MODE', 'keyword')
+ollama_client.embedding_model = os.getenv('EMBEDDING_MODEL', ollama_client.embedding_model)
+# 埋め込みベクトルの保存先（Vercel環境ではファイルに書き込めないためメモリのみ）
+vector_dir = None if IS_VERCEL else os.getenv(
+    'VECTOR_INDEX_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'index'))
+# 検索インデックスのスナップショット（build_index.py で事前に作成できる。Vercel環境では読み込みのみ）
+search_index_path = os.getenv(
+    'SEARCH_INDEX_PATH', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'index', 'search-index.bin'))
+# ドキュメントの読み込み・インデックス作成に使うプロセス数（0ならCPUのコア数）
+index_workers = int(os.getenv('INDEX_WORKERS', '1')) or default_workers()
+
+# ドキュメント検索の初期化（読み込みは起動処理でバックグラウンド実行）
+docs_dir = os.getenv('DOCS_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'docs'))
+document_search = DocumentSearch(
+    docs_dir,
+    autoload=False,
+    mode=search_mode,
+    embedder=ollama_client if search_mode != 'keyword' else None,
+    vector_dir=vector_dir,
+    index_path=search_index_path,
+    save_index=not IS_VERCEL,
+    workers=index_workers,
+    cache_size=int(os.getenv('SEARCH_CACHE_SIZE', '256'))
+)
+
+def _invalidate_response_cache(changes):
+    """更新・削除されたドキュメントを参照していた応答をキャッシュから削除"""
+    response_cache.invalidate_tags(changes['updated'] + changes['removed'])
+
+document_search.add_listener(_invalidate_response_cache)
+
+# ドキュメントの自動再読み込み（DOCS_WATCH_INTERVAL秒ごとに変更を確認、0または未設定で無効）
+docs_watch_interval = float(os.getenv('DOCS_WATCH_INTERVAL', '0'))
+
+# RAGプロンプトのコンテキスト作成（CONTEXT_TOKEN_BUDGETでトークン予算を指定、未設定ならモデルから計算）
+context_builder = ContextBuilder(
+    model=ollama_client.router.model_for('chatbot', ollama_client.model),
+    budget_tokens=int(os.getenv('CONTEXT_TOKEN_BUDGET', '0')) or None,
+    num_predict=prompt_registry.options('chatbot').get('num_predict', 500),
+    context_tokens=prompt_registry.options('chatbot').get('num_ctx')
+)
+# 会話で引き継ぐトークン数の上限（続きの質問・回答と新しい参照箇所が num_ctx に収まるようにする）
+if not chat_sessions.context_limit:
+    chat_sessions.context_limit = context_builder.session_context_limit
+# コンテキストの候補として検索する件数（実際に使う量はトークン予算で決まる）
+CONTEXT_SEARCH_RESULTS = 6
+
+# 一括処理で同時に処理する件数と、1回で受け付ける最大件数
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '2'))
+BATCH_MAX_RECORDS = int(os.getenv('BATCH_MAX_RECORDS', '1000'))
 
-# 起動時にモデルを確認・ダウンロード（ローカル環境のみ）
-if not IS_VERCEL:
+# 起動処理の進捗（/api/ready で確認できる）
+readiness = Readiness()
+
+metrics.register_gauge('assistant_documents', 'Number of indexed documents',
+                       lambda: len(document_search.documents_cache))
+metrics.register_gauge('assistant_ready', 'Whether startup tasks have finished', lambda: int(readiness.ready))
+metrics.register_gauge('assistant_response_cache_entries', 'Entries in the response cache',
+                       lambda: response_cache.stats()['entries'])
+metrics.register_counter('assistant_response_cache_hits_total', 'Response cache hits', lambda: response_cache.hits)
+metrics.register_counter('assistant_response_cache_misses_total', 'Response cache misses',
+                         lambda: response_cache.misses)
+metrics.register_counter('assistant_search_cache_hits_total', 'Search result cache hits',
+                         lambda: document_search.cache.hits)
+metrics.register_counter('assistant_search_cache_misses_total', 'Search result cache misses',
+                         lambda: document_search.cache.misses)
+metrics.register_gauge('assistant_chat_sessions', 'Chat sessions holding conversation context',
+                       lambda: chat_sessions.stats()['sessions'])
+metrics.register_gauge('assistant_ollama_available', 'Whether Ollama is considered reachable',
+                       lambda: int(ollama_client.health()['available']))
+metrics.register_gauge('assistant_generation_running', 'Generation requests sent to Ollama',
+                       lambda: generation_scheduler.stats()['running'])
+metrics.register_gauge('assistant_generation_waiting', 'Generation requests waiting in the queue',
+                       lambda: generation_scheduler.stats()['waiting'])
+metrics.register_counter('assistant_generation_rejected_total',
+                         'Generation requests rejected because the queue was full',
+                         lambda: generation_scheduler.rejected)
+
+# 起動処理中に呼ばれたリクエストへ返す再試行までの秒数
+WARMING_UP_RETRY_AFTER = 5
+
+def _load_documents(report):
+    """起動処理: ドキュメントを読み込んでインデックスを構築"""
+    def progress(done, total):
+        report(f"{done}/{total} ファイル", done / total if total else 1.0)
+    
+    document_search.reload(progress=progress)
+    report(f"{len(document_search.documents_cache)} 件のドキュメントを読み込みました")
+    if docs_watch_interval > 0 and not IS_VERCEL:
+        document_search.start_watcher(docs_watch_interval)
+
+def _verify_model(report):
+    """起動処理: モデルを確認・ダウンロード（ローカル環境のみ）"""
     print("Ollamaモデルを確認しています...")
     print("※ モデルは一度ダウンロードされれば、次回以降は自動的に使用されます。")
     print("※ すべての処理はローカルで完結し、データは外部に送信されません。\n")
-    try:
-        ollama_client.ensure_model()
-    except Exception as e:
-        print(f"モデルの確認中にエラーが発生しました: {e}")
-        print("アプリケーションは続行しますが、モデルが利用できない可能性があります。")
-else:
-    print("Vercel環境: 外部Ollamaサーバーを使用します")
+    report("モデルを確認しています")
+    if not ollama_client.ensure_model():
+        # アプリケーションは続行する（デモ応答にフォールバック）
+        raise RuntimeError("モデルが利用できません。デモ応答で動作します。")
+    if document_search.embedder is not None and not ollama_client.model_exists(ollama_client.embedding_model):
+        report(f"埋め込みモデル '{ollama_client.embedding_model}' をダウンロードしています")
+        if ollama_client.download_model(ollama_client.embedding_model):
+            # ドキュメントの読み込み時に作れなかった埋め込みを作り直す
+            document_search.reload()
+    if OLLAMA_WARMUP:
+        # 最初のリクエストでモデルの読み込みを待たないよう、メモリに読み込んでおく（失敗しても続行する）
+        report("モデルを読み込んでいます")
+        ollama_client.warm_up()
+    report(f"モデル '{ollama_client.model}' を利用できます")
+
+def _warm_up_models(report):
+    """起動処理: 外部のOllamaサーバーでモデルをメモリに読み込み、最初のリクエストで読み込みを待たないようにする"""
+    report("モデルを読み込んでいます")
+    loaded = ollama_client.warm_up()
+    if not loaded:
+        # アプリケーションは続行する（最初のリクエストでモデルが読み込まれる）
+        raise RuntimeError("モデルを読み込めませんでした")
+    report(f"{loaded} 件のモデルを読み込みました")
+
+def start_background_tasks():
+    """起動処理をバックグラウンドで開始（既に開始済みの処理は何もしない）"""
+    readiness.start('documents', _load_documents)
+    if OLLAMA_HEALTH_INTERVAL > 0:
+        ollama_client.start_health_monitor(OLLAMA_HEALTH_INTERVAL)
+    if OLLAMA_WARMUP_INTERVAL > 0:
+        ollama_client.start_warmer(OLLAMA_WARMUP_INTERVAL)
+    if IS_VERCEL:
+        print("Vercel環境: 外部Ollamaサーバーを使用します")
+        readiness.mark_ready('model', '外部Ollamaサーバーを使用')
+        if OLLAMA_WARMUP:
+            readiness.start('warmup', _warm_up_models)
+    else:
+        readiness.start('model', _verify_model)
+
+def _warming_up_response(function_type):
+    """
+    必要なコンポーネントが準備中なら503応答を返す（準備完了ならNone）
+    
+    リクエストを待たせず、すぐに「準備中」と返してクライアントに再試行してもらう
+    """
+    pending = []
+    if function_type == 'chatbot' and readiness.is_pending('documents'):
+        pending.append('documents')
+    if readiness.is_pending('model'):
+        pending.append('model')
+    if not pending:
+        return None
+    
+    response = jsonify({
+        'success': False,
+        'warming_up': True,
+        'error': '起動処理中です。しばらくしてから再度お試しください。',
+        'pending': pending,
+        'status': readiness.status()
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(WARMING_UP_RETRY_AFTER)
+    return response
+
+def _queue_full_response(error):
+    """
+    待ち行列が一杯なら429、待ち時間の上限を超えたなら503を返す
+    
+    どちらもRetry-Afterで再試行までの目安を伝える
+    """
+    response = jsonify({
+        'success': False,
+        'queue_full': True,
+        'error': str(error),
+        'retry_after': error.retry_after,
+        'queue': generation_scheduler.stats()
+    })
+    response.status_code = 503 if error.timed_out else 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+bp = Blueprint('main', __name__)
+
+# 静的ファイルのルートを明示的に追加（Vercel対応）
+@bp.route('/static/<path:filename>')
+def static_files(filename):
+    """静的ファイルを配信"""
+    from flask import send_from_directory
+    return send_from_directory(static_dir, filename)
 
-@app.route('/')
+@bp.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/api/chat', methods=['POST'])
+def _prepare_chat(message, function_type, session_id=None):
+    """
+    ドキュメント検索を行い、モデルに渡す入力と参照元を作成
+    
+    会話の続きでは、引き継ぐトークン数をトークン予算から差し引き、送信済みの参照箇所は送り直さない
+    
+    Returns:
+        (モデルへの入力, 参照元のリスト, コンテキストのトークン数, 会話の記録に使う情報)
+    """
+    # ドキュメント検索（チャットボット機能の場合）
+    sources = []
+    turn = None
+    if function_type == 'chatbot':
+        # 質問に関連するドキュメントを検索
+        with metrics.span('search'):
+            search_results = document_search.search(message, max_results=CONTEXT_SEARCH_RESULTS)
+        
+        history = chat_sessions.peek(session_id, context_builder.model) if session_id else None
+        
+        # 関連性の高い部分をトークン予算内に詰めてコンテキストを作成
+        with metrics.span('prompt_build'):
+            context = context_builder.build(message, search_results, document_search,
+                                            history_tokens=history['tokens'] if history else 0,
+                                            sent=history['sources'] if history else None)
+        if session_id:
+            turn = (history['turns'] if history else 0, context['sources'])
+        
+        for used in context['sources']:
+            content = used['content']
+            if len(content) > 500:
+                # 長い場合は最初の部分と最後の部分を表示
+                sources.append({
+                    'title': used['title'],
+                    'content': content[:400] + '\n\n... (中略) ...\n\n' + content[-200:],
+                    'line': used['line'],
+                    'full_content': content  # 完全な内容も保持
+                })
+            else:
+                sources.append({
+                    'title': used['title'],
+                    'content': content,
+                    'line': used['line']
+                })
+        
+        # 検索結果をコンテキストに含めて質問を拡張
+        if sources:
+            trace = metrics.current_trace()
+            if trace is not None:
+                trace.details['context_tokens'] = context['tokens']
+            enhanced_message = f"{context['text']}質問: {message}\n\n上記のドキュメントの内容に基づいて、質問に日本語で回答してください。ドキュメントに記載されていない内容については推測せず、「ドキュメントに記載がありません」と答えてください。"
+            return enhanced_message, sources, context['tokens'], turn
+    
+    return message, sources, 0, turn
+
+def _record_session_sources(session_id, turn):
+    """応答の context に含まれた参照箇所を会話セッションに記録（続きの質問で送り直さないため）"""
+    if turn is not None:
+        chat_sessions.record_sources(session_id, *turn)
+
+def _source_titles(sources):
+    """参照元のドキュメント名（重複なし）"""
+    return list(dict.fromkeys(source['title'] for source in sources))
+
+@bp.route('/api/chat', methods=['POST'])
 def chat():
     """チャットボットAPI"""
     data = request.json
     message = data.get('message', '')
     function_type = data.get('function_type', 'chatbot')
+    session_id = data.get('session_id')
     
-    try:
-        # ドキュメント検索（チャットボット機能の場合）
-        sources = []
-        if function_type == 'chatbot':
-            # 質問に関連するドキュメントを検索
-            search_results = document_search.search(message, max_results=3)
-            sources = []
-            for result in search_results:
-                # ファイル全体が返された場合はそのまま、部分の場合は要約
-                content = result['content']
-                if len(content) > 500:
-                    # 長い場合は最初の部分と最後の部分を表示
-                    sources.append({
-                        'title': result['title'],
-                        'content': content[:400] + '\n\n... (中略) ...\n\n' + content[-200:],
-                        'line': result.get('line', 0),
-                        'full_content': content  # 完全な内容も保持
-                    })
-                else:
-                    sources.append({
-                        'title': result['title'],
-                        'content': content,
-                        'line': result.get('line', 0)
-                    })
+    with metrics.trace(function_type, 'chat') as trace:
+        warming_up = _warming_up_response(function_type)
+        if warming_up is not None:
+            trace.status = 'warming_up'
+            return warming_up
+        
+        try:
+            prompt_input, sources, context_tokens, turn = _prepare_chat(message, function_type, session_id)
             
-            # 検索結果をコンテキストに含めて質問を拡張
-            if sources:
-                context = "以下のドキュメントの内容を参照してください:\n\n"
-                for i, source in enumerate(sources, 1):
-                    context += f"【{source['title']}】\n{source['content']}\n\n"
-                enhanced_message = f"{context}質問: {message}\n\n上記のドキュメントの内容に基づいて、質問に日本語で回答してください。ドキュメントに記載されていない内容については推測せず、「ドキュメントに記載がありません」と答えてください。"
+            # 機能タイプに応じて処理を分岐
+            if function_type == 'chatbot':
+                response = ollama_client.chat(prompt_input, cache_tags=_source_titles(sources),
+                                              session_id=session_id)
+                _record_session_sources(session_id, turn)
+            elif function_type == 'daily_report':
+                response = ollama_client.generate_daily_report(prompt_input)
+            elif function_type == 'anomaly_detection':
+                response = ollama_client.detect_anomaly(prompt_input)
+            elif function_type == 'production_plan':
+                response = ollama_client.generate_production_plan(prompt_input)
             else:
-                enhanced_message = message
-        else:
-            enhanced_message = message
-        
-        # 機能タイプに応じて処理を分岐
-        if function_type == 'chatbot':
-            response = ollama_client.chat(enhanced_message if sources else message)
-        elif function_type == 'daily_report':
-            response = ollama_client.generate_daily_report(message)
-        elif function_type == 'anomaly_detection':
-            response = ollama_client.detect_anomaly(message)
-        elif function_type == 'production_plan':
-            response = ollama_client.generate_production_plan(message)
-        else:
-            response = ollama_client.chat(message)
-        
-        return jsonify({
-            'success': True,
-            'response': response,
-            'sources': sources
-        })
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+                response = ollama_client.chat(prompt_input)
+            
+            return jsonify({
+                'success': True,
+                'response': response,
+                'sources': sources,
+                'context_tokens': context_tokens
+            })
+        except QueueFullError as e:
+            trace.status = 'rejected'
+            return _queue_full_response(e)
+        except Exception as e:
+            trace.status = 'error'
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+
+def _sse(event, data):
+    """Server-Sent Events形式の1イベントを作成"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@bp.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    チャットボットAPI（ストリーミング版）
+    
+    Server-Sent Eventsで sources → token（複数回） → done の順に送信する。
+    エラー時は error イベントを送信して終了する。
+    """
+    data = request.json
+    message = data.get('message', '')
+    function_type = data.get('function_type', 'chatbot')
+    # 会話を引き継ぐのはチャットボットのみ（日報生成などは1回ごとに独立した処理）
+    session_id = data.get('session_id') if function_type == 'chatbot' else None
+    
+    warming_up = _warming_up_response(function_type)
+    if warming_up is not None:
+        with metrics.trace(function_type, 'chat_stream') as trace:
+            trace.status = 'warming_up'
+        return warming_up
+    
+    # 待ち行列が一杯なら、ストリームを開始する前に429を返す
+    if generation_scheduler.is_full():
+        with metrics.trace(function_type, 'chat_stream') as trace:
+            trace.status = 'rejected'
+        return _queue_full_response(QueueFullError(
+            'リクエストが混み合っています。しばらくしてから再度お試しください。',
+            generation_scheduler.retry_after()))
+    
+    def generate():
+        # レスポンスの送信中に処理が進むため、計測はジェネレータの中で行う
+        with metrics.trace(function_type, 'chat_stream') as trace:
+            try:
+                prompt_input, sources, context_tokens, turn = _prepare_chat(message, function_type, session_id)
+                # 参照元を先に送信し、回答の生成を待たずに表示できるようにする
+                yield _sse('sources', {'sources': sources, 'context_tokens': context_tokens})
+                for text in ollama_client.stream(function_type, prompt_input, cache_tags=_source_titles(sources),
+                                                 session_id=session_id):
+                    yield _sse('token', {'text': text})
+                _record_session_sources(session_id, turn)
+                yield _sse('done', {'success': True})
+            except QueueFullError as e:
+                trace.status = 'rejected'
+                yield _sse('error', {'success': False, 'error': str(e), 'retry_after': e.retry_after})
+            except Exception as e:
+                trace.status = 'error'
+                yield _sse('error', {'success': False, 'error': str(e)})
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # プロキシによるバッファリングを無効化
+    })
+
+def _batch_request():
+    """
+    一括処理のリクエストから機能タイプとレコードを取り出す
+    
+    JSON（{"function_type": ..., "records": [...]}）またはファイルのアップロード
+    （multipart/form-dataの file、JSON LinesまたはCSV）に対応
+    """
+    upload = request.files.get('file')
+    if upload is not None:
+        function_type = request.form.get('function_type', 'daily_report')
+        try:
+            text = upload.read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise BatchError('ファイルはUTF-8で保存してください')
+        records = parse_records(text, upload.filename or '')
+    else:
+        data = request.get_json(silent=True) or {}
+        function_type = data.get('function_type', 'daily_report')
+        records = data.get('records')
+        if not isinstance(records, list):
+            raise BatchError('records にレコードのリストを指定してください')
+    
+    if function_type not in BATCH_FUNCTION_TYPES:
+        raise BatchError(f"function_type は {', '.join(BATCH_FUNCTION_TYPES)} のいずれかを指定してください")
+    if not records:
+        raise BatchError('レコードがありません')
+    if len(records) > BATCH_MAX_RECORDS:
+        raise BatchError(f"一度に処理できるのは {BATCH_MAX_RECORDS} 件までです")
+    return function_type, records
 
-@app.route('/api/documents', methods=['GET'])
+@bp.route('/api/batch', methods=['POST'])
+def batch():
+    """
+    一括処理API（日報生成・異常検知・生産計画）
+    
+    レコードを並行して処理し、終わった順にNDJSON（1行に1つのJSON）で返す。
+    start → result（レコードごと） → done の順に送信する。失敗したレコードは
+    success=False の result として返し、残りの処理は続ける。
+    """
+    try:
+        function_type, records = _batch_request()
+    except BatchError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    warming_up = _warming_up_response(function_type)
+    if warming_up is not None:
+        return warming_up
+    
+    def process(input_data):
+        with metrics.trace(function_type, 'batch'):
+            return ollama_client.generate_batch_item(function_type, input_data)
+    
+    def generate():
+        started_at = time.perf_counter()
+        succeeded = 0
+        yield json.dumps({'type': 'start', 'function_type': function_type, 'total': len(records)},
+                         ensure_ascii=False) + '\n'
+        for result in run_batch(records, process, concurrency=BATCH_CONCURRENCY):
+            if result['success']:
+                succeeded += 1
+            yield json.dumps({'type': 'result', **result}, ensure_ascii=False) + '\n'
+        yield json.dumps({
+            'type': 'done',
+            'total': len(records),
+            'succeeded': succeeded,
+            'failed': len(records) - succeeded,
+            'elapsed': round(time.perf_counter() - started_at, 3)
+        }, ensure_ascii=False) + '\n'
+    
+    return Response(generate(), mimetype='application/x-ndjson', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@bp.route('/api/ready', methods=['GET'])
+def ready():
+    """起動処理の進捗（すべて完了していれば200、処理中なら503）"""
+    is_ready = readiness.ready
+    return jsonify({
+        'ready': is_ready,
+        'components': readiness.status()
+    }), 200 if is_ready else 503
+
+@bp.route('/api/documents', methods=['GET'])
 def get_documents():
     """利用可能なドキュメント一覧を取得"""
-    docs_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'docs')
     documents = []
     
     if os.path.exists(docs_dir):
@@ -140,23 +565,62 @@ def get_documents():
     
     return jsonify({'documents': documents})
 
-@app.route('/api/documents/reload', methods=['POST'])
+@bp.route('/api/documents/reload', methods=['POST'])
 def reload_documents():
     """ドキュメントを再読み込み"""
     try:
-        document_search.reload()
-        return jsonify({'success': True, 'message': 'ドキュメントを再読み込みしました'})
+        changes = document_search.reload()
+        return jsonify({
+            'success': True,
+            'message': 'ドキュメントを再読み込みしました',
+            'changes': changes
+        })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/documents/<filename>', methods=['GET'])
+@bp.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """レイテンシなどの計測値（Prometheusのテキスト形式）"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@bp.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """応答キャッシュの統計情報（ヒット数・ミス数など）"""
+    return jsonify(response_cache.stats())
+
+@bp.route('/api/search/cache/stats', methods=['GET'])
+def search_cache_stats():
+    """検索結果キャッシュの統計情報（ヒット数・ミス数など）"""
+    return jsonify(document_search.cache.stats())
+
+@bp.route('/api/chat/sessions/stats', methods=['GET'])
+def chat_sessions_stats():
+    """会話セッションの統計情報（セッション数・保持しているトークン数など）"""
+    return jsonify(chat_sessions.stats())
+
+@bp.route('/api/chat/sessions/<session_id>', methods=['DELETE'])
+def delete_chat_session(session_id):
+    """会話セッションを破棄（次の質問から新しい会話として扱う）"""
+    return jsonify({'success': True, 'deleted': chat_sessions.discard(session_id)})
+
+@bp.route('/api/ollama/health', methods=['GET'])
+def ollama_health():
+    """Ollamaの接続状態（停止を検知してデモ応答に切り替えているか）とモデル一覧のキャッシュ"""
+    return jsonify(ollama_client.health())
+
+@bp.route('/api/queue/stats', methods=['GET'])
+def queue_stats():
+    """生成リクエストの実行数・待ち数などの統計情報"""
+    return jsonify(generation_scheduler.stats())
+
+@bp.route('/api/documents/<filename>', methods=['GET'])
 def get_document(filename):
     """ドキュメントの内容を取得"""
     import urllib.parse
     
     # セキュリティ: パストラバーサル攻撃を防ぐ
     filename = os.path.basename(filename)
-    current_docs_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'docs')
+    current_docs_dir = docs_dir
     filepath = os.path.join(current_docs_dir, filename)
     
     # 親ディレクトリへの移動を防ぐ
@@ -166,6 +630,17 @@ def get_document(filename):
     if not os.path.exists(filepath):
         return jsonify({'error': 'File not found'}), 404
     
+    if filename.endswith('.pdf'):
+        # PDFは取り込み時に抽出したテキストを返す
+        doc = document_search.documents_cache.get(filename)
+        if doc is None:
+            return jsonify({'error': 'Unsupported file type'}), 400
+        return jsonify({
+            'success': True,
+            'filename': filename,
+            'content': doc.text
+        })
+    
     if not filename.endswith(('.txt', '.md')):
         return jsonify({'error': 'Unsupported file type'}), 400
     
@@ -181,6 +656,23 @@ def get_document(filename):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def create_app(start_background=True):
+    """
+    Flaskアプリを作成
+    
+    Args:
+        start_background: Trueならドキュメントの読み込みとモデルの確認をバックグラウンドで開始する。
+            リクエストの受け付けはこれらの完了を待たずに始まる。
+    """
+    app = Flask(__name__, template_folder=template_dir, static_folder=static_dir, static_url_path='/static')
+    CORS(app)
+    app.register_blueprint(bp)
+    if start_background:
+        start_background_tasks()
+    return app
+
+app = create_app()
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
 
@@ -0,0 +1,122 @@
+"""
+一括処理
+複数のレコード（ライン・設備ごとの記録など）を並行して処理し、終わったものから結果を返す
+"""
+import csv
+import io
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterator, List
+
+from generation_scheduler import QueueFullError
+
+# 一括処理できる機能タイプ
+BATCH_FUNCTION_TYPES = ('daily_report', 'anomaly_detection', 'production_plan')
+# 待ち行列が一杯だった場合に再試行する回数と、1回あたりの最大待ち時間（秒）
+QUEUE_FULL_RETRIES = 5
+MAX_RETRY_WAIT = 30
+
+class BatchError(ValueError):
+    """入力の形式が正しくない"""
+
+def parse_records(text: str, filename: str = '') -> List:
+    """
+    アップロードされたファイルの内容をレコードのリストに変換
+    
+    Args:
+        text: ファイルの内容
+        filename: ファイル名（拡張子で形式を判定。.csv ならCSV、それ以外はJSON Lines）
+    
+    Returns:
+        レコード（文字列または辞書）のリスト
+    """
+    if filename.lower().endswith('.csv'):
+        reader = csv.DictReader(io.StringIO(text))
+        return [dict(row) for row in reader if any((value or '').strip() for value in row.values())]
+    
+    records = []
+    for line_no, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError as e:
+            raise BatchError(f"{line_no}行目のJSONが正しくありません: {e}")
+    return records
+
+def record_id(record, index: int):
+    """レコードのID（'id' があればその値、なければ0始まりの番号）"""
+    if isinstance(record, dict) and record.get('id') not in (None, ''):
+        return record['id']
+    return index
+
+def record_input(record) -> str:
+    """
+    レコードをモデルへの入力に変換
+    
+    文字列はそのまま、辞書は 'input' があればその値、なければ「項目: 値」の行にする
+    """
+    if isinstance(record, str):
+        return record
+    if isinstance(record, dict):
+        if isinstance(record.get('input'), str):
+            return record['input']
+        return '\n'.join(f"{key}: {value}" for key, value in record.items() if key != 'id')
+    return json.dumps(record, ensure_ascii=False)
+
+def _process_with_retry(process: Callable[[str], str], input_data: str) -> str:
+    """待ち行列が一杯の場合はRetry-Afterの分だけ待って再試行する"""
+    for attempt in range(QUEUE_FULL_RETRIES + 1):
+        try:
+            return process(input_data)
+        except QueueFullError as e:
+            if attempt == QUEUE_FULL_RETRIES:
+                raise
+            time.sleep(min(e.retry_after, MAX_RETRY_WAIT))
+
+def run_batch(records: List, process: Callable[[str], str], concurrency: int = 2) -> Iterator[Dict]:
+    """
+    レコードを並行して処理し、終わった順に結果を返すジェネレータ
+    
+    1件の失敗で全体を止めず、その件だけ success=False として返す。
+    ジェネレータが途中で閉じられた（クライアントが切断した）場合は未開始の処理を取り消す。
+    
+    Args:
+        records: レコードのリスト
+        process: 入力を受け取って生成結果を返す関数
+        concurrency: 同時に処理する件数
+    
+    Yields:
+        {'index', 'id', 'success', 'response' または 'error', 'elapsed', 'completed', 'total'}
+    """
+    total = len(records)
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='batch')
+    try:
+        pending = {}
+        for index, record in enumerate(records):
+            future = executor.submit(_process_with_retry, process, record_input(record))
+            pending[future] = (index, time.perf_counter())
+        
+        completed = 0
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, submitted_at = pending.pop(future)
+                completed += 1
+                result = {
+                    'index': index,
+                    'id': record_id(records[index], index),
+                    'elapsed': round(time.perf_counter() - submitted_at, 3),
+                    'completed': completed,
+                    'total': total
+                }
+                try:
+                    result['success'] = True
+                    result['response'] = future.result()
+                except Exception as e:
+                    result['success'] = False
+                    result['error'] = str(e)
+                yield result
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
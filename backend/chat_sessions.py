@@ -0,0 +1,192 @@
+"""
+チャットボットの会話セッション
+Ollamaが返す context（それまでの会話のトークン列）をセッションごとに保持し、
+2回目以降の質問では新しい部分だけを評価させる
+"""
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# セッションIDの最大長（クライアントが生成したIDをそのまま使うため長さを制限する）
+MAX_SESSION_ID_LENGTH = 128
+
+class ChatSession:
+    """1つの会話（context はOllamaのトークン列）"""
+    
+    def __init__(self, session_id: str, model: str):
+        self.id = session_id
+        self.model = model
+        # 符号付き32ビット整数の配列（Pythonのintのリストより小さい）
+        self.context = array('i')
+        # 直前に応答したサーバー（同じサーバーに送るとOllama側のキャッシュも使える）
+        self.backend = None
+        # context に含まれている参照箇所 {ドキュメント名: [(開始行, 終了行)]}（続きの質問で送り直さない）
+        self.sources = {}
+        self.turns = 0
+        self.last_used = time.monotonic()
+
+class ChatSessionStore:
+    """
+    会話セッションの保持
+    
+    一定時間使われなかったセッションは参照時に破棄し、セッション数・保持するトークン数の合計が
+    上限を超えたら最も古いセッションから破棄する。1つの会話が context_limit トークンを超えたら、
+    次の質問から会話をやり直す（モデルのコンテキスト長を超えると先頭が切り捨てられるため）。
+    """
+    
+    def __init__(self, max_sessions: int = 1000, idle_timeout: float = 1800,
+                 max_total_tokens: int = 2000000, context_limit: int = 2048):
+        """
+        Args:
+            max_sessions: 保持する最大セッション数（0ならセッションを使わない）
+            idle_timeout: 最後の質問からセッションを破棄するまでの時間（秒）
+            max_total_tokens: すべてのセッションで保持するトークン数の上限（1トークン4バイト）
+            context_limit: 1つの会話で引き継ぐトークン数の上限（モデルのコンテキスト長の目安）
+        """
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_total_tokens = max_total_tokens
+        self.context_limit = context_limit
+        # {session_id: ChatSession}（最後に使った順）
+        self._sessions = OrderedDict()
+        self._total_tokens = 0
+        self._lock = threading.Lock()
+        self.reused = 0
+        self.expired = 0
+        self.evicted = 0
+        self.resets = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.max_sessions > 0
+    
+    def get(self, session_id: Optional[str], model: str) -> Optional[ChatSession]:
+        """
+        セッションを取得（なければ作成）
+        
+        モデルが変わった場合はトークン列を引き継げないため、会話をやり直す
+        
+        Returns:
+            セッション（セッションを使わない場合・IDが不正な場合はNone）
+        """
+        if not self.enabled or not isinstance(session_id, str) or \
+                not session_id or len(session_id) > MAX_SESSION_ID_LENGTH:
+            return None
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is None or session.model != model:
+                if session is not None:
+                    self._total_tokens -= len(session.context)
+                session = ChatSession(session_id, model)
+                self._sessions[session_id] = session
+            elif session.context:
+                self.reused += 1
+            session.last_used = now
+            self._sessions.move_to_end(session_id)
+            self._evict()
+            return session
+    
+    def peek(self, session_id: Optional[str], model: str) -> Optional[Dict]:
+        """
+        続きの質問のコンテキストを作るための情報（セッションは作成・更新しない）
+        
+        Returns:
+            {'tokens': 引き継ぐトークン数, 'sources': 送信済みの参照箇所, 'turns': これまでの回数}
+            （セッションがない・期限切れ・モデルが変わった場合はNone）
+        """
+        if not self.enabled or not isinstance(session_id, str):
+            return None
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.model != model or \
+                    time.monotonic() - session.last_used >= self.idle_timeout:
+                return None
+            return {
+                'tokens': len(session.context),
+                'sources': {title: list(ranges) for title, ranges in session.sources.items()},
+                'turns': session.turns
+            }
+    
+    def record_sources(self, session_id: Optional[str], turns: int, sources: List[Dict]):
+        """
+        応答の context に含まれた参照箇所を記録
+        
+        Args:
+            turns: 質問する前の回数（peek() の 'turns'、セッションがなかった場合は0）
+            sources: ContextBuilder.build() の 'sources'
+        """
+        if not isinstance(session_id, str):
+            return
+        with self._lock:
+            session = self._sessions.get(session_id)
+            # 応答が context として保存されなかった場合（キャッシュ・デモ応答・やり直し）は記録しない
+            if session is None or session.turns != turns + 1 or not session.context:
+                return
+            for source in sources:
+                session.sources.setdefault(source['title'], []).append((source['start_line'], source['end_line']))
+    
+    def update(self, session: ChatSession, context: Optional[List[int]], backend: Optional[str] = None):
+        """応答で返された context を保存（上限を超えた場合は次の質問から会話をやり直す）"""
+        with self._lock:
+            if self._sessions.get(session.id) is not session:
+                # 応答を待っている間に破棄された
+                return
+            self._total_tokens -= len(session.context)
+            if context and len(context) <= self.context_limit:
+                session.context = array('i', context)
+            else:
+                if context:
+                    self.resets += 1
+                session.context = array('i')
+                session.sources = {}
+            self._total_tokens += len(session.context)
+            session.backend = backend
+            session.turns += 1
+            session.last_used = time.monotonic()
+            self._evict()
+    
+    def discard(self, session_id: str) -> bool:
+        """セッションを破棄（会話をやり直す）"""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                return False
+            self._total_tokens -= len(session.context)
+            return True
+    
+    def _expire(self, now: float):
+        """一定時間使われなかったセッションを破棄（ロック取得済みで呼び出す）"""
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used < self.idle_timeout:
+                break
+            self._sessions.popitem(last=False)
+            self._total_tokens -= len(session.context)
+            self.expired += 1
+    
+    def _evict(self):
+        """上限を超えた分を古い順に破棄（ロック取得済みで呼び出す）"""
+        while self._sessions and (len(self._sessions) > self.max_sessions or
+                                  self._total_tokens > self.max_total_tokens):
+            _, session = self._sessions.popitem(last=False)
+            self._total_tokens -= len(session.context)
+            self.evicted += 1
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'total_tokens': self._total_tokens,
+                'max_total_tokens': self.max_total_tokens,
+                'context_limit': self.context_limit,
+                'idle_timeout': self.idle_timeout,
+                'reused': self.reused,
+                'expired': self.expired,
+                'evicted': self.evicted,
+                'resets': self.resets
+            }
@@ -0,0 +1,235 @@
+"""
+RAGプロンプト用のコンテキスト作成
+検索結果から関連性の高い部分を選び、モデルのコンテキスト長に合わせたトークン数に収める
+"""
+import re
+from typing import Dict, List, Optional
+
+from document_search import extract_keywords
+
+# モデルごとのコンテキスト長（トークン数）
+MODEL_CONTEXT_TOKENS = {
+    'tinyllama': 2048,
+    'llama2': 4096,
+    'llama3': 8192,
+    'gemma': 8192,
+    'mistral': 8192,
+    'qwen2': 32768,
+}
+DEFAULT_CONTEXT_TOKENS = 2048
+
+# 日本語1文字あたりのトークン数の目安（語彙に日本語が少ないモデルは1文字が複数トークンになる）
+MODEL_CJK_TOKENS_PER_CHAR = {
+    'tinyllama': 2.0,
+    'llama2': 2.0,
+    'mistral': 1.5,
+}
+DEFAULT_CJK_TOKENS_PER_CHAR = 1.0
+# 英数字などは約4文字で1トークン
+OTHER_CHARS_PER_TOKEN = 4
+
+# システムプロンプト・指示文などコンテキスト以外に確保するトークン数
+PROMPT_OVERHEAD_TOKENS = 300
+# 途中で切り詰めてまで入れる価値がある最小のトークン数
+MIN_SNIPPET_TOKENS = 48
+# 会話の続きで新しい参照箇所に確保する最小のトークン数
+MIN_FOLLOWUP_TOKENS = 256
+
+_CJK_PATTERN = re.compile(r'[　-ヿ㐀-鿿豈-﫿＀-￯]')
+
+def _model_family(model: str) -> str:
+    """'tinyllama:latest' → 'tinyllama'"""
+    return (model or '').split(':')[0].lower()
+
+def estimate_tokens(text: str, model: Optional[str] = None) -> int:
+    """テキストのトークン数を見積もる（トークナイザーを使わない概算）"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(text) - cjk
+    ratio = MODEL_CJK_TOKENS_PER_CHAR.get(_model_family(model), DEFAULT_CJK_TOKENS_PER_CHAR)
+    return int(cjk * ratio + other / OTHER_CHARS_PER_TOKEN) + 1
+
+def context_window(model: Optional[str]) -> int:
+    """モデルのコンテキスト長"""
+    return MODEL_CONTEXT_TOKENS.get(_model_family(model), DEFAULT_CONTEXT_TOKENS)
+
+class ContextBuilder:
+    """検索結果をトークン予算内のコンテキストにまとめる"""
+    
+    def __init__(self, model: str = 'tinyllama', budget_tokens: Optional[int] = None, num_predict: int = 500,
+                 context_tokens: Optional[int] = None):
+        """
+        Args:
+            model: 使用するモデル（トークン数の見積もりとコンテキスト長に使用）
+            budget_tokens: コンテキストに使う最大トークン数（Noneならモデルのコンテキスト長から計算）
+            num_predict: 生成する最大トークン数（コンテキスト長から差し引く）
+            context_tokens: リクエストで指定するコンテキスト長（num_ctx。Noneならモデルの既定値）
+        """
+        self.model = model
+        self.num_predict = num_predict
+        self.context_tokens = context_tokens
+        self._budget_tokens = budget_tokens
+    
+    @property
+    def window(self) -> int:
+        """コンテキスト長"""
+        return self.context_tokens or context_window(self.model)
+    
+    @property
+    def budget_tokens(self) -> int:
+        if self._budget_tokens:
+            return self._budget_tokens
+        return max(0, self.window - self.num_predict - PROMPT_OVERHEAD_TOKENS)
+    
+    @property
+    def session_context_limit(self) -> int:
+        """会話で引き継ぐトークン数の上限（続きの質問と回答、新しい参照箇所の分を残す）"""
+        return max(0, self.window - self.num_predict - PROMPT_OVERHEAD_TOKENS - MIN_FOLLOWUP_TOKENS)
+    
+    def build(self, query: str, results: List[Dict], document_search, history_tokens: int = 0,
+              sent: Optional[Dict[str, List[tuple]]] = None) -> Dict:
+        """
+        検索結果からコンテキストを作成
+        
+        Args:
+            query: 質問
+            results: DocumentSearch.search() の結果
+            document_search: 行の取得に使うDocumentSearch
+            history_tokens: 会話の続きで引き継ぐトークン数（トークン予算から差し引く）
+            sent: 会話の中で送信済みの参照箇所 {ドキュメント名: [(開始行, 終了行)]}（送り直さない）
+        
+        Returns:
+            {'text': コンテキスト, 'sources': 使用した部分のリスト,
+             'tokens': 使用したトークン数の見積もり, 'budget': トークン予算}
+        """
+        budget = max(0, self.budget_tokens - history_tokens - estimate_tokens(query, self.model))
+        keywords = [k.lower() for k in extract_keywords(query)]
+        candidates = self._merge_windows(self._candidates(results, keywords, document_search), document_search)
+        if sent:
+            candidates = [c for c in candidates if not any(
+                start <= c['start_line'] and c['end_line'] <= end for start, end in sent.get(c['title'], ()))]
+        # スコアの高い順（同スコアは検索結果の順）に詰める
+        candidates.sort(key=lambda c: (-c['score'], c['order']))
+        
+        header = "以下のドキュメントの内容を参照してください:\n\n"
+        used = estimate_tokens(header, self.model)
+        parts = []
+        sources = []
+        for candidate in candidates:
+            block = f"【{candidate['title']}】\n{candidate['content']}\n\n"
+            tokens = estimate_tokens(block, self.model)
+            if used + tokens > budget:
+                # 残りが十分あれば行単位で切り詰めて入れる
+                remaining = budget - used
+                if remaining < MIN_SNIPPET_TOKENS:
+                    continue
+                candidate = self._truncate(candidate, remaining)
+                if candidate is None:
+                    continue
+                block = f"【{candidate['title']}】\n{candidate['content']}\n\n"
+                tokens = estimate_tokens(block, self.model)
+            parts.append(block)
+            sources.append(candidate)
+            used += tokens
+        
+        if not parts:
+            return {'text': '', 'sources': [], 'tokens': 0, 'budget': budget}
+        return {
+            'text': header + ''.join(parts),
+            'sources': [{
+                'title': c['title'],
+                'content': c['content'],
+                'line': c['start_line'],
+                'start_line': c['start_line'],
+                'end_line': c['end_line'],
+                'score': c['score']
+            } for c in sources],
+            'tokens': used,
+            'budget': budget
+        }
+    
+    def _candidates(self, results, keywords, document_search) -> List[Dict]:
+        """
+        検索結果を候補（行範囲付き）に変換
+        
+        ドキュメント全体の結果は、読み込み時に見出し・段落で分割したチャンクを単位にする
+        """
+        candidates = []
+        for order, result in enumerate(results):
+            title = result['title']
+            if result.get('whole_document'):
+                line_count = result.get('end_line', 0)
+                for chunk in document_search.get_chunks(title):
+                    text = '\n'.join(document_search.get_lines(title, chunk.start_line, chunk.end_line)).lower()
+                    hits = sum(text.count(k) for k in keywords)
+                    # キーワードを含まないチャンクも低い優先度で候補に残す
+                    candidates.append({
+                        'title': title,
+                        'start_line': chunk.start_line,
+                        'end_line': chunk.end_line,
+                        'score': result['score'] + hits - chunk.start_line / (line_count + 1),
+                        'order': order
+                    })
+            else:
+                line = result.get('line', 1)
+                candidates.append({
+                    'title': title,
+                    'start_line': result.get('start_line', line),
+                    'end_line': result.get('end_line', line),
+                    'score': result['score'],
+                    'order': order
+                })
+        return candidates
+    
+    def _merge_windows(self, candidates: List[Dict], document_search) -> List[Dict]:
+        """同じドキュメントで重なる行範囲を1つにまとめ、内容を取得する"""
+        by_title = {}
+        for candidate in candidates:
+            by_title.setdefault(candidate['title'], []).append(candidate)
+        
+        merged = []
+        for title, items in by_title.items():
+            items.sort(key=lambda c: c['start_line'])
+            current = None
+            for item in items:
+                if current is not None and item['start_line'] <= current['end_line']:
+                    current['end_line'] = max(current['end_line'], item['end_line'])
+                    current['score'] = max(current['score'], item['score'])
+                    current['order'] = min(current['order'], item['order'])
+                else:
+                    current = dict(item)
+                    merged.append(current)
+        for candidate in merged:
+            lines = document_search.get_lines(candidate['title'], candidate['start_line'], candidate['end_line'])
+            # 前後の空行は範囲から外す
+            while lines and not lines[0].strip():
+                lines = lines[1:]
+                candidate['start_line'] += 1
+            while lines and not lines[-1].strip():
+                lines = lines[:-1]
+                candidate['end_line'] -= 1
+            candidate['content'] = '\n'.join(lines)
+        return [c for c in merged if c['content']]
+    
+    def _truncate(self, candidate: Dict, max_tokens: int) -> Optional[Dict]:
+        """行単位でトークン数が収まるところまで切り詰める"""
+        lines = candidate['content'].split('\n')
+        overhead = estimate_tokens(f"【{candidate['title']}】\n\n\n", self.model)
+        kept = []
+        used = overhead
+        for line in lines:
+            tokens = estimate_tokens(line + '\n', self.model)
+            if used + tokens > max_tokens:
+                break
+            kept.append(line)
+            used += tokens
+        # 切り詰めた位置の直前の空行は含めない
+        while kept and not kept[-1].strip():
+            kept.pop()
+        if not kept:
+            return None
+        truncated = dict(candidate)
+        truncated['content'] = '\n'.join(kept)
+        truncated['end_line'] = candidate['start_line'] + len(kept) - 1
+        return truncated
@@ -2,129 +2,619 @@
 ドキュメント検索機能
 ローカル完結でドキュメントを検索し、関連する部分を抽出
 """
+import functools
+import hashlib
+import heapq
+import math
 import os
 import re
-from typing import List, Dict
+import threading
+from typing import List, Dict, Optional
+
+from document_text import DocumentText
+from index_snapshot import load_snapshot, save_snapshot
+from ingest import READ_BLOCK_SIZE, SUPPORTED_EXTENSIONS
+from parallel_index import ingest_files
+from search_cache import SearchCache
+from search_index import InvertedIndex
+from vector_index import VectorIndex, document_chunks
+
+# スコアリング方式
+SCORING_BM25 = 'bm25'
+SCORING_FREQUENCY = 'frequency'  # 従来方式（キーワードの出現回数 + ファイル名ボーナス）
+
+# 検索方式
+SEARCH_KEYWORD = 'keyword'
+SEARCH_SEMANTIC = 'semantic'    # 埋め込みベクトルの類似度
+SEARCH_HYBRID = 'hybrid'        # キーワードと類似度のスコアを合成
+SEARCH_MODES = (SEARCH_KEYWORD, SEARCH_SEMANTIC, SEARCH_HYBRID)
+# ハイブリッド検索での類似度の重み（残りがキーワードのスコア）
+HYBRID_SEMANTIC_WEIGHT = 0.5
+# ハイブリッド検索で方式ごとに取得する候補数（最大結果数に対する倍率）
+HYBRID_CANDIDATE_FACTOR = 4
+
+# キーワードの分割結果を保持するクエリ数
+KEYWORD_CACHE_SIZE = 1024
+
+# BM25のパラメータ
+BM25_K1 = 1.2
+BM25_B = 0.75
+# ファイル名にキーワードが含まれる場合のボーナス（方式ごと）
+FILENAME_BONUS = {
+    SCORING_BM25: 1.0,
+    SCORING_FREQUENCY: 10,
+}
+
+def normalize_query(query: str) -> str:
+    """表記の揺れ（大文字・小文字、空白の数）をそろえたクエリ"""
+    return ' '.join(query.lower().split())
+
+@functools.lru_cache(maxsize=KEYWORD_CACHE_SIZE)
+def _extract_keywords(normalized_query: str) -> tuple:
+    keywords = []
+    # 英数字の単語
+    keywords.extend(re.findall(r'\w+', normalized_query))
+    # 日本語の文字列（2文字以上）
+    keywords.extend(k for k in re.findall(r'[ぁ-んァ-ヶー一-龠々]+', normalized_query) if len(k) >= 2)
+    return tuple(keywords)
+
+def extract_keywords(query: str) -> List[str]:
+    """クエリをキーワードに分割（日本語も含む。同じ質問の分割結果は再利用する）"""
+    return list(_extract_keywords(normalize_query(query)))
+
+class _Snapshot:
+    """検索に使う読み取り専用のスナップショット（再読み込み時は丸ごと差し替える）"""
+    
+    def __init__(self, documents=None, index=None, fingerprints=None, version=0, vectors=None):
+        self.documents = documents if documents is not None else {}
+        self.index = index if index is not None else InvertedIndex()
+        # {ファイル名: (mtime_ns, サイズ, SHA-256)}
+        self.fingerprints = fingerprints if fingerprints is not None else {}
+        self.version = version
+        self.vectors = vectors if vectors is not None else VectorIndex()
+        # {チャンクID: チャンク}（キーワード検索の単位）
+        self.chunks = {chunk.id: chunk for doc in self.documents.values() for chunk in doc.chunks}
+        # {チャンクID: ドキュメント内の順番}（同スコアの並び順に使う）
+        self.chunk_order = {chunk_id: order for order, chunk_id in enumerate(self.chunks)}
+        # {ファイル名: 小文字化したファイル名}
+        self.folded_names = {name: name.lower() for name in self.documents}
+        # ファイル名の照合用 {文字数: {小文字化したファイル名または拡張子を除いた名前: (順番, ファイル名)}}
+        self.filename_keys = {}
+        for order, (name, folded) in enumerate(self.folded_names.items()):
+            for key in (folded.replace('.txt', '').replace('.md', ''), folded):
+                if key:
+                    self.filename_keys.setdefault(len(key), {}).setdefault(key, (order, name))
 
 class DocumentSearch:
-    def __init__(self, docs_dir):
+    def __init__(self, docs_dir, scoring=SCORING_BM25, autoload=True, mode=SEARCH_KEYWORD,
+                 embedder=None, vector_dir=None, index_path=None, save_index=True, workers=1,
+                 cache_size=256):
+        """
+        Args:
+            docs_dir: ドキュメントのディレクトリ
+            scoring: スコアリング方式（'bm25' または従来方式の 'frequency'）
+            autoload: Trueなら初期化時にドキュメントを読み込む（Falseの場合は reload() を呼ぶまで空）
+            mode: 既定の検索方式（'keyword' / 'semantic' / 'hybrid'）
+            embedder: 埋め込みベクトルを作成するオブジェクト（embed(テキストのリスト) と
+                embedding_model 属性を持つもの。Noneならキーワード検索のみ）
+            vector_dir: ベクトルインデックスの保存先（Noneならメモリのみ）
+            index_path: 検索インデックスのスナップショットのパス。最初の読み込みでここから復元し、
+                変更されたファイルだけを読み直す（Noneなら毎回すべて読み込む）
+            save_index: Trueなら読み込み後にスナップショットを保存する（読み取り専用の環境ではFalse）
+            workers: ファイルの読み込み・インデックス作成に使うプロセス数（1なら同じプロセスで順に読み込む）
+            cache_size: 検索結果のキャッシュの最大件数（0ならキャッシュしない）
+        """
+        if scoring not in FILENAME_BONUS:
+            raise ValueError(f"未対応のスコアリング方式です: {scoring}")
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"未対応の検索方式です: {mode}")
         self.docs_dir = docs_dir
-        self.documents_cache = {}
-        self._load_documents()
+        self.scoring = scoring
+        self.mode = mode
+        self.embedder = embedder
+        self.vector_dir = vector_dir
+        self.index_path = index_path
+        self.save_index = save_index
+        self.workers = max(1, workers)
+        # 検索結果のキャッシュ（ドキュメントのバージョンが変わると自動的に破棄される）
+        self.cache = SearchCache(cache_size)
+        self._index_restored = False
+        # 保存済みのベクトルは最初の読み込みで内容が同じチャンクに再利用する
+        vectors = VectorIndex.load(vector_dir) if embedder is not None and vector_dir else None
+        self._snapshot = _Snapshot(vectors=vectors)
+        self._reload_lock = threading.Lock()
+        self._watcher_thread = None
+        self._watcher_stop = threading.Event()
+        self._listeners = []
+        if autoload:
+            self.reload()
+    
+    def add_listener(self, callback):
+        """
+        ドキュメントが変更されたときに呼び出す関数を登録
+        
+        Args:
+            callback: reload() の戻り値と同じ形式の変更内容を受け取る関数
+        """
+        self._listeners.append(callback)
     
-    def _load_documents(self):
-        """ドキュメントを読み込んでキャッシュ"""
+    @property
+    def documents_cache(self) -> Dict[str, DocumentText]:
+        """読み込み済みドキュメント {ファイル名: DocumentText}（doc['content'] などの参照にも対応）"""
+        return self._snapshot.documents
+    
+    @property
+    def index(self) -> InvertedIndex:
+        return self._snapshot.index
+    
+    @property
+    def version(self) -> int:
+        """ドキュメントが変更されるたびに増える番号"""
+        return self._snapshot.version
+    
+    def _scan_files(self) -> Dict[str, os.stat_result]:
+        """検索対象ファイルの一覧とstat情報を取得"""
+        files = {}
         if not os.path.exists(self.docs_dir):
-            return
+            return files
         
         for filename in os.listdir(self.docs_dir):
-            if filename.endswith(('.txt', '.md')):
+            if filename.lower().endswith(SUPPORTED_EXTENSIONS):
                 filepath = os.path.join(self.docs_dir, filename)
                 try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        self.documents_cache[filename] = {
-                            'name': filename,
-                            'content': content,
-                            'lines': content.split('\n')
-                        }
-                except Exception as e:
+                    files[filename] = os.stat(filepath)
+                except OSError as e:
                     print(f"ドキュメント読み込みエラー ({filename}): {e}")
+        return files
+    
+    def _file_digest(self, filename: str) -> str:
+        """ファイルの内容のSHA-256（ファイル全体を一度に読み込まない）"""
+        hasher = hashlib.sha256()
+        with open(os.path.join(self.docs_dir, filename), 'rb') as f:
+            for block in iter(lambda: f.read(READ_BLOCK_SIZE), b''):
+                hasher.update(block)
+        return hasher.hexdigest()
     
-    def search(self, query: str, max_results: int = 3) -> List[Dict]:
+    def search(self, query: str, max_results: int = 3, mode: Optional[str] = None) -> List[Dict]:
         """
         クエリに関連するドキュメントの部分を検索
         
         Args:
             query: 検索クエリ
             max_results: 最大結果数
+            mode: 検索方式（'keyword' / 'semantic' / 'hybrid'、Noneなら既定の方式）
+                埋め込みが使えない場合はキーワード検索になる
+        
+        同じキーワードの組み合わせ・最大結果数の検索結果は、ドキュメントが変わるまでキャッシュから返す
         
         Returns:
             関連するドキュメントの部分のリスト
         """
-        if not query or not self.documents_cache:
+        mode = mode or self.mode
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"未対応の検索方式です: {mode}")
+        # 検索中に再読み込みされても一貫した結果になるよう、スナップショットを固定する
+        snapshot = self._snapshot
+        documents = snapshot.documents
+        if not query or not documents:
             return []
         
-        # ファイル名の完全一致をチェック（「○○について教えて」などのパターン）
-        query_lower = query.lower()
-        for filename, doc_data in self.documents_cache.items():
-            filename_lower = filename.lower()
-            filename_base = filename_lower.replace('.txt', '').replace('.md', '')
-            
-            # ファイル名が質問に含まれている場合、そのファイル全体を返す
-            if filename_base in query_lower or filename_lower in query_lower:
-                return [{
-                    'title': doc_data['name'],
-                    'content': doc_data['content'],  # ファイル全体
-                    'line': 1,
-                    'score': 1000  # 最高スコア
-                }]
+        if mode != SEARCH_KEYWORD and (self.embedder is None or not len(snapshot.vectors)):
+            mode = SEARCH_KEYWORD
+        # 大文字・小文字と空白の数だけが異なる質問は同じ結果を返す
+        # キーの元になった正規化済みのクエリでファイル名の照合・キーワードの分割・埋め込みを行うため、
+        # 同じキーの質問は必ず同じ結果になる（埋め込みベクトルの作成も省略できる）
+        query = normalize_query(query)
+        key = (mode, query, max_results)
+        generation = (snapshot.version, snapshot.vectors.document_version)
+        cached = self.cache.get(generation, key)
+        if cached is not None:
+            return cached
         
+        results = None
+        if mode != SEARCH_KEYWORD:
+            try:
+                query_vector = self.embedder.embed([query])[0]
+            except Exception as e:
+                print(f"クエリの埋め込みエラー（キーワード検索で続行）: {e}")
+                # 一時的な失敗の可能性があるため、代わりのキーワード検索の結果はキャッシュしない
+                key = None
+            else:
+                if mode == SEARCH_SEMANTIC:
+                    results = self._semantic_search(snapshot, query_vector, max_results)
+                else:
+                    results = self._filename_match(snapshot, query)
+                    if results is None:
+                        results = self._hybrid_search(snapshot, query, query_vector, max_results)
+        
+        if results is None:
+            results = self._filename_match(snapshot, query)
+            if results is None:
+                results = self._keyword_search(snapshot, query, max_results)
+        if key is not None:
+            self.cache.set(generation, key, results)
+        return results
+    
+    def _filename_match(self, snapshot: _Snapshot, query: str) -> Optional[List[Dict]]:
+        """
+        ファイル名が質問に含まれている場合（「○○について教えて」など）、そのファイル全体を返す
+        
+        ドキュメントを順に調べず、質問の部分文字列をファイル名の文字数ごとの辞書で引く
+        （複数が含まれる場合はドキュメントの順で最初のもの）
+        """
+        query_lower = query.lower()
+        found = None
+        for length, keys in snapshot.filename_keys.items():
+            for start in range(len(query_lower) - length + 1):
+                match = keys.get(query_lower[start:start + length])
+                if match is not None and (found is None or match < found):
+                    found = match
+        if found is None:
+            return None
+        doc = snapshot.documents[found[1]]
+        return [{
+            'title': doc.name,
+            'content': doc.text,  # ファイル全体
+            'line': 1,
+            'start_line': 1,
+            'end_line': doc.line_count,
+            'whole_document': True,
+            'score': 1000  # 最高スコア
+        }]
+    
+    def _keyword_search(self, snapshot: _Snapshot, query: str, max_results: int) -> List[Dict]:
+        """キーワードを含むチャンクを検索（転置インデックスを使用）"""
+        documents = snapshot.documents
+        chunks = snapshot.chunks
         # クエリをキーワードに分割（日本語も含む）
-        keywords = []
-        # 英数字の単語
-        keywords.extend(re.findall(r'\w+', query_lower))
-        # 日本語の文字列（2文字以上）
-        keywords.extend(re.findall(r'[ぁ-んァ-ヶー一-龠々]+', query))
+        keywords = extract_keywords(query)
         
         if not keywords:
             return []
         
+        # 転置インデックスからキーワードを含む行だけを取得
+        # {キーワード: {チャンクID: {行番号: 出現回数}}}
+        keyword_matches = {}
+        for keyword in keywords:
+            keyword_lower = keyword.lower()
+            if keyword_lower not in keyword_matches:
+                keyword_matches[keyword_lower] = snapshot.index.find(
+                    keyword_lower, lambda chunk_id, line_no: documents[chunks[chunk_id].document].folded_line(line_no))
+        
+        # チャンクごとのスコアとキーワードを含む行
+        chunk_scores = {}
+        chunk_lines = {}
+        for keyword in keywords:
+            found = keyword_matches[keyword.lower()]
+            for chunk_id, line_counts in found.items():
+                tf = sum(line_counts.values())
+                chunk_scores[chunk_id] = chunk_scores.get(chunk_id, 0) + self._keyword_score(snapshot.index, chunk_id, tf, len(found))
+                chunk_lines.setdefault(chunk_id, set()).update(line_counts)
+        
+        # 候補（スコア, 順序, チャンクID）を列挙（同スコアはドキュメント内の順序に従う）
+        # キーワードを含むチャンクだけを調べるため、検索の時間はドキュメント全体の量によらない
+        filename_bonus = FILENAME_BONUS[self.scoring]
+        filename_scores = {}
+        chunk_order = snapshot.chunk_order
+        candidates = []
+        for chunk_id, score in chunk_scores.items():
+            filename = chunks[chunk_id].document
+            if filename not in filename_scores:
+                # ファイル名も検索対象に含める
+                filename_lower = snapshot.folded_names[filename]
+                filename_scores[filename] = sum(filename_bonus for keyword in keywords if keyword in filename_lower)
+            candidates.append((score + filename_scores[filename], chunk_order[chunk_id], chunk_id))
+        
+        # 上位max_results件だけをヒープで選択（同スコアは候補の順序を保つ）
+        top = heapq.nsmallest(max_results, candidates, key=lambda c: (-c[0], c[1]))
+        
         results = []
+        for total_score, _, chunk_id in top:
+            chunk = chunks[chunk_id]
+            doc = documents[chunk.document]
+            # チャンク（見出し・段落の単位）をそのまま返す。行のリストは作らず本文から直接切り出す
+            results.append({
+                'title': doc.name,
+                'content': doc.slice_lines(chunk.start_line - 1, chunk.end_line),
+                'line': min(chunk_lines[chunk_id]) + 1,  # キーワードが最初に現れる行
+                'start_line': chunk.start_line,  # チャンクの範囲（1始まり、終端を含む）
+                'end_line': chunk.end_line,
+                'heading': chunk.heading,
+                'chunk_id': chunk_id,
+                'score': total_score
+            })
+        
+        return results
+    
+    def _chunk_result(self, snapshot: _Snapshot, chunk_index: int, score: float) -> Optional[Dict]:
+        """チャンクを検索結果の形式に変換（ドキュメントが変わっていて範囲外ならNone）"""
+        chunk = snapshot.vectors.chunks[chunk_index]
+        doc = snapshot.documents.get(chunk['document'])
+        if doc is None or chunk['end_line'] > doc.line_count:
+            return None
+        content = doc.slice_lines(chunk['start_line'] - 1, chunk['end_line'])
+        return {
+            'title': doc.name,
+            'content': content.strip(),
+            'line': chunk['start_line'],
+            'start_line': chunk['start_line'],
+            'end_line': chunk['end_line'],
+            'heading': chunk.get('heading', ''),
+            'chunk_id': chunk.get('id'),
+            'score': score
+        }
+    
+    def _semantic_search(self, snapshot: _Snapshot, query_vector, max_results: int) -> List[Dict]:
+        """埋め込みベクトルの類似度が高いチャンクを検索"""
+        results = []
+        for chunk_index, similarity in snapshot.vectors.search(query_vector, max_results):
+            result = self._chunk_result(snapshot, chunk_index, similarity)
+            if result is not None:
+                results.append(result)
+        return results
+    
+    def _hybrid_search(self, snapshot: _Snapshot, query: str, query_vector, max_results: int) -> List[Dict]:
+        """
+        キーワード検索と意味検索のスコアを合成
+        
+        キーワードのスコアは最大値で割って0〜1にし、類似度（0〜1に切り詰め）と重み付きで足す。
+        キーワードがヒットした行は、その行を含むチャンク単位にまとめる。
+        """
+        candidates = max_results * HYBRID_CANDIDATE_FACTOR
+        keyword_results = self._keyword_search(snapshot, query, candidates)
+        similarities = snapshot.vectors.similarities(query_vector)
+        semantic_top = snapshot.vectors.search(query_vector, candidates, similarities)
         
-        for filename, doc_data in self.documents_cache.items():
-            content = doc_data['content']
-            content_lower = content.lower()
-            lines = doc_data['lines']
-            filename_lower = filename.lower()
+        max_keyword = max((r['score'] for r in keyword_results), default=0) or 1.0
+        # {チャンク番号 または (ファイル名, 行): [キーワードのスコア, 類似度, 検索結果]}
+        fused = {}
+        for result in keyword_results:
+            chunk_index = snapshot.vectors.chunk_at(result['title'], result['line'])
+            key = chunk_index if chunk_index is not None else (result['title'], result['line'])
+            entry = fused.setdefault(key, [0.0, 0.0, result if chunk_index is None else None])
+            entry[0] = max(entry[0], result['score'] / max_keyword)
+        for chunk_index, _ in semantic_top:
+            fused.setdefault(chunk_index, [0.0, 0.0, None])
+        for key, entry in fused.items():
+            if entry[2] is None:
+                entry[1] = max(0.0, float(similarities[key]))
+        
+        scored = []
+        for order, (key, (keyword_score, similarity, result)) in enumerate(fused.items()):
+            score = HYBRID_SEMANTIC_WEIGHT * similarity + (1 - HYBRID_SEMANTIC_WEIGHT) * keyword_score
+            scored.append((score, order, key, result))
+        
+        # 上位max_results件だけを取り出す（ドキュメントが変わって使えないチャンクがあったときだけ範囲を広げる）
+        limit = max_results
+        while True:
+            results = []
+            for score, _, key, result in heapq.nsmallest(limit, scored, key=lambda s: (-s[0], s[1])):
+                if result is None:
+                    result = self._chunk_result(snapshot, key, score)
+                    if result is None:
+                        continue
+                else:
+                    result = dict(result, score=score)
+                results.append(result)
+                if len(results) >= max_results:
+                    return results
+            if limit >= len(scored):
+                return results
+            limit *= 2
+    
+    def get_lines(self, filename: str, start_line: int = 1, end_line: Optional[int] = None) -> List[str]:
+        """
+        ドキュメントの指定範囲の行を取得
+        
+        Args:
+            filename: ドキュメント名
+            start_line: 開始行（1始まり）
+            end_line: 終了行（この行を含む、Noneなら最後まで）
+        
+        Returns:
+            行のリスト（ドキュメントがなければ空）
+        """
+        doc = self._snapshot.documents.get(filename)
+        if doc is None:
+            return []
+        return doc.lines(max(0, start_line - 1), end_line)
+    
+    def get_chunks(self, filename: str) -> List:
+        """ドキュメントのチャンク（読み込み時に見出し・段落で分割したもの。ドキュメントがなければ空）"""
+        doc = self._snapshot.documents.get(filename)
+        return list(doc.chunks) if doc is not None else []
+    
+    def _keyword_score(self, index: InvertedIndex, chunk_id: str, tf: int, df: int) -> float:
+        """
+        1つのキーワードのチャンクに対するスコア
+        
+        Args:
+            index: 統計量を参照するインデックス
+            chunk_id: チャンクID
+            tf: チャンク内でのキーワードの出現回数
+            df: キーワードを含むチャンク数
+        """
+        if self.scoring == SCORING_FREQUENCY:
+            return tf
+        
+        n = index.document_count
+        avgdl = index.average_length or 1.0
+        dl = index.doc_lengths.get(chunk_id, 0)
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * dl / avgdl)
+        return idf * tf * (BM25_K1 + 1) / (tf + norm)
+    
+    def reload(self, progress=None) -> Dict[str, List[str]]:
+        """
+        ドキュメントを再読み込み
+        
+        変更（追加・更新・削除）されたファイルだけを読み直してインデックスを差分更新し、
+        完成したスナップショットに差し替える。検索中のリクエストは古いスナップショットを
+        そのまま使い続けるため、途中の状態が見えることはない。
+        
+        Args:
+            progress: 進捗を受け取る関数 progress(処理済みファイル数, 全ファイル数)
+        
+        Returns:
+            {'added': [...], 'updated': [...], 'removed': [...]}
+        """
+        with self._reload_lock:
+            old = self._snapshot
+            if self.index_path and not self._index_restored:
+                # 初回はスナップショットを基準にし、ファイルの指紋が一致するものは読み直さない
+                self._index_restored = True
+                restored = load_snapshot(self.index_path)
+                if restored is not None:
+                    documents, index, fingerprints = restored
+                    old = _Snapshot(documents, index, fingerprints, old.version + 1, old.vectors)
+            files = self._scan_files()
+            changes = {'added': [], 'updated': [], 'removed': []}
             
-            # ファイル名も検索対象に含める
-            filename_score = 0
-            for keyword in keywords:
-                if keyword in filename_lower:
-                    filename_score += 10  # ファイル名マッチは高スコア
+            removed = [name for name in old.documents if name not in files]
+            # (ファイル名, DocumentText, 作成済みのポスティング) のリスト
+            to_index = []
+            fingerprints = {}
+            # 読み込みが必要なファイル
+            to_read = []
             
-            # キーワードの出現回数をカウント
-            content_score = sum(content_lower.count(keyword.lower()) for keyword in keywords)
+            for filename, st in files.items():
+                previous = old.fingerprints.get(filename)
+                if previous and previous[:2] == (st.st_mtime_ns, st.st_size):
+                    fingerprints[filename] = previous
+                    continue
+                if previous:
+                    # 更新日時だけが変わった場合は再インデックスしない（ハッシュだけを計算する）
+                    try:
+                        if previous[2] == self._file_digest(filename):
+                            fingerprints[filename] = (st.st_mtime_ns, st.st_size, previous[2])
+                            continue
+                    except Exception as e:
+                        print(f"ドキュメント読み込みエラー ({filename}): {e}")
+                        fingerprints[filename] = previous
+                        continue
+                to_read.append(filename)
             
-            total_score = content_score + filename_score
+            done = len(files) - len(to_read)
+            if progress:
+                progress(done, len(files))
+            for filename, doc, digest, postings, error in ingest_files(self.docs_dir, to_read, self.workers):
+                done += 1
+                if progress:
+                    progress(done, len(files))
+                if error is not None:
+                    print(f"ドキュメント読み込みエラー ({filename}): {error}")
+                    # 読めなかったファイルは以前の内容を維持する
+                    previous = old.fingerprints.get(filename)
+                    if previous:
+                        fingerprints[filename] = previous
+                    continue
+                st = files[filename]
+                fingerprints[filename] = (st.st_mtime_ns, st.st_size, digest)
+                to_index.append((filename, doc, postings))
+                changes['updated' if filename in old.documents else 'added'].append(filename)
             
-            if total_score > 0:
-                # 関連する行を抽出
-                relevant_lines = []
-                for i, line in enumerate(lines):
-                    line_lower = line.lower()
-                    line_original = line
-                    # キーワードが含まれている行を検索
-                    if any(keyword.lower() in line_lower or keyword in line_original for keyword in keywords):
-                        # 前後の行も含める（コンテキスト）
-                        start = max(0, i - 2)
-                        end = min(len(lines), i + 3)
-                        context = '\n'.join(lines[start:end])
-                        relevant_lines.append({
-                            'line': i + 1,
-                            'content': context.strip(),
-                            'match_line': i + 1
-                        })
-                
-                if relevant_lines:
-                    # 最も関連性の高い部分を選択（複数ある場合は最初の数個）
-                    for match in relevant_lines[:2]:  # 各ドキュメントから最大2箇所
-                        results.append({
-                            'title': doc_data['name'],
-                            'content': match['content'],
-                            'line': match['line'],
-                            'score': total_score
-                        })
-        
-        # スコアでソート
-        results.sort(key=lambda x: x['score'], reverse=True)
-        
-        # 最大結果数まで返す
-        return results[:max_results]
-    
-    def reload(self):
-        """ドキュメントを再読み込み"""
-        self.documents_cache = {}
-        self._load_documents()
-
+            for filename in removed:
+                changes['removed'].append(filename)
+            
+            if not to_index and not removed:
+                # 以前の埋め込みに失敗していた場合はここで作り直す
+                vectors = self._update_vectors(old.documents, old.vectors, old.version)
+                if fingerprints != old.fingerprints or vectors is not old.vectors or old is not self._snapshot:
+                    self._snapshot = _Snapshot(old.documents, old.index, fingerprints, old.version, vectors)
+                    if fingerprints != old.fingerprints:
+                        self._save_index()
+                return changes
+            
+            documents = dict(old.documents)
+            index = old.index.copy()
+            for filename in removed:
+                for chunk in documents.pop(filename).chunks:
+                    index.remove_document(chunk.id)
+            for filename, doc, postings in to_index:
+                previous = documents.get(filename)
+                if previous is not None:
+                    for chunk in previous.chunks:
+                        index.remove_document(chunk.id)
+                documents[filename] = doc
+                # チャンクごとにインデックスに登録（行番号はドキュメント内の位置のまま）
+                for chunk in doc.chunks:
+                    if postings is not None:
+                        # ワーカープロセスで作成済みの部分インデックスをまとめる
+                        index.add_postings(chunk.id, *postings[chunk.id])
+                    else:
+                        index.add_document(chunk.id, doc.folded_lines(chunk.start_line - 1, chunk.end_line),
+                                           first_line=chunk.start_line - 1)
+            
+            vectors = self._update_vectors(documents, old.vectors, old.version + 1)
+            self._snapshot = _Snapshot(documents, index, fingerprints, old.version + 1, vectors)
+            self._save_index()
+            if progress:
+                progress(len(files), len(files))
+        
+        for callback in self._listeners:
+            try:
+                callback(changes)
+            except Exception as e:
+                print(f"ドキュメント変更通知エラー: {e}")
+        return changes
+    
+    def _save_index(self):
+        """現在のスナップショットをファイルに保存（失敗しても検索は続行できる）"""
+        if not self.index_path or not self.save_index:
+            return
+        snapshot = self._snapshot
+        try:
+            save_snapshot(self.index_path, snapshot.documents, snapshot.index, snapshot.fingerprints)
+        except Exception as e:
+            print(f"インデックスのスナップショット保存エラー: {e}")
+    
+    def _update_vectors(self, documents: Dict[str, DocumentText], vectors: VectorIndex, version: int) -> VectorIndex:
+        """
+        ドキュメントに合わせてベクトルインデックスを更新（内容が変わったチャンクだけ埋め込む）
+        
+        埋め込みに失敗した場合は以前のインデックスをそのまま返し、次回の再読み込みで再試行する
+        """
+        if self.embedder is None or vectors.document_version == version:
+            return vectors
+        model = getattr(self.embedder, 'embedding_model', type(self.embedder).__name__)
+        try:
+            updated = vectors.updated(document_chunks(documents), self.embedder, model, version)
+        except Exception as e:
+            print(f"埋め込みベクトル作成エラー（キーワード検索で続行）: {e}")
+            return vectors
+        if self.vector_dir and updated.vectors is not vectors.vectors:
+            try:
+                updated.save(self.vector_dir)
+            except Exception as e:
+                print(f"ベクトルインデックス保存エラー: {e}")
+        return updated
+    
+    def start_watcher(self, interval: float = 5.0):
+        """
+        docsディレクトリを定期的に確認し、変更があれば自動で再読み込みする
+        
+        Args:
+            interval: 確認間隔（秒）
+        """
+        if self._watcher_thread and self._watcher_thread.is_alive():
+            return
+        self._watcher_stop.clear()
+        self._watcher_thread = threading.Thread(
+            target=self._watch, args=(interval,), name='document-watcher', daemon=True)
+        self._watcher_thread.start()
+    
+    def stop_watcher(self, timeout: Optional[float] = None):
+        """ファイル監視を停止"""
+        self._watcher_stop.set()
+        if self._watcher_thread:
+            self._watcher_thread.join(timeout)
+            self._watcher_thread = None
+    
+    def _watch(self, interval: float):
+        while not self._watcher_stop.wait(interval):
+            try:
+                changes = self.reload()
+                if any(changes.values()):
+                    print(f"ドキュメントの変更を検出しました: {changes}")
+            except Exception as e:
+                print(f"ドキュメント監視エラー: {e}")
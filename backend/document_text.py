@@ -0,0 +1,90 @@
+"""
+ドキュメントの本文
+本文は1つの文字列として保持し、行は開始位置の配列から必要なときに切り出す
+"""
+from array import array
+from typing import Iterator, List, Optional, Sequence
+
+def line_starts(text: str) -> array:
+    """各行の開始位置（文字単位）の配列"""
+    starts = array('I', [0])
+    pos = text.find('\n')
+    while pos != -1:
+        starts.append(pos + 1)
+        pos = text.find('\n', pos + 1)
+    return starts
+
+class DocumentText:
+    """
+    1つのドキュメントの本文と、検索用に小文字化した本文
+    
+    行の一覧（str のリスト）は保持しない。行番号は0始まり。
+    従来の辞書形式との互換のため doc['name'] / doc['content'] / doc['lines'] でも参照できる
+    （'lines' は呼び出すたびにリストを作成する）。
+    """
+    
+    __slots__ = ('name', 'text', 'folded', 'starts', 'folded_starts', 'chunks')
+    
+    def __init__(self, name: str, text: str, starts: Optional[Sequence[int]] = None, chunks: Optional[List] = None):
+        """
+        Args:
+            name: ドキュメント名
+            text: 本文
+            starts: 行の開始位置（計算済みの場合。スナップショットから復元したものなど）
+            chunks: 検索の単位となるチャンク（ingest.Chunk のリスト）
+        """
+        self.name = name
+        self.text = text
+        self.chunks = chunks if chunks is not None else []
+        # 小文字化は読み込み時に1回だけ行う
+        self.folded = text.lower()
+        self.starts = starts if starts is not None else line_starts(text)
+        # 小文字化で文字数が変わる文字（'İ' など）を含む場合だけ、別に開始位置を持つ
+        self.folded_starts = self.starts if len(self.folded) == len(text) else line_starts(self.folded)
+    
+    @property
+    def line_count(self) -> int:
+        return len(self.starts)
+    
+    @staticmethod
+    def _span(text: str, starts: Sequence[int], start: int, end: int) -> str:
+        """start行目からend行目の手前までを改行付きのまま切り出す（末尾の改行は含めない）"""
+        end = min(end, len(starts))
+        if start >= end:
+            return ''
+        stop = starts[end] - 1 if end < len(starts) else len(text)
+        return text[starts[start]:stop]
+    
+    def line(self, line_no: int) -> str:
+        """1行を取得"""
+        return self._span(self.text, self.starts, line_no, line_no + 1)
+    
+    def folded_line(self, line_no: int) -> str:
+        """小文字化した1行を取得"""
+        return self._span(self.folded, self.folded_starts, line_no, line_no + 1)
+    
+    def slice_lines(self, start: int, end: Optional[int] = None) -> str:
+        """start行目からend行目の手前まで（endがNoneなら最後まで）を1つの文字列で取得"""
+        return self._span(self.text, self.starts, max(0, start), self.line_count if end is None else end)
+    
+    def lines(self, start: int = 0, end: Optional[int] = None) -> List[str]:
+        """行のリストを取得（指定範囲だけを分割する）"""
+        end = self.line_count if end is None else min(end, self.line_count)
+        if max(0, start) >= end:
+            return []
+        return self.slice_lines(start, end).split('\n')
+    
+    def folded_lines(self, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+        """小文字化した行を順に返す（インデックス作成用）"""
+        end = self.line_count if end is None else min(end, self.line_count)
+        for line_no in range(max(0, start), end):
+            yield self.folded_line(line_no)
+    
+    def __getitem__(self, key: str):
+        if key == 'name':
+            return self.name
+        if key == 'content':
+            return self.text
+        if key == 'lines':
+            return self.lines()
+        raise KeyError(key)
@@ -0,0 +1,175 @@
+"""
+生成リクエストのスケジューラ
+Ollamaへの同時リクエスト数を制限し、待ち行列が一杯のときはすぐにエラーを返す
+"""
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# 機能タイプごとの優先度（小さいほど先に処理する）
+FUNCTION_PRIORITIES = {
+    'chatbot': 0,            # 対話的な質問を優先
+    'anomaly_detection': 1,
+    'production_plan': 2,
+    'daily_report': 3,
+    'batch': 4,              # 一括処理は最後
+}
+DEFAULT_PRIORITY = 2
+
+def priority_for(function_type: str) -> int:
+    """機能タイプの優先度"""
+    return FUNCTION_PRIORITIES.get(function_type, DEFAULT_PRIORITY)
+
+class QueueFullError(Exception):
+    """待ち行列が一杯、または待ち時間の上限を超えた"""
+    
+    def __init__(self, message: str, retry_after: int, timed_out: bool = False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        # Trueなら待ち時間の上限を超えた（Falseなら待ち行列が一杯で受け付けなかった）
+        self.timed_out = timed_out
+
+class _Ticket:
+    __slots__ = ('granted',)
+    
+    def __init__(self):
+        self.granted = False
+
+class GenerationScheduler:
+    """
+    同時実行数と待ち行列の長さを制限するスケジューラ
+    
+    生成処理はリクエストのスレッドでそのまま実行し、実行枠（slot）の割り当てだけを管理する。
+    空きがなければ優先度順に待ち、待ち行列が一杯なら QueueFullError を送出する。
+    """
+    
+    def __init__(self, workers: int = 1, max_queue: int = 8, queue_timeout: float = 120):
+        """
+        Args:
+            workers: 同時にOllamaへ送る生成リクエストの数
+            max_queue: 実行を待つリクエストの最大数
+            queue_timeout: 待ち時間の上限（秒）
+        """
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._running = 0
+        # [(優先度, 到着順, チケット)]
+        self._waiting = []
+        self._sequence = itertools.count()
+        # 1件あたりの処理時間の移動平均（Retry-Afterの見積もりに使用）
+        self._average_seconds = 10.0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait_seconds = 0.0
+    
+    def retry_after(self) -> int:
+        """今から投入した場合に実行できるまでの目安（秒）"""
+        with self._cond:
+            return self._retry_after_locked()
+    
+    def _retry_after_locked(self) -> int:
+        rounds = (len(self._waiting) + 1) / self.workers
+        return max(1, math.ceil(rounds * self._average_seconds))
+    
+    def is_full(self) -> bool:
+        """新しいリクエストを待たせる余地がないか"""
+        with self._cond:
+            return self._running >= self.workers and len(self._waiting) >= self.max_queue
+    
+    def acquire(self, priority: int = DEFAULT_PRIORITY) -> float:
+        """
+        実行枠を取得（空くまで待つ）
+        
+        Returns:
+            待った時間（秒）
+        
+        Raises:
+            QueueFullError: 待ち行列が一杯、または待ち時間の上限を超えた
+        """
+        started_at = time.perf_counter()
+        with self._cond:
+            if self._running < self.workers and not self._waiting:
+                self._running += 1
+                return 0.0
+            if len(self._waiting) >= self.max_queue:
+                self.rejected += 1
+                raise QueueFullError('リクエストが混み合っています。しばらくしてから再度お試しください。',
+                                     self._retry_after_locked())
+            
+            ticket = _Ticket()
+            entry = (priority, next(self._sequence), ticket)
+            heapq.heappush(self._waiting, entry)
+            deadline = started_at + self.queue_timeout
+            while not ticket.granted:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self.timed_out += 1
+                    raise QueueFullError('待ち時間の上限を超えました。しばらくしてから再度お試しください。',
+                                         self._retry_after_locked(), timed_out=True)
+                self._cond.wait(remaining)
+            
+            waited = time.perf_counter() - started_at
+            self.total_wait_seconds += waited
+            return waited
+    
+    def release(self, elapsed: Optional[float] = None):
+        """
+        実行枠を返却し、待っているリクエストのうち最も優先度の高いものに渡す
+        
+        Args:
+            elapsed: 処理にかかった時間（秒、Retry-Afterの見積もりに使用）
+        """
+        with self._cond:
+            self.completed += 1
+            if elapsed is not None:
+                self._average_seconds = 0.8 * self._average_seconds + 0.2 * elapsed
+            if self._waiting:
+                _, _, ticket = heapq.heappop(self._waiting)
+                ticket.granted = True  # 実行数はそのまま引き継ぐ
+                self._cond.notify_all()
+            else:
+                self._running -= 1
+    
+    @contextmanager
+    def slot(self, priority: int = DEFAULT_PRIORITY, metrics=None):
+        """
+        実行枠を取得して処理を行う
+        
+        Args:
+            priority: 優先度（小さいほど先）
+            metrics: 待ち時間を計測するMetrics（queue_wait段階として記録）
+        """
+        if metrics is not None:
+            with metrics.span('queue_wait'):
+                self.acquire(priority)
+        else:
+            self.acquire(priority)
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started_at)
+    
+    def stats(self) -> Dict:
+        """実行中・待機中の件数などの統計情報"""
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'running': self._running,
+                'waiting': len(self._waiting),
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'average_wait_seconds': self.total_wait_seconds / self.completed if self.completed else 0.0,
+                'average_generation_seconds': self._average_seconds
+            }
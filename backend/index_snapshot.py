@@ -0,0 +1,204 @@
+"""
+検索インデックスのスナップショット
+ドキュメント・行の開始位置・チャンク・ポスティング・統計量を1つのバイナリファイルに保存し、起動時にメモリマップで開く
+
+スナップショットは毎回新しいファイル名で書き出し、指定したパスには使用中のファイル名だけを書く。
+メモリマップで開いている（Windowsでは置き換え・削除できない）ファイルは上書きしない。
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import uuid
+from array import array
+from typing import Dict, Optional, Tuple
+
+from document_text import DocumentText
+from ingest import Chunk
+from search_index import INDEX_VERSION, InvertedIndex
+
+MAGIC = b'DSINDEX\0'
+# ファイル形式のバージョン（形式・本文の読み込み方を変えたら上げる。一致しないスナップショットは使わない）
+FORMAT_VERSION = 4
+
+# マジック, 形式のバージョン, インデックスのバージョン, 整数のバイト数, バイトオーダー（1=リトル）, メタデータ長
+_HEADER = struct.Struct('<8sIIBBxxQ')
+_ITEM_SIZE = array('I').itemsize
+_LITTLE_ENDIAN = 1 if sys.byteorder == 'little' else 0
+
+def _align(offset: int) -> int:
+    return (offset + _ITEM_SIZE - 1) // _ITEM_SIZE * _ITEM_SIZE
+
+def _data_prefix(path: str) -> Tuple[str, str]:
+    """スナップショットの本体のファイル名の先頭と拡張子（search-index.bin → 'search-index-', '.bin'）"""
+    stem, ext = os.path.splitext(os.path.basename(path))
+    return f"{stem}-", ext or '.bin'
+
+def snapshot_file(path: str) -> Optional[str]:
+    """path が指している本体のファイルのパス（なければNone）"""
+    try:
+        with open(path, 'rb') as f:
+            pointer = f.read(4096)
+    except OSError:
+        return None
+    if pointer.startswith(MAGIC):
+        # 本体を直接書いていた以前の形式
+        return path
+    data_file = pointer.decode('utf-8', errors='replace').strip()
+    if not data_file or os.path.basename(data_file) != data_file:
+        return None
+    return os.path.join(os.path.dirname(os.path.abspath(path)), data_file)
+
+def save_snapshot(path: str, documents: Dict[str, DocumentText], index: InvertedIndex,
+                  fingerprints: Dict[str, Tuple]) -> None:
+    """
+    スナップショットを保存（新しいファイルに書いてから path の指す先を差し替え、古いファイルを削除する）
+    
+    ファイルの構成: ヘッダー, メタデータ（JSON）, 本文, 行の開始位置, エントリ表, ポスティング
+    エントリ表は (語番号, チャンク番号, ポスティングの開始位置, 件数) の並び
+    """
+    names = list(documents)
+    # ポスティングの名前（チャンクID）の番号
+    entry_ids = {chunk.id: i for i, chunk in enumerate(chunk for name in names for chunk in documents[name].chunks)}
+    
+    texts = []
+    doc_meta = []
+    text_offset = 0
+    starts = array('I')
+    for name in names:
+        doc = documents[name]
+        data = doc.text.encode('utf-8')
+        texts.append(data)
+        doc_meta.append({
+            'name': name,
+            'text': [text_offset, len(data)],
+            'lines': [len(starts), doc.line_count],
+            # [[チャンクID, 開始行, 終了行, 見出し, 語の出現数の合計]]
+            'chunks': [[chunk.id, chunk.start_line, chunk.end_line, chunk.heading, index.doc_lengths.get(chunk.id, 0)]
+                       for chunk in doc.chunks],
+            'fingerprint': list(fingerprints.get(name, ()))
+        })
+        text_offset += len(data)
+        starts.extend(doc.starts)
+    
+    terms = []
+    entries = array('I')
+    postings = array('I')
+    for term, docs in index.postings.items():
+        term_id = len(terms)
+        terms.append(term)
+        for name, positions in docs.items():
+            entries.extend((term_id, entry_ids[name], len(postings), len(positions)))
+            postings.extend(positions)
+    
+    metadata = json.dumps({
+        'documents': doc_meta,
+        'terms': terms,
+        'total_length': index.total_length,
+        'line_starts': len(starts),
+        'entries': len(entries),
+        'postings': len(postings)
+    }, ensure_ascii=False).encode('utf-8')
+    
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    prefix, ext = _data_prefix(path)
+    data_file = f"{prefix}{uuid.uuid4().hex[:12]}{ext}"
+    with open(os.path.join(directory, data_file), 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, INDEX_VERSION, _ITEM_SIZE, _LITTLE_ENDIAN, len(metadata)))
+        f.write(metadata)
+        for data in texts:
+            f.write(data)
+        f.write(b'\0' * (_align(f.tell()) - f.tell()))
+        starts.tofile(f)
+        entries.tofile(f)
+        postings.tofile(f)
+    
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(data_file)
+    os.replace(tmp_path, path)
+    
+    # 古いファイルを削除（メモリマップで使用中のため削除できない場合は次回に持ち越す）
+    for filename in os.listdir(directory):
+        if filename.startswith(prefix) and filename.endswith(ext) and filename != data_file:
+            try:
+                os.remove(os.path.join(directory, filename))
+            except OSError:
+                pass
+
+def load_snapshot(path: str) -> Optional[Tuple[Dict[str, DocumentText], InvertedIndex, Dict[str, Tuple]]]:
+    """
+    スナップショットを読み込む
+    
+    行の開始位置とポスティングはコピーせず、メモリマップ上の領域をそのまま参照する。
+    ファイルがない・形式やバージョンが異なる・壊れている場合はNone。
+    
+    Returns:
+        (ドキュメント, インデックス, ファイルの指紋)
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        data_path = snapshot_file(path)
+        if data_path is None:
+            raise ValueError('スナップショットのファイル名がありません')
+        with open(data_path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format_version, index_version, item_size, little_endian, metadata_length = \
+            _HEADER.unpack_from(buffer, 0)
+        if (magic, format_version, index_version, item_size, little_endian) != \
+                (MAGIC, FORMAT_VERSION, INDEX_VERSION, _ITEM_SIZE, _LITTLE_ENDIAN):
+            print(f"インデックスのスナップショットの形式が異なるため使用しません ({path})")
+            buffer.close()
+            return None
+        
+        offset = _HEADER.size
+        metadata = json.loads(bytes(buffer[offset:offset + metadata_length]).decode('utf-8'))
+        offset += metadata_length
+        text_start = offset
+        text_length = sum(doc['text'][1] for doc in metadata['documents'])
+        offset = _align(text_start + text_length)
+        view = memoryview(buffer)
+        starts = view[offset:offset + metadata['line_starts'] * _ITEM_SIZE].cast('I')
+        offset += metadata['line_starts'] * _ITEM_SIZE
+        entries = view[offset:offset + metadata['entries'] * _ITEM_SIZE].cast('I')
+        offset += metadata['entries'] * _ITEM_SIZE
+        postings = view[offset:offset + metadata['postings'] * _ITEM_SIZE].cast('I')
+        if len(postings) != metadata['postings']:
+            raise ValueError('ファイルが途中で切れています')
+        
+        documents = {}
+        fingerprints = {}
+        index = InvertedIndex()
+        names = []
+        for doc in metadata['documents']:
+            name = doc['name']
+            start, length = doc['text']
+            content = bytes(buffer[text_start + start:text_start + start + length]).decode('utf-8')
+            lines_start, line_count = doc['lines']
+            chunks = []
+            for chunk_id, start_line, end_line, heading, length in doc['chunks']:
+                chunks.append(Chunk(chunk_id, name, start_line, end_line, heading))
+                index.doc_lengths[chunk_id] = length
+                index.doc_terms[chunk_id] = []
+                names.append(chunk_id)
+            documents[name] = DocumentText(name, content, starts[lines_start:lines_start + line_count], chunks)
+            if doc['fingerprint']:
+                fingerprints[name] = tuple(doc['fingerprint'])
+        index.total_length = metadata['total_length']
+        
+        terms = metadata['terms']
+        for i in range(0, len(entries), 4):
+            term = terms[entries[i]]
+            name = names[entries[i + 1]]
+            start = entries[i + 2]
+            index.postings.setdefault(term, {})[name] = postings[start:start + entries[i + 3]]
+            index.doc_terms[name].append(term)
+        # 行の開始位置とポスティングが参照している間はメモリマップを閉じない
+        index.buffer = buffer
+        return documents, index, fingerprints
+    except Exception as e:
+        print(f"インデックスのスナップショット読み込みエラー ({path}): {e}")
+        return None
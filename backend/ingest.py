@@ -0,0 +1,250 @@
+"""
+ドキュメントの取り込み
+ファイルを少しずつ読み込み、見出し・段落の区切りに沿ったチャンクに分割する
+"""
+import hashlib
+import io
+import re
+from array import array
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # PDFの読み込みは任意（pypdfがなければPDFは検索対象外）
+    PdfReader = None
+
+from document_text import DocumentText
+
+PDF_SUPPORTED = PdfReader is not None
+TEXT_EXTENSIONS = ('.txt', '.md')
+SUPPORTED_EXTENSIONS = TEXT_EXTENSIONS + (('.pdf',) if PDF_SUPPORTED else ())
+
+# 1チャンクの最大文字数（超える場合は段落の区切り、なければ行の区切りで分ける）
+CHUNK_MAX_CHARS = 800
+# ハッシュ計算・読み込みの単位（バイト）
+READ_BLOCK_SIZE = 1 << 16
+
+# Markdownの見出し（# 〜 ######）
+_MARKDOWN_HEADING = re.compile(r'^(#{1,6})\s+(.+?)\s*#*\s*$')
+# 「1. 」「2．」などの番号付き見出し
+_NUMBERED_HEADING = re.compile(r'^\d+[.．]\s*(\S.*)$')
+# 番号付き見出しの階層（Markdownの見出しより下）
+_NUMBERED_LEVEL = 7
+
+class Chunk:
+    """
+    検索の単位となるドキュメントの一部分
+    
+    IDはドキュメント名・見出しの階層・同じ見出しの中での順番から作るため、
+    ほかのセクションを編集しても変わらない
+    """
+    
+    __slots__ = ('id', 'document', 'start_line', 'end_line', 'heading')
+    
+    def __init__(self, chunk_id: str, document: str, start_line: int, end_line: int, heading: str = ''):
+        self.id = chunk_id
+        self.document = document
+        # 1始まり、終端を含む
+        self.start_line = start_line
+        self.end_line = end_line
+        # 見出しの階層（「大見出し > 中見出し」）
+        self.heading = heading
+
+def chunk_id(document: str, heading: str, ordinal: int) -> str:
+    raw = f"{document}\0{heading}\0{ordinal}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+def _heading(line: str, allow_numbered: bool = True) -> Optional[Tuple[int, str]]:
+    """
+    見出し行なら (階層, 見出し) を返す
+    
+    番号付きの行は、段落の先頭にある短い行だけを見出しとみなす（番号付きリストの項目と区別するため）
+    """
+    stripped = line.strip()
+    match = _MARKDOWN_HEADING.match(stripped)
+    if match:
+        return len(match.group(1)), match.group(2)
+    match = _NUMBERED_HEADING.match(stripped) if allow_numbered else None
+    if match and len(stripped) <= 40:
+        return _NUMBERED_LEVEL, stripped
+    return None
+
+def split_chunks(document: str, lines: Iterable[str], max_chars: int = CHUNK_MAX_CHARS) -> List[Chunk]:
+    """
+    行を順に受け取り、見出しと段落の区切りでチャンクに分割する
+    
+    - 見出しごとに新しいチャンクを始める（見出しだけの行は次の本文と同じチャンクにする）
+    - 長いセクションは最大文字数を超える前の段落の区切り（なければ行）で分ける
+    - チャンクの前後の空行は含めない
+    
+    Args:
+        document: ドキュメント名（チャンクIDに使用）
+        lines: 行（ファイル全体を読み込まずに渡せるよう、イテレータでもよい）
+        max_chars: 1チャンクの最大文字数
+    """
+    splitter = _ChunkSplitter(document, max_chars)
+    for line_no, line in enumerate(lines, 1):
+        splitter.add(line_no, line.rstrip('\r\n'))
+    splitter.close()
+    return splitter.chunks
+
+class _ChunkSplitter:
+    """split_chunks() の作業用の状態"""
+    
+    def __init__(self, document: str, max_chars: int):
+        self.document = document
+        self.max_chars = max_chars
+        self.chunks: List[Chunk] = []
+        # 見出しの階層 [(階層, 見出し)]
+        self.headings: List[Tuple[int, str]] = []
+        # 見出しごとのチャンク数（IDの順番に使用）
+        self.ordinals = {}
+        # 作成中のチャンク
+        self.start = None
+        self.end = None
+        self.size = 0
+        self.has_body = False
+        self.heading = ''
+        # 直前の段落の区切り (区切り前の最後の行, その時点の文字数, 区切り後の最初の行)
+        self.paragraph_break = None
+        self.after_blank = False
+        # 直前の行が空行（またはファイルの先頭）か
+        self.previous_blank = True
+    
+    def add(self, line_no: int, line: str):
+        if not line.strip():
+            self.after_blank = self.start is not None
+            self.previous_blank = True
+            return
+        
+        heading = _heading(line, allow_numbered=self.previous_blank)
+        self.previous_blank = False
+        if heading is not None:
+            if self.has_body:
+                self.close()
+            level, title = heading
+            while self.headings and self.headings[-1][0] >= level:
+                self.headings.pop()
+            self.headings.append((level, title))
+        else:
+            if self.after_blank and self.has_body:
+                self.paragraph_break = (self.end, self.size, line_no)
+            if self.has_body and self.size + len(line) > self.max_chars:
+                self._split()
+        self.after_blank = False
+        
+        if self.start is None:
+            self.start = line_no
+        if heading is not None or not self.has_body:
+            # 見出しが続く場合は最も深い見出しをチャンクの見出しにする
+            self.heading = ' > '.join(title for _, title in self.headings)
+        self.end = line_no
+        self.size += len(line) + 1
+        if heading is None:
+            self.has_body = True
+    
+    def _split(self):
+        """長くなったチャンクを直前の段落の区切り（なければ現在の行の手前）で分ける"""
+        if self.paragraph_break is None:
+            self.close()
+            return
+        break_end, break_size, next_start = self.paragraph_break
+        carried_size = self.size - break_size
+        end = self.end
+        self.end = break_end
+        self.close()
+        # 区切り以降の行は同じ見出しの次のチャンクとして続ける
+        self.start = next_start
+        self.end = end
+        self.size = carried_size
+        self.has_body = True
+    
+    def close(self):
+        """作成中のチャンクを確定"""
+        if self.start is not None:
+            ordinal = self.ordinals.get(self.heading, 0)
+            self.ordinals[self.heading] = ordinal + 1
+            self.chunks.append(Chunk(chunk_id(self.document, self.heading, ordinal), self.document,
+                                     self.start, self.end, self.heading))
+        self.start = None
+        self.end = None
+        self.size = 0
+        self.has_body = False
+        self.paragraph_break = None
+        self.after_blank = False
+
+class _HashingReader(io.RawIOBase):
+    """読み込んだバイト列のハッシュを計算しながら読むファイル"""
+    
+    def __init__(self, f, hasher):
+        self.f = f
+        self.hasher = hasher
+    
+    def readable(self) -> bool:
+        return True
+    
+    def readinto(self, buffer) -> int:
+        size = self.f.readinto(buffer)
+        if size:
+            self.hasher.update(memoryview(buffer)[:size])
+        return size
+
+def _read_lines(path: str, hasher) -> Iterator[str]:
+    """
+    テキストファイルを1行ずつ読み込み、読んだバイト列のハッシュも計算する
+    
+    テキストモードと同じく改行（\r\n・\r）を \n に変換する（Windowsで作成したファイルの \r を本文に残さない）
+    """
+    with open(path, 'rb') as f, \
+            io.TextIOWrapper(io.BufferedReader(_HashingReader(f, hasher), READ_BLOCK_SIZE), encoding='utf-8') as text:
+        yield from text
+
+def _read_pdf_lines(path: str, hasher) -> Iterator[str]:
+    """PDFからページごとにテキストを取り出す（ページの間は空行で区切る）"""
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_BLOCK_SIZE), b''):
+            hasher.update(block)
+    reader = PdfReader(path)
+    for page_no, page in enumerate(reader.pages):
+        if page_no:
+            yield '\n'
+        text = page.extract_text() or ''
+        for line in text.splitlines():
+            yield line + '\n'
+
+def ingest_file(path: str, name: str) -> Tuple[DocumentText, str]:
+    """
+    ファイルを読み込んでチャンクに分割
+    
+    行を読みながらチャンクの区切りを決めるため、分割のためにファイル全体を
+    もう一度走査することはない。本文は行ごとの文字列を残さずにバッファへ書き足し、
+    行の開始位置も読みながら記録する（読み込み中に本文の複製や行のリストを持たない）。
+    
+    Returns:
+        (チャンク付きのドキュメント, ファイルの内容のSHA-256)
+    """
+    hasher = hashlib.sha256()
+    if name.lower().endswith('.pdf'):
+        if not PDF_SUPPORTED:
+            raise RuntimeError('PDFを読み込むには pypdf をインストールしてください')
+        source = _read_pdf_lines(path, hasher)
+    else:
+        source = _read_lines(path, hasher)
+    
+    buffer = io.StringIO()
+    starts = array('I', [0])
+    
+    def collect():
+        position = 0
+        for line in source:
+            buffer.write(line)
+            position += len(line)
+            # 各行の末尾以外に改行は含まれない（改行は \n に変換済み）
+            if line.endswith('\n'):
+                starts.append(position)
+            yield line
+    
+    chunks = split_chunks(name, collect())
+    text = buffer.getvalue()
+    buffer.close()
+    return DocumentText(name, text, starts, chunks=chunks), hasher.hexdigest()
@@ -0,0 +1,263 @@
+"""
+リクエストのレイテンシ計測
+処理段階ごとの所要時間とOllamaの生成統計を集計し、Prometheusのテキスト形式で出力する
+"""
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+# 秒単位のヒストグラムの区切り
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# トークン/秒のヒストグラムの区切り
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# 処理中のリクエストの計測情報（スレッドごと）
+_current_trace = contextvars.ContextVar('request_trace', default=None)
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: str = '') -> str:
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """ラベルごとの累積値"""
+    
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(labels)} {_format_value(value)}')
+        return lines
+
+class Histogram:
+    """ラベルごとの分布（累積バケット・合計・件数）"""
+    
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        # {labels: [バケットごとの件数..., 合計, 件数]}
+        self._values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, data in sorted(self._values.items()):
+                label_text = _format_labels(labels)
+                for bound, count in zip(self.buckets + (float('inf'),), data[:-2] + [data[-1]]):
+                    bucket_labels = _format_labels(labels, 'le="%s"' % _format_value(bound))
+                    lines.append(f'{self.name}_bucket{bucket_labels} {count}')
+                lines.append(f'{self.name}_sum{label_text} {_format_value(data[-2])}')
+                lines.append(f'{self.name}_count{label_text} {data[-1]}')
+        return lines
+
+class RequestTrace:
+    """1リクエスト分の計測情報"""
+    
+    def __init__(self, function_type: str, endpoint: str):
+        self.function_type = function_type
+        self.endpoint = endpoint
+        self.status = 'success'
+        self.started_at = time.perf_counter()
+        # {段階: 所要時間（秒）}
+        self.spans: Dict[str, float] = {}
+        # Ollamaが返した生成統計など
+        self.details: Dict[str, object] = {}
+
+class Metrics:
+    """アプリケーション全体の計測値"""
+    
+    def __init__(self, prefix: str = 'assistant', request_log: bool = False):
+        """
+        Args:
+            prefix: メトリクス名の接頭辞
+            request_log: Trueならリクエストごとに計測結果をJSON 1行で出力する
+        """
+        self.request_log = request_log
+        self.requests = Counter(f'{prefix}_requests_total', 'Number of handled requests')
+        self.request_seconds = Histogram(f'{prefix}_request_seconds', 'Request latency in seconds')
+        self.stage_seconds = Histogram(f'{prefix}_stage_seconds', 'Latency of each request stage in seconds')
+        self.first_token_seconds = Histogram(
+            f'{prefix}_time_to_first_token_seconds', 'Time until the first streamed token in seconds')
+        self.ollama_prompt_tokens = Counter(f'{prefix}_ollama_prompt_tokens_total', 'Prompt tokens evaluated by Ollama')
+        self.ollama_generated_tokens = Counter(f'{prefix}_ollama_generated_tokens_total', 'Tokens generated by Ollama')
+        self.ollama_prompt_eval_seconds = Histogram(
+            f'{prefix}_ollama_prompt_eval_seconds', 'Prompt evaluation time reported by Ollama')
+        self.ollama_eval_seconds = Histogram(f'{prefix}_ollama_eval_seconds', 'Generation time reported by Ollama')
+        self.ollama_load_seconds = Histogram(f'{prefix}_ollama_load_seconds', 'Model load time reported by Ollama')
+        self.ollama_tokens_per_second = Histogram(
+            f'{prefix}_ollama_tokens_per_second', 'Generation speed reported by Ollama', TOKENS_PER_SECOND_BUCKETS)
+        self._collectors = [
+            self.requests, self.request_seconds, self.stage_seconds, self.first_token_seconds,
+            self.ollama_prompt_tokens, self.ollama_generated_tokens, self.ollama_prompt_eval_seconds,
+            self.ollama_eval_seconds, self.ollama_load_seconds, self.ollama_tokens_per_second
+        ]
+        # 出力時に値を取得するゲージ・カウンター {名前: (種類, 説明, 値を返す関数)}
+        self._callbacks: Dict[str, Tuple[str, str, Callable[[], float]]] = {}
+    
+    def register_gauge(self, name: str, help_text: str, func: Callable[[], float]):
+        """出力時に値を取得するゲージを登録"""
+        self._callbacks[name] = ('gauge', help_text, func)
+    
+    def register_counter(self, name: str, help_text: str, func: Callable[[], float]):
+        """
+        出力時に値を取得するカウンターを登録（増えるだけの累積値。名前は _total で終わる）
+        
+        キャッシュのヒット数など、他のオブジェクトが数えている値を出力するときに使う
+        """
+        if not name.endswith('_total'):
+            raise ValueError(f"カウンターの名前は _total で終わる必要があります: {name}")
+        self._callbacks[name] = ('counter', help_text, func)
+    
+    @staticmethod
+    def current_trace() -> Optional[RequestTrace]:
+        return _current_trace.get()
+    
+    @contextmanager
+    def trace(self, function_type: str, endpoint: str):
+        """
+        リクエスト全体を計測
+        
+        この中で実行された span() や record_ollama_stats() はこのリクエストに紐づく
+        """
+        trace = RequestTrace(function_type, endpoint)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        except Exception:
+            trace.status = 'error'
+            raise
+        finally:
+            _current_trace.reset(token)
+            elapsed = time.perf_counter() - trace.started_at
+            self.requests.inc(function_type=function_type, endpoint=endpoint, status=trace.status)
+            self.request_seconds.observe(elapsed, function_type=function_type, endpoint=endpoint)
+            if self.request_log:
+                print(json.dumps({
+                    'event': 'request',
+                    'endpoint': endpoint,
+                    'function_type': function_type,
+                    'status': trace.status,
+                    'duration_ms': round(elapsed * 1000, 1),
+                    'spans_ms': {stage: round(seconds * 1000, 1) for stage, seconds in trace.spans.items()},
+                    **trace.details
+                }, ensure_ascii=False))
+    
+    @contextmanager
+    def span(self, stage: str):
+        """処理段階（search, prompt_build, ollama_http, ollama_cli など）の所要時間を計測"""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started_at
+            trace = _current_trace.get()
+            function_type = trace.function_type if trace else 'none'
+            self.stage_seconds.observe(elapsed, function_type=function_type, stage=stage)
+            if trace is not None:
+                trace.spans[stage] = trace.spans.get(stage, 0.0) + elapsed
+    
+    def record_first_token(self, seconds: float):
+        """ストリーミングで最初のトークンが届くまでの時間を記録"""
+        trace = _current_trace.get()
+        function_type = trace.function_type if trace else 'none'
+        self.first_token_seconds.observe(seconds, function_type=function_type)
+        if trace is not None:
+            trace.details['time_to_first_token_ms'] = round(seconds * 1000, 1)
+    
+    def record_ollama_stats(self, result: Dict):
+        """
+        Ollamaの /api/generate の応答（ストリーミングの場合は最後のチャンク）から生成統計を記録
+        
+        時間はナノ秒単位で返される
+        """
+        trace = _current_trace.get()
+        function_type = trace.function_type if trace else 'none'
+        model = result.get('model', '')
+        prompt_tokens = result.get('prompt_eval_count') or 0
+        eval_tokens = result.get('eval_count') or 0
+        prompt_eval_seconds = (result.get('prompt_eval_duration') or 0) / 1e9
+        eval_seconds = (result.get('eval_duration') or 0) / 1e9
+        load_seconds = (result.get('load_duration') or 0) / 1e9
+        
+        self.ollama_prompt_tokens.inc(prompt_tokens, function_type=function_type, model=model)
+        self.ollama_generated_tokens.inc(eval_tokens, function_type=function_type, model=model)
+        if 'prompt_eval_duration' in result:
+            self.ollama_prompt_eval_seconds.observe(prompt_eval_seconds, function_type=function_type, model=model)
+        if 'eval_duration' in result:
+            self.ollama_eval_seconds.observe(eval_seconds, function_type=function_type, model=model)
+        if 'load_duration' in result:
+            self.ollama_load_seconds.observe(load_seconds, function_type=function_type, model=model)
+        tokens_per_second = eval_tokens / eval_seconds if eval_seconds > 0 else 0.0
+        if tokens_per_second:
+            self.ollama_tokens_per_second.observe(tokens_per_second, function_type=function_type, model=model)
+        
+        if trace is not None:
+            trace.details['ollama'] = {
+                'model': model,
+                'prompt_tokens': prompt_tokens,
+                'generated_tokens': eval_tokens,
+                'prompt_eval_ms': round(prompt_eval_seconds * 1000, 1),
+                'eval_ms': round(eval_seconds * 1000, 1),
+                'load_ms': round(load_seconds * 1000, 1),
+                'tokens_per_second': round(tokens_per_second, 2)
+            }
+    
+    def record_model_load(self, model: str, load_seconds: float):
+        """
+        ウォームアップでのモデルの読み込み時間を記録
+        
+        リクエストの読み込み時間（record_ollama_stats）と区別するため、機能タイプは 'warmup' とする
+        """
+        self.ollama_load_seconds.observe(load_seconds, function_type='warmup', model=model)
+    
+    def render_prometheus(self) -> str:
+        """Prometheusのテキスト形式で出力"""
+        lines = []
+        for collector in self._collectors:
+            lines.extend(collector.render())
+        for name, (kind, help_text, func) in sorted(self._callbacks.items()):
+            try:
+                value = func()
+            except Exception:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,245 @@
+"""
+Ollamaの非同期クライアント
+asyncioで多数の生成リクエストを同時に処理するためのクライアント（リモートのOllama向け）
+"""
+import asyncio
+import json
+
+import aiohttp
+
+from ollama_client import (
+    OllamaClientBase, CONNECT_TIMEOUT, GENERATE_TIMEOUT, LIST_TIMEOUT, PULL_TIMEOUT, HEALTH_TIMEOUT
+)
+
+class AsyncOllamaClient(OllamaClientBase):
+    """
+    OllamaClientと同じメソッドを持つ非同期版のクライアント
+    
+    使用例:
+        async with AsyncOllamaClient(api_url=os.getenv('OLLAMA_API_URL')) as client:
+            answers = await asyncio.gather(*(client.chat(q) for q in questions))
+    """
+    
+    def __init__(self, ollama_path=None, api_url=None, connect_timeout=CONNECT_TIMEOUT, pool_maxsize=100,
+                 prompts=None, keep_alive=None, sensor_analyzer=None):
+        """
+        初期化
+        
+        Args:
+            ollama_path: ローカルのOllama実行ファイルのパス（ローカル環境のみ）
+            api_url: Ollama APIのURL（デフォルト: http://localhost:11434）
+            connect_timeout: 接続確立のタイムアウト（秒）
+            pool_maxsize: 同時に保持する接続の最大数
+            prompts: 機能タイプごとのテンプレートと生成オプション（PromptRegistry、Noneなら標準）
+            keep_alive: 最後のリクエストからモデルをメモリに残す時間（"30m"、秒数、-1で無期限。NoneならOllamaの既定値）
+            sensor_analyzer: 異常検知の前処理（SensorAnalyzer、Noneなら標準の設定）
+        """
+        super().__init__(ollama_path, api_url, connect_timeout, prompts, keep_alive, sensor_analyzer)
+        self.pool_maxsize = pool_maxsize
+        self._session = None
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+    
+    def _client_timeout(self, read_timeout):
+        return aiohttp.ClientTimeout(connect=self.connect_timeout, sock_read=read_timeout)
+    
+    @property
+    def session(self):
+        """接続を使い回すセッション（イベントループ内で初回使用時に作成）"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_maxsize, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+    
+    async def close(self):
+        """保持している接続を閉じる"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+    
+    async def _run_ollama(self, prompt, system_prompt=None, function_type='chatbot'):
+        """Ollamaを実行してレスポンスを取得（function_type は生成オプションの選択に使用）"""
+        full_prompt = f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
+        try:
+            payload = self._build_payload(prompt, system_prompt, function_type=function_type)
+            async with self.session.post(self.api_url, json=payload,
+                                         timeout=self._client_timeout(GENERATE_TIMEOUT)) as response:
+                if response.status == 200:
+                    result = await response.json(content_type=None)
+                    return result.get("response", "").strip()
+            # APIが利用できない場合はコマンドラインを試す
+            return await self._run_ollama_cli(full_prompt)
+        except Exception as e:
+            print(f"Ollama APIエラー: {e}")
+            # フォールバック: コマンドライン実行
+            return await self._run_ollama_cli(full_prompt)
+    
+    async def _stream_ollama(self, prompt, system_prompt=None, function_type='chatbot'):
+        """
+        Ollamaをストリーミングモードで実行し、生成されたテキストを順に返す非同期ジェネレータ
+        
+        HTTP APIが使えない場合はコマンドライン実行（またはデモ応答）の結果をまとめて1回で返す
+        """
+        full_prompt = f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
+        received = False
+        try:
+            payload = self._build_payload(prompt, system_prompt, stream=True, function_type=function_type)
+            async with self.session.post(self.api_url, json=payload,
+                                         timeout=self._client_timeout(GENERATE_TIMEOUT)) as response:
+                if response.status != 200:
+                    yield await self._run_ollama_cli(full_prompt)
+                    return
+                
+                # NDJSON: 1行に1つのJSONオブジェクト
+                async for line in response.content:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        data = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if data.get("error"):
+                        raise RuntimeError(data["error"])
+                    text = data.get("response", "")
+                    if text:
+                        received = True
+                        yield text
+                    if data.get("done"):
+                        break
+        except Exception as e:
+            print(f"Ollama APIエラー（ストリーミング）: {e}")
+            # 途中まで返している場合はそこで打ち切る
+            if not received:
+                yield await self._run_ollama_cli(full_prompt)
+    
+    async def _run_ollama_cli(self, prompt):
+        """コマンドライン経由でOllamaを実行（フォールバック）"""
+        if not self.ollama_path:
+            # 外部のOllamaサーバーを使う環境ではコマンドラインを使えない
+            return self._get_demo_response(prompt)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.ollama_path, "run", self.model, prompt,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                stdout, _ = await asyncio.wait_for(process.communicate(), timeout=30)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                raise
+            
+            if process.returncode == 0:
+                return stdout.decode('utf-8', errors='replace').strip()
+            else:
+                return self._get_demo_response(prompt)
+        except Exception as e:
+            print(f"Ollama CLI実行エラー: {e}")
+            return self._get_demo_response(prompt)
+    
+    async def list_models(self):
+        """インストール済みモデル一覧を取得"""
+        try:
+            async with self.session.get(self.list_url, timeout=self._client_timeout(LIST_TIMEOUT)) as response:
+                if response.status == 200:
+                    return self._parse_model_names(await response.json(content_type=None))
+        except Exception as e:
+            print(f"モデル一覧取得エラー（API）: {e}")
+        return []
+    
+    async def model_exists(self, model_name):
+        """指定されたモデルがインストールされているか確認"""
+        models = await self.list_models()
+        return model_name in models
+    
+    async def download_model(self, model_name):
+        """モデルをダウンロード"""
+        print(f"\nモデル '{model_name}' をダウンロードしています...")
+        try:
+            payload = {"name": model_name}
+            async with self.session.post(self.pull_url, json=payload,
+                                         timeout=self._client_timeout(PULL_TIMEOUT)) as response:
+                if response.status == 200:
+                    async for line in response.content:
+                        line = line.strip()
+                        if line:
+                            self._print_pull_progress(line)
+                    print(f"\n✓ モデル '{model_name}' のダウンロードが完了しました。\n")
+                    return True
+                print(f"モデルダウンロードエラー: ステータス {response.status}")
+        except asyncio.TimeoutError:
+            print("タイムアウト: モデルダウンロードに時間がかかりすぎています。")
+        except Exception as e:
+            print(f"モデルダウンロードエラー（API）: {e}")
+        return False
+    
+    async def check_ollama_running(self):
+        """Ollamaが起動しているか確認"""
+        try:
+            async with self.session.get(self.list_url, timeout=self._client_timeout(HEALTH_TIMEOUT)) as response:
+                return response.status == 200
+        except Exception:
+            return False
+    
+    async def ensure_model(self):
+        """モデルが存在することを確認し、なければダウンロード"""
+        if not await self.check_ollama_running():
+            print("警告: Ollamaが起動していないようです。")
+            return False
+        if await self.model_exists(self.model):
+            return True
+        return await self.download_model(self.model)
+    
+    def _preprocess(self, function_type, input_data):
+        """
+        機能タイプに応じた入力の前処理（現在は異常検知のセンサーデータのみ）
+        
+        Returns:
+            (モデルへの入力, モデルを使わずに返す結果またはNone)
+        """
+        if function_type != 'anomaly_detection':
+            return input_data, None
+        input_data, result, _ = self._analyze_sensor_data(input_data)
+        return input_data, result
+    
+    @staticmethod
+    async def _single(text):
+        """1回だけテキストを返す非同期ジェネレータ（モデルを使わずに返す結果のストリーミング用）"""
+        yield text
+    
+    async def chat(self, message):
+        """チャットボット機能"""
+        return await self._run_ollama(*self._build_prompt('chatbot', message))
+    
+    async def generate_daily_report(self, input_data):
+        """日報生成機能"""
+        return await self._run_ollama(*self._build_prompt('daily_report', input_data), function_type='daily_report')
+    
+    async def detect_anomaly(self, input_data):
+        """異常検知機能（数値の時系列は前処理して、要約と異常候補の区間だけをモデルに渡す）"""
+        input_data, result = self._preprocess('anomaly_detection', input_data)
+        if result is not None:
+            return result
+        return await self._run_ollama(*self._build_prompt('anomaly_detection', input_data), function_type='anomaly_detection')
+    
+    async def generate_production_plan(self, input_data):
+        """生産計画生成機能"""
+        return await self._run_ollama(*self._build_prompt('production_plan', input_data), function_type='production_plan')
+    
+    def stream(self, function_type, input_data):
+        """
+        機能タイプに応じた回答をストリーミングで生成
+        
+        使用例:
+            async for text in client.stream('chatbot', message):
+                ...
+        """
+        input_data, result = self._preprocess(function_type, input_data)
+        if result is not None:
+            return self._single(result)
+        return self._stream_ollama(*self._build_prompt(function_type, input_data), function_type=function_type)
@@ -1,19 +1,58 @@
 import subprocess
 import json
 import os
+import time
+from contextlib import nullcontext
 import requests
+from requests.adapters import HTTPAdapter
 
-class OllamaClient:
-    def __init__(self, ollama_path=None, api_url=None):
+from generation_scheduler import priority_for
+from ollama_health import HealthMonitor, ModelRegistry
+from ollama_router import ROUTE_LEAST_OUTSTANDING, Backend, BackendRouter
+from prompt_templates import PromptRegistry
+from sensor_analysis import SensorAnalyzer
+
+# タイムアウト（秒）: 接続の確立と応答の読み取りで別々に設定する
+CONNECT_TIMEOUT = 5
+GENERATE_TIMEOUT = 120
+LIST_TIMEOUT = 10
+PULL_TIMEOUT = 600
+HEALTH_TIMEOUT = 5
+EMBED_TIMEOUT = 60
+# モデルの読み込み（ウォームアップ）は生成より時間がかかることがある
+WARMUP_TIMEOUT = 300
+
+def _is_model_error(response):
+    """404がモデルがないことによるものか（APIがない古いサーバーの404と区別する）"""
+    try:
+        error = response.json().get('error', '')
+    except ValueError:
+        return False
+    return isinstance(error, str) and 'model' in error
+
+class OllamaClientBase:
+    """同期版・非同期版のクライアントで共通の設定とプロンプト作成"""
+    
+    def __init__(self, ollama_path=None, api_url=None, connect_timeout=CONNECT_TIMEOUT, prompts=None,
+                 keep_alive=None, sensor_analyzer=None):
         """
         初期化
         
         Args:
             ollama_path: ローカルのOllama実行ファイルのパス（ローカル環境のみ）
             api_url: Ollama APIのURL（デフォルト: http://localhost:11434）
+            connect_timeout: 接続確立のタイムアウト（秒）
+            prompts: 機能タイプごとのテンプレートと生成オプション（PromptRegistry、Noneなら標準）
+            keep_alive: 最後のリクエストからモデルをメモリに残す時間（"30m"、秒数、-1で無期限。NoneならOllamaの既定値）
+            sensor_analyzer: 異常検知の前処理（SensorAnalyzer、Noneなら標準の設定）
         """
         self.ollama_path = ollama_path
         self.model = "tinyllama"  # 軽量モデル（約637MB）
+        self.embedding_model = "nomic-embed-text"  # 意味検索用の埋め込みモデル
+        self.connect_timeout = connect_timeout
+        self.prompts = prompts if prompts is not None else PromptRegistry()
+        self.keep_alive = keep_alive
+        self.sensor_analyzer = sensor_analyzer if sensor_analyzer is not None else SensorAnalyzer()
         
         # API URLの設定
         if api_url:
@@ -21,44 +60,498 @@ class OllamaClient:
         else:
             base_url = "http://localhost:11434"
         
+        self.base_url = base_url
         self.api_url = f"{base_url}/api/generate"
         self.list_url = f"{base_url}/api/tags"
         self.pull_url = f"{base_url}/api/pull"
+        self.embed_url = f"{base_url}/api/embed"
+        self.embeddings_url = f"{base_url}/api/embeddings"
+    
+    def _timeout(self, read_timeout):
+        """(接続タイムアウト, 読み取りタイムアウト) を返す"""
+        return (self.connect_timeout, read_timeout)
+    
+    def _build_payload(self, prompt, system_prompt=None, stream=False, model=None, function_type=None):
+        """
+        /api/generate に送るリクエストを作成
         
-    def _run_ollama(self, prompt, system_prompt=None):
-        """Ollamaを実行してレスポンスを取得"""
+        Args:
+            model: 使うモデル（省略時は self.model）
+            function_type: 機能タイプ（生成オプションの選択に使用。省略時はチャットボット）
+        """
+        payload = {
+            "model": model or self.model,
+            "prompt": prompt,
+            "stream": stream,
+            "options": self.prompts.options(function_type)
+        }
+        
+        if system_prompt:
+            payload["system"] = system_prompt
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        return payload
+    
+    def _get_demo_response(self, prompt):
+        """デモ用のフォールバックレスポンス"""
+        return f"デモモード: あなたの質問「{prompt}」を受け取りました。実際のOllamaモデルが利用可能になると、より詳細な回答が提供されます。"
+    
+    def _parse_model_names(self, data):
+        """/api/tags の応答からモデル名（タグなし）の一覧を取得"""
+        models = [model.get('name', '').split(':')[0] for model in data.get('models', [])]
+        return list(set(models))  # 重複を除去
+    
+    def _print_pull_progress(self, line):
+        """/api/pull のストリーミング応答1行分の進捗を表示"""
         try:
-            # まずHTTP APIを試す
-            payload = {
-                "model": self.model,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.7,
-                    "num_predict": 500  # 最大トークン数を制限して高速化
+            data = json.loads(line)
+        except json.JSONDecodeError:
+            return
+        if 'status' in data:
+            status = data['status']
+            # 進捗情報を表示
+            if 'completed' in data and 'total' in data:
+                completed = data.get('completed', 0)
+                total = data.get('total', 0)
+                if total > 0:
+                    percent = (completed / total) * 100
+                    print(f"  進捗: {percent:.1f}% ({completed}/{total}) - {status}")
+                else:
+                    print(f"  {status}")
+            else:
+                print(f"  {status}")
+    
+    def _analyze_sensor_data(self, input_data):
+        """
+        異常検知の入力が数値の時系列（CSV・JSON）なら前処理する
+        
+        数千件の値をそのままモデルに渡す代わりに、要約と異常候補の区間だけを渡す。
+        異常の候補がない、またはすべてしきい値を超えているなど判断が明らかな場合は、モデルを使わずに結果を返す。
+        
+        Returns:
+            (モデルへの入力, モデルを使わずに返す結果またはNone, 解析結果またはNone)
+        """
+        analysis = self.sensor_analyzer.analyze_text(input_data) if isinstance(input_data, str) else None
+        if analysis is None:
+            return input_data, None, None
+        if analysis.clear_cut:
+            return input_data, analysis.report(), analysis
+        return analysis.to_prompt(), None, analysis
+    
+    def _build_prompt(self, function_type, input_data):
+        """
+        機能タイプに応じたプロンプトを作成（テンプレートに入力を埋め込む）
+        
+        Returns:
+            (prompt, system_prompt)
+        """
+        return self.prompts.render(function_type, input_data)
+
+class OllamaClient(OllamaClientBase):
+    def __init__(self, ollama_path=None, api_url=None, connect_timeout=CONNECT_TIMEOUT, pool_maxsize=10,
+                 cache=None, metrics=None, scheduler=None, model_cache_ttl=60, failure_threshold=3,
+                 retry_interval=30, backends=None, strategy=ROUTE_LEAST_OUTSTANDING, routes=None, sessions=None,
+                 prompts=None, keep_alive=None, sensor_analyzer=None):
+        """
+        初期化
+        
+        Args:
+            ollama_path: ローカルのOllama実行ファイルのパス（ローカル環境のみ）
+            api_url: Ollama APIのURL（デフォルト: http://localhost:11434）
+            connect_timeout: 接続確立のタイムアウト（秒）
+            pool_maxsize: 保持するkeep-alive接続の最大数（同時リクエスト数の目安）
+            cache: 応答キャッシュ（ResponseCache、Noneならキャッシュしない）
+            metrics: レイテンシ計測（Metrics、Noneなら計測しない）
+            scheduler: 同時実行数を制限するスケジューラ（GenerationScheduler、Noneなら制限しない）
+            model_cache_ttl: インストール済みモデルの一覧を再利用する時間（秒）
+            failure_threshold: 接続の失敗が何回続いたらOllamaが停止しているとみなすか
+            retry_interval: 停止しているとみなしてから再び接続を試すまでの時間（秒）
+            backends: 振り分け先のOllamaサーバー（Backendのリスト、Noneなら api_url の1台のみ）
+            strategy: 振り分け方式（'least_outstanding' または 'latency'）
+            routes: 機能タイプごとに使うモデル・サーバー {機能タイプ: {'model': モデル名, 'backend': サーバー名}}
+            sessions: 会話セッション（ChatSessionStore、Noneなら毎回独立した質問として扱う）
+            prompts: 機能タイプごとのテンプレートと生成オプション（PromptRegistry、Noneなら標準）
+            keep_alive: 最後のリクエストからモデルをメモリに残す時間（"30m"、秒数、-1で無期限。NoneならOllamaの既定値）
+            sensor_analyzer: 異常検知の前処理（SensorAnalyzer、Noneなら標準の設定）
+        """
+        super().__init__(ollama_path, api_url, connect_timeout, prompts, keep_alive, sensor_analyzer)
+        self.cache = cache
+        self.metrics = metrics
+        self.scheduler = scheduler
+        self.sessions = sessions
+        # サーバーごとのサーキットブレーカーで、停止中のサーバーにはリクエストを送らない
+        # （すべて停止している場合はタイムアウトを待たずにデモ応答を返す）
+        if not backends:
+            backends = [Backend(self.base_url, failure_threshold=failure_threshold, retry_interval=retry_interval)]
+        self.router = BackendRouter(backends, strategy, routes)
+        self.model_registry = ModelRegistry(self._fetch_models, model_cache_ttl)
+        self._health_monitor = None
+        self._warmer = None
+        # 直近のウォームアップの結果 {モデル: {サーバー名: {...}}}
+        self.warmups = {}
+        
+        # 接続を使い回すセッション（リクエストごとにTCP接続を張り直さない）
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+    
+    def close(self):
+        """保持している接続を閉じる"""
+        self.stop_health_monitor()
+        self.stop_warmer()
+        self.session.close()
+    
+    def start_health_monitor(self, interval=10):
+        """
+        Ollamaの死活確認をバックグラウンドで定期的に行う
+        
+        停止を検知するとリクエストをすぐにデモ応答へ切り替え、復旧を検知すると元に戻す
+        """
+        if self._health_monitor is None:
+            self._health_monitor = HealthMonitor(self.check_ollama_running, interval)
+        self._health_monitor.start()
+    
+    def stop_health_monitor(self, timeout=None):
+        if self._health_monitor is not None:
+            self._health_monitor.stop(timeout)
+    
+    def start_warmer(self, interval):
+        """
+        一定間隔でモデルのウォームアップを行う（keep_alive より短い間隔にすると、モデルがメモリから外されない）
+        
+        起動時のウォームアップは warm_up() で別に行うため、最初の実行は interval 秒後
+        """
+        if self._warmer is None:
+            self._warmer = HealthMonitor(self.warm_up, interval, name='ollama-warmup', initial_delay=True)
+        self._warmer.start()
+    
+    def stop_warmer(self, timeout=None):
+        if self._warmer is not None:
+            self._warmer.stop(timeout)
+    
+    def _warmup_targets(self):
+        """ウォームアップするモデルと、そのモデルで使うコンテキスト長 {モデル: num_ctx}"""
+        targets = {}
+        # コンテキスト長が異なるとOllamaはモデルを読み込み直すため、実際のリクエストと同じ値で読み込む
+        for function_type in self.prompts.templates:
+            model = self.router.model_for(function_type, self.model)
+            targets.setdefault(model, self.prompts.options(function_type).get('num_ctx'))
+        return targets
+    
+    def warm_up(self, models=None):
+        """
+        モデルをOllamaのメモリに読み込んでおく（空のプロンプトを送ると、生成せずに読み込みだけを行う）
+        
+        最初のユーザーがモデルの読み込みを待たないよう、起動時（と一定間隔）に呼び出す。
+        読み込みにかかった時間は生成時間とは別に記録する。
+        
+        Args:
+            models: 読み込むモデルのリスト（省略時は既定のモデルと機能タイプごとに指定したモデル）
+        
+        Returns:
+            読み込めた（モデル, サーバー）の数
+        """
+        targets = self._warmup_targets() if models is None else {model: None for model in models}
+        loaded = 0
+        for model, num_ctx in targets.items():
+            payload = {"model": model, "prompt": "", "stream": False}
+            if num_ctx:
+                payload["options"] = {"num_ctx": num_ctx}
+            if self.keep_alive is not None:
+                payload["keep_alive"] = self.keep_alive
+            for backend in self.router.candidates(model):
+                if not backend.breaker.allow():
+                    continue
+                started_at = time.perf_counter()
+                try:
+                    response = self.session.post(backend.api_url, json=payload,
+                                                 timeout=self._timeout(WARMUP_TIMEOUT))
+                except requests.exceptions.RequestException as e:
+                    backend.record_probe(str(e))
+                    print(f"ウォームアップエラー（{model}、{backend.name}）: {e}")
+                    continue
+                if response.status_code != 200:
+                    backend.record_probe(f"HTTP {response.status_code}" if response.status_code >= 500 else None)
+                    print(f"ウォームアップエラー（{model}、{backend.name}）: HTTP {response.status_code}")
+                    continue
+                backend.record_probe()
+                try:
+                    result = response.json()
+                except ValueError:
+                    result = {}
+                load_seconds = (result.get("load_duration") or 0) / 1e9
+                if self.metrics is not None:
+                    self.metrics.record_model_load(model, load_seconds)
+                self.warmups.setdefault(model, {})[backend.name] = {
+                    'load_ms': round(load_seconds * 1000, 1),
+                    'elapsed_ms': round((time.perf_counter() - started_at) * 1000, 1),
+                    'at': time.time()
                 }
-            }
-            
-            if system_prompt:
-                payload["system"] = system_prompt
-            
-            response = requests.post(self.api_url, json=payload, timeout=120)
-            
-            if response.status_code == 200:
+                loaded += 1
+        return loaded
+    
+    def health(self):
+        """接続状態（サーバーごとの処理数・レイテンシ・サーキットブレーカー）とモデル一覧のキャッシュの状態"""
+        monitor = self._health_monitor
+        return {
+            'base_url': self.base_url,
+            'available': self.router.available,
+            'last_checked': monitor.last_checked if monitor is not None else None,
+            'models': self.model_registry.stats(),
+            'routing': self.router.stats(),
+            'prompts': self.prompts.stats(),
+            'keep_alive': self.keep_alive,
+            'warmup': self.warmups
+        }
+    
+    def _span(self, stage):
+        """処理段階の計測（計測しない場合は何もしない）"""
+        if self.metrics is None:
+            return nullcontext()
+        return self.metrics.span(stage)
+    
+    def _slot(self, function_type):
+        """
+        生成の実行枠を取得（スケジューラがない場合は何もしない）
+        
+        Raises:
+            QueueFullError: 待ち行列が一杯、または待ち時間の上限を超えた
+        """
+        if self.scheduler is None:
+            return nullcontext()
+        return self.scheduler.slot(priority_for(function_type), self.metrics)
+    
+    def _preprocess(self, function_type, input_data):
+        """
+        機能タイプに応じた入力の前処理（現在は異常検知のセンサーデータのみ）
+        
+        Returns:
+            (モデルへの入力, モデルを使わずに返す結果またはNone)
+        """
+        if function_type != 'anomaly_detection':
+            return input_data, None
+        with self._span('preprocess'):
+            input_data, result, analysis = self._analyze_sensor_data(input_data)
+        if analysis is not None and self.metrics is not None:
+            trace = self.metrics.current_trace()
+            if trace is not None:
+                trace.details['sensor_analysis'] = analysis.stats()
+        return input_data, result
+    
+    def _record_cache_hit(self):
+        if self.metrics is not None:
+            trace = self.metrics.current_trace()
+            if trace is not None:
+                trace.details['cache_hit'] = True
+    
+    def _cache_key(self, payload):
+        """応答キャッシュのキー（キャッシュ無効ならNone）"""
+        if self.cache is None:
+            return None
+        return self.cache.make_key(payload["model"], payload.get("system"), payload["prompt"], payload["options"])
+    
+    def _prepare_generation(self, prompt, system_prompt, function_type, session_id, stream=False):
+        """
+        リクエストと会話セッションを準備
+        
+        会話の続きでは前回の応答の context（過去のやり取りのトークン列）を付けて送る。
+        Ollamaは context と一致する先頭部分の評価を省略するため、新しい質問の部分だけが評価される。
+        会話の続きは過去のやり取りによって回答が変わるため応答キャッシュを使わない。
+        最初の質問はキャッシュを使う（キャッシュから返した場合は context がないため、次の質問は新しい会話になる）。
+        
+        Returns:
+            (payload, 応答キャッシュのキー, セッション)
+        """
+        model = self.router.model_for(function_type, self.model)
+        payload = self._build_payload(prompt, system_prompt, stream=stream, model=model, function_type=function_type)
+        session = None
+        if session_id and self.sessions is not None:
+            session = self.sessions.get(session_id, model)
+        if session is None or not session.context:
+            return payload, self._cache_key(payload), session
+        payload["context"] = session.context.tolist()
+        return payload, None, session
+    
+    def _run_ollama(self, prompt, system_prompt=None, cache_tags=(), function_type='chatbot', priority=None,
+                    session_id=None):
+        """
+        Ollamaを実行してレスポンスを取得
+        
+        Args:
+            prompt: プロンプト
+            system_prompt: システムプロンプト
+            cache_tags: 応答キャッシュに付けるタグ（参照したドキュメント名。更新時の無効化に使用）
+            function_type: 機能タイプ（使うモデル・サーバーとスケジューラの優先度に使用）
+            priority: スケジューラの優先度に使う機能タイプ（省略時は function_type）
+            session_id: 会話セッションのID（指定すると前回までのやり取りを引き継ぐ）
+        
+        Raises:
+            QueueFullError: スケジューラの待ち行列が一杯、または待ち時間の上限を超えた
+        """
+        payload, cache_key, session = self._prepare_generation(prompt, system_prompt, function_type, session_id)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self._record_cache_hit()
+                return cached
+        
+        with self._slot(priority or function_type):
+            return self._generate(payload, cache_key, cache_tags, function_type, session)
+    
+    def _generate(self, payload, cache_key=None, cache_tags=(), function_type=None, session=None):
+        """
+        HTTP API（失敗時はコマンドライン）で生成
+        
+        接続できない・エラーを返したサーバーがあれば、同じモデルを使える別のサーバーで再試行する
+        """
+        prompt = payload["prompt"]
+        system_prompt = payload.get("system")
+        attempted = False
+        prefer = session.backend if session is not None else None
+        for backend in self.router.attempts(payload["model"], function_type, prefer):
+            attempted = True
+            started = backend.begin()
+            try:
+                with self._span('ollama_http'):
+                    response = self.session.post(backend.api_url, json=payload,
+                                                 timeout=self._timeout(GENERATE_TIMEOUT))
+                if response.status_code != 200:
+                    # 5xxはサーバーの障害、4xx（モデルがないなど）はサーバー自体は稼働している
+                    print(f"Ollama APIエラー（{backend.name}）: HTTP {response.status_code}")
+                    backend.finish(started, ok=False,
+                                   error=f"HTTP {response.status_code}" if response.status_code >= 500 else None)
+                    continue
                 result = response.json()
-                return result.get("response", "").strip()
-            else:
-                # APIが利用できない場合はコマンドラインを試す
-                full_prompt = f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
-                return self._run_ollama_cli(full_prompt)
-        except (requests.exceptions.RequestException, Exception) as e:
-            print(f"Ollama APIエラー: {e}")
-            # フォールバック: コマンドライン実行
-            full_prompt = f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
-            return self._run_ollama_cli(full_prompt)
+            except Exception as e:
+                print(f"Ollama APIエラー（{backend.name}）: {e}")
+                backend.finish(started, ok=False,
+                               error=str(e) if isinstance(e, requests.exceptions.RequestException) else None)
+                continue
+            backend.finish(started)
+            
+            if self.metrics is not None:
+                self.metrics.record_ollama_stats(result)
+            text = result.get("response", "").strip()
+            # フォールバック（CLI・デモ応答）の結果はキャッシュしない
+            if cache_key is not None and text:
+                self.cache.set(cache_key, text, cache_tags)
+            if session is not None:
+                self.sessions.update(session, result.get("context"), backend.name)
+            return text
+        
+        if not attempted:
+            # すべてのサーバーが停止しているとみなしている間は、タイムアウトを待たずにデモ応答を返す
+            return self._get_demo_response(prompt)
+        # APIが利用できない場合はコマンドラインを試す
+        full_prompt = f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
+        return self._run_ollama_cli(full_prompt)
+    
+    def _stream_ollama(self, prompt, system_prompt=None, cache_tags=(), function_type='chatbot', session_id=None):
+        """
+        Ollamaをストリーミングモードで実行し、生成されたテキストを順に返すジェネレータ
+        
+        HTTP APIが使えない場合はコマンドライン実行（またはデモ応答）の結果をまとめて1回で返す。
+        キャッシュに同じ応答がある場合はまとめて1回で返す。
+        
+        Raises:
+            QueueFullError: スケジューラの待ち行列が一杯、または待ち時間の上限を超えた
+        """
+        payload, cache_key, session = self._prepare_generation(prompt, system_prompt, function_type, session_id,
+                                                               stream=True)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self._record_cache_hit()
+                yield cached
+                return
+        
+        # 生成が終わる（またはクライアントが切断する）まで実行枠を保持する
+        with self._slot(function_type):
+            yield from self._generate_stream(payload, cache_key, cache_tags, function_type, session)
+    
+    def _generate_stream(self, payload, cache_key=None, cache_tags=(), function_type=None, session=None):
+        """
+        HTTP API（失敗時はコマンドライン）でストリーミング生成
+        
+        最初のテキストを返す前に失敗した場合のみ、別のサーバーで再試行する
+        """
+        prompt = payload["prompt"]
+        system_prompt = payload.get("system")
+        full_prompt = f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
+        received = False
+        attempted = False
+        started_at = time.perf_counter()
+        prefer = session.backend if session is not None else None
+        for backend in self.router.attempts(payload["model"], function_type, prefer):
+            attempted = True
+            chunks = []
+            ok = False
+            error = None
+            started = backend.begin()
+            try:
+                with self._span('ollama_http'), \
+                        self.session.post(backend.api_url, json=payload, stream=True,
+                                          timeout=self._timeout(GENERATE_TIMEOUT)) as response:
+                    if response.status_code != 200:
+                        print(f"Ollama APIエラー（ストリーミング、{backend.name}）: HTTP {response.status_code}")
+                        if response.status_code >= 500:
+                            error = f"HTTP {response.status_code}"
+                        continue
+                    
+                    # NDJSON: 1行に1つのJSONオブジェクト
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        try:
+                            data = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        if data.get("error"):
+                            raise RuntimeError(data["error"])
+                        text = data.get("response", "")
+                        if text:
+                            if not received and self.metrics is not None:
+                                self.metrics.record_first_token(time.perf_counter() - started_at)
+                            received = True
+                            chunks.append(text)
+                            yield text
+                        if data.get("done"):
+                            if self.metrics is not None:
+                                self.metrics.record_ollama_stats(data)
+                            # 最後まで生成できた場合のみキャッシュする
+                            if cache_key is not None and chunks:
+                                self.cache.set(cache_key, ''.join(chunks).strip(), cache_tags)
+                            if session is not None:
+                                self.sessions.update(session, data.get("context"), backend.name)
+                            break
+                    ok = True
+            except Exception as e:
+                print(f"Ollama APIエラー（ストリーミング、{backend.name}）: {e}")
+                if isinstance(e, requests.exceptions.RequestException):
+                    error = str(e)
+                # 途中まで返している場合はそこで打ち切る（別のサーバーで最初から生成し直さない）
+                if received:
+                    return
+            finally:
+                backend.finish(started, ok, error)
+            if ok:
+                return
+        
+        if not attempted:
+            yield self._get_demo_response(prompt)
+        else:
+            yield self._run_ollama_cli(full_prompt)
     
     def _run_ollama_cli(self, prompt):
         """コマンドライン経由でOllamaを実行（フォールバック）"""
+        if not self.ollama_path:
+            # 外部のOllamaサーバーを使う環境ではコマンドラインを使えない
+            return self._get_demo_response(prompt)
+        with self._span('ollama_cli'):
+            return self._run_ollama_cli_process(prompt)
+    
+    def _run_ollama_cli_process(self, prompt):
         try:
             cmd = [
                 self.ollama_path,
@@ -82,22 +575,118 @@ class OllamaClient:
             print(f"Ollama CLI実行エラー: {e}")
             return self._get_demo_response(prompt)
     
-    def _get_demo_response(self, prompt):
-        """デモ用のフォールバックレスポンス"""
-        return f"デモモード: あなたの質問「{prompt}」を受け取りました。実際のOllamaモデルが利用可能になると、より詳細な回答が提供されます。"
+    def embed(self, texts):
+        """
+        テキストの埋め込みベクトルを取得（意味検索用）
+        
+        テキストのリストを1回のリクエストで /api/embed に送る。/api/embed がない古いサーバー
+        （404が返る）では、1件ずつ /api/embeddings に送る。
+        デモ応答へのフォールバックはなく、取得できなければ例外を送出する
+        
+        Args:
+            texts: テキストのリスト
+        
+        Returns:
+            ベクトル（floatのリスト）のリスト
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        with self._span('embedding'):
+            vectors = self._embed_batch(texts)
+            if vectors is None:
+                vectors = [self._embed_one(text) for text in texts]
+        return vectors
     
-    def list_models(self):
-        """インストール済みモデル一覧を取得"""
-        try:
-            # HTTP APIで取得を試みる
-            response = requests.get(self.list_url, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                models = [model.get('name', '').split(':')[0] for model in data.get('models', [])]
-                return list(set(models))  # 重複を除去
-        except Exception as e:
-            print(f"モデル一覧取得エラー（API）: {e}")
+    def _embed_batch(self, texts):
+        """
+        まとめて埋め込みを取得（接続できない・5xxの場合は別のサーバーで再試行する）
+        
+        Returns:
+            ベクトルのリスト。/api/embed に対応していないサーバーに当たった場合はNone
+        """
+        last_error = None
+        for backend in self.router.attempts(self.embedding_model):
+            if not backend.batch_embed:
+                return None
+            started = backend.begin()
+            try:
+                response = self.session.post(
+                    backend.embed_url,
+                    json={"model": self.embedding_model, "input": texts},
+                    timeout=self._timeout(EMBED_TIMEOUT)
+                )
+                if response.status_code >= 500:
+                    response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                backend.finish(started, ok=False, error=str(e))
+                last_error = e
+                continue
+            backend.finish(started, ok=response.status_code == 200)
+            if response.status_code == 404 and not _is_model_error(response):
+                print(f"Ollama（{backend.name}）は /api/embed に対応していないため、1件ずつ埋め込みを取得します")
+                backend.batch_embed = False
+                return None
+            response.raise_for_status()
+            return response.json()["embeddings"]
+        if last_error is not None:
+            raise last_error
+        raise RuntimeError('Ollamaに接続できません')
+    
+    def _embed_one(self, text):
+        """1件分の埋め込みを取得（接続できない・5xxの場合は別のサーバーで再試行する）"""
+        last_error = None
+        for backend in self.router.attempts(self.embedding_model):
+            started = backend.begin()
+            try:
+                response = self.session.post(
+                    backend.embeddings_url,
+                    json={"model": self.embedding_model, "prompt": text},
+                    timeout=self._timeout(EMBED_TIMEOUT)
+                )
+                if response.status_code >= 500:
+                    response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                backend.finish(started, ok=False, error=str(e))
+                last_error = e
+                continue
+            backend.finish(started, ok=response.status_code == 200)
+            response.raise_for_status()
+            return response.json()["embedding"]
+        if last_error is not None:
+            raise last_error
+        raise RuntimeError('Ollamaに接続できません')
+    
+    def list_models(self, refresh=False):
+        """
+        インストール済みモデル一覧を取得
+        
+        一覧は一定時間キャッシュし、毎回APIやコマンドラインを呼び出さない
+        
+        Args:
+            refresh: Trueならキャッシュを使わずに取得し直す
+        """
+        return self.model_registry.get(refresh)
+    
+    def _fetch_models(self):
+        """
+        モデル一覧をAPI（失敗時はコマンドライン）で取得（取得できなければNone）
         
+        複数のサーバーがある場合は、いずれかのサーバーにあるモデルをすべて返す
+        """
+        models = None
+        for backend in self.router.backends:
+            # 停止しているとみなしているサーバーには問い合わせない
+            if not backend.breaker.allow():
+                continue
+            names = self._probe_backend(backend, LIST_TIMEOUT)
+            if names is not None:
+                models = (models or set()) | set(names)
+        if models is not None:
+            return list(models)
+        
+        if not self.ollama_path:
+            return None
         # フォールバック: コマンドラインで取得
         try:
             cmd = [self.ollama_path, "list"]
@@ -113,50 +702,41 @@ class OllamaClient:
         except Exception as e:
             print(f"モデル一覧取得エラー（CLI）: {e}")
         
-        return []
+        return None
     
     def model_exists(self, model_name):
-        """指定されたモデルがインストールされているか確認"""
-        models = self.list_models()
-        return model_name in models
+        """指定されたモデルがインストールされているか確認（一覧はキャッシュを使用）"""
+        return model_name in self.list_models()
     
     def download_model(self, model_name):
-        """モデルをダウンロード"""
+        """モデルをダウンロード（複数のサーバーがある場合は、そのモデルを使うすべてのサーバーにダウンロードする）"""
         print(f"\nモデル '{model_name}' をダウンロードしています...")
         print("（初回ダウンロードには数分かかる場合があります）\n")
-        try:
-            # HTTP APIでダウンロードを試みる
-            payload = {"name": model_name}
-            response = requests.post(self.pull_url, json=payload, stream=True, timeout=600)
-            
-            if response.status_code == 200:
-                # ストリーミングレスポンスを処理
-                for line in response.iter_lines():
-                    if line:
-                        try:
-                            data = json.loads(line)
-                            if 'status' in data:
-                                status = data['status']
-                                # 進捗情報を表示
-                                if 'completed' in data and 'total' in data:
-                                    completed = data.get('completed', 0)
-                                    total = data.get('total', 0)
-                                    if total > 0:
-                                        percent = (completed / total) * 100
-                                        print(f"  進捗: {percent:.1f}% ({completed}/{total}) - {status}")
-                                    else:
-                                        print(f"  {status}")
-                                else:
-                                    print(f"  {status}")
-                        except json.JSONDecodeError:
-                            pass
-                print(f"\n✓ モデル '{model_name}' のダウンロードが完了しました。\n")
-                return True
-        except requests.exceptions.Timeout:
-            print(f"タイムアウト: モデルダウンロードに時間がかかりすぎています。")
-            return False
-        except Exception as e:
-            print(f"モデルダウンロードエラー（API）: {e}")
+        downloaded = False
+        for backend in self.router.backends:
+            # 使うモデルを指定したサーバーには、指定外のモデルをダウンロードしない
+            if backend.models is not None and not backend.serves(model_name):
+                continue
+            try:
+                # HTTP APIでダウンロードを試みる
+                payload = {"name": model_name}
+                with self.session.post(backend.pull_url, json=payload, stream=True,
+                                       timeout=self._timeout(PULL_TIMEOUT)) as response:
+                    if response.status_code == 200:
+                        # ストリーミングレスポンスを処理
+                        for line in response.iter_lines():
+                            if line:
+                                self._print_pull_progress(line)
+                        print(f"\n✓ モデル '{model_name}' のダウンロードが完了しました（{backend.name}）。\n")
+                        downloaded = True
+            except requests.exceptions.Timeout:
+                print(f"タイムアウト: モデルダウンロードに時間がかかりすぎています（{backend.name}）。")
+                return False
+            except Exception as e:
+                print(f"モデルダウンロードエラー（API、{backend.name}）: {e}")
+        if downloaded:
+            self.model_registry.invalidate()
+            return True
         
         # フォールバック: コマンドラインでダウンロード
         print("コマンドライン経由でダウンロードを試みます...")
@@ -178,6 +758,7 @@ class OllamaClient:
             process.wait()
             if process.returncode == 0:
                 print(f"\n✓ モデル '{model_name}' のダウンロードが完了しました。\n")
+                self.model_registry.invalidate()
                 return True
             else:
                 print(f"モデルダウンロードエラー: リターンコード {process.returncode}")
@@ -189,16 +770,46 @@ class OllamaClient:
             print(f"モデルダウンロードエラー（CLI）: {e}")
             return False
     
-    def check_ollama_running(self):
-        """Ollamaが起動しているか確認"""
+    def _probe_backend(self, backend, read_timeout):
+        """
+        サーバーにモデル一覧を問い合わせる（応答がなければNone）
+        
+        結果はサーバーのサーキットブレーカーに記録し、取得したモデル一覧は振り分けに使う
+        """
+        try:
+            response = self.session.get(backend.list_url, timeout=self._timeout(read_timeout))
+        except requests.exceptions.RequestException as e:
+            backend.record_probe(str(e))
+            return None
+        if response.status_code != 200:
+            backend.record_probe(f"HTTP {response.status_code}")
+            return None
+        backend.record_probe()
         try:
-            response = requests.get("http://localhost:11434/api/tags", timeout=5)
-            return response.status_code == 200
-        except Exception:
+            models = self._parse_model_names(response.json())
+        except ValueError:
+            return []
+        backend.installed_models = set(models)
+        return models
+    
+    def check_ollama_running(self):
+        """
+        Ollamaが起動しているか確認（いずれかのサーバーが応答すればTrue）
+        
+        結果はサーバーごとのサーキットブレーカーに記録し、取得したモデル一覧はキャッシュに反映する
+        """
+        models = None
+        for backend in self.router.backends:
+            names = self._probe_backend(backend, HEALTH_TIMEOUT)
+            if names is not None:
+                models = (models or set()) | set(names)
+        if models is None:
             return False
+        self.model_registry.update(list(models))
+        return True
     
     def ensure_model(self):
-        """モデルが存在することを確認し、なければダウンロード"""
+        """モデル（機能タイプごとに指定したモデルを含む）が存在することを確認し、なければダウンロード"""
         # Ollamaが起動しているか確認
         if not self.check_ollama_running():
             print("警告: Ollamaが起動していないようです。")
@@ -206,36 +817,77 @@ class OllamaClient:
             print(f"起動コマンド: \"{self.ollama_path}\" serve")
             return False
         
-        if self.model_exists(self.model):
-            print(f"✓ モデル '{self.model}' は既にインストールされています。")
-            print("  （次回以降も自動的に使用されます）")
-            return True
-        
-        print(f"モデル '{self.model}' が見つかりません。ダウンロードを開始します...")
-        print("  ※ 初回のみダウンロードが必要です。次回以降は自動的に使用されます。")
-        return self.download_model(self.model)
+        models = [self.model] + sorted({route['model'] for route in self.router.routes.values()
+                                        if route.get('model') and route['model'] != self.model})
+        ready = True
+        for model in models:
+            if self.model_exists(model):
+                print(f"✓ モデル '{model}' は既にインストールされています。")
+                print("  （次回以降も自動的に使用されます）")
+                continue
+            
+            print(f"モデル '{model}' が見つかりません。ダウンロードを開始します...")
+            print("  ※ 初回のみダウンロードが必要です。次回以降は自動的に使用されます。")
+            ready = self.download_model(model) and ready
+        return ready
     
-    def chat(self, message):
-        """チャットボット機能"""
-        system_prompt = "あなたは製造現場の熟練作業員のノウハウを継承するAIアシスタントです。提供されたドキュメントの内容を正確に理解し、その内容に基づいて質問に答えてください。必ず日本語で回答してください。ドキュメントに記載されていない内容については推測せず、正直に「ドキュメントに記載がありません」と答えてください。"
-        # メッセージに既にコンテキストが含まれている場合はそのまま使用
-        return self._run_ollama(message, system_prompt)
+    def chat(self, message, cache_tags=(), session_id=None):
+        """
+        チャットボット機能
+        
+        Args:
+            message: 質問（ドキュメントのコンテキストを含む場合あり）
+            cache_tags: 参照したドキュメント名（応答キャッシュの無効化に使用）
+            session_id: 会話セッションのID（指定すると前回までのやり取りを引き継ぐ）
+        """
+        prompt, system_prompt = self._build_prompt('chatbot', message)
+        return self._run_ollama(prompt, system_prompt, cache_tags, 'chatbot', session_id=session_id)
     
     def generate_daily_report(self, input_data):
         """日報生成機能"""
-        system_prompt = "あなたは製造現場の日報を作成するアシスタントです。提供された音声入力や設備データを基に、日報フォーマットに整理してください。必ず日本語で回答してください。"
-        prompt = f"入力データ: {input_data}\n\n日報（日本語で）:"
-        return self._run_ollama(prompt, system_prompt)
+        prompt, system_prompt = self._build_prompt('daily_report', input_data)
+        return self._run_ollama(prompt, system_prompt, function_type='daily_report')
     
     def detect_anomaly(self, input_data):
-        """異常検知機能"""
-        system_prompt = "あなたは製造現場の異常検知システムです。提供されたマルチモーダルな入力データ（画像、センサーデータなど）を分析し、通常と異なる状態を発見してください。必ず日本語で回答してください。"
-        prompt = f"入力データ: {input_data}\n\n分析結果（日本語で）:"
-        return self._run_ollama(prompt, system_prompt)
+        """異常検知機能（数値の時系列は前処理して、要約と異常候補の区間だけをモデルに渡す）"""
+        input_data, result = self._preprocess('anomaly_detection', input_data)
+        if result is not None:
+            return result
+        prompt, system_prompt = self._build_prompt('anomaly_detection', input_data)
+        return self._run_ollama(prompt, system_prompt, function_type='anomaly_detection')
     
     def generate_production_plan(self, input_data):
         """生産計画生成機能"""
-        system_prompt = "あなたは製造現場の生産計画を動的に生成するアシスタントです。組立員のシフト、部材の仕入れ状況、設備の稼働状況などの情報を基に、最適な生産計画を提案してください。必ず日本語で回答してください。"
-        prompt = f"入力情報: {input_data}\n\n生産計画（日本語で）:"
-        return self._run_ollama(prompt, system_prompt)
-
+        prompt, system_prompt = self._build_prompt('production_plan', input_data)
+        return self._run_ollama(prompt, system_prompt, function_type='production_plan')
+    
+    def generate_batch_item(self, function_type, input_data):
+        """
+        一括処理の1件分を生成
+        
+        対話的なリクエストより後に処理されるよう、最も低い優先度（batch）で実行する
+        """
+        input_data, result = self._preprocess(function_type, input_data)
+        if result is not None:
+            return result
+        prompt, system_prompt = self._build_prompt(function_type, input_data)
+        return self._run_ollama(prompt, system_prompt, function_type=function_type, priority='batch')
+    
+    def stream(self, function_type, input_data, cache_tags=(), session_id=None):
+        """
+        機能タイプに応じた回答をストリーミングで生成
+        
+        Args:
+            function_type: 'chatbot' / 'daily_report' / 'anomaly_detection' / 'production_plan'
+            input_data: 入力（チャットボットの場合はコンテキスト付きの質問）
+            cache_tags: 参照したドキュメント名（応答キャッシュの無効化に使用）
+            session_id: 会話セッションのID（指定すると前回までのやり取りを引き継ぐ）
+        
+        Yields:
+            生成されたテキストの断片
+        """
+        input_data, result = self._preprocess(function_type, input_data)
+        if result is not None:
+            return iter([result])
+        prompt, system_prompt = self._build_prompt(function_type, input_data)
+        return self._stream_ollama(prompt, system_prompt, cache_tags, function_type, session_id)
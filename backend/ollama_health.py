@@ -0,0 +1,199 @@
+"""
+Ollamaの稼働状況の管理
+モデル一覧のキャッシュ、定期的な死活監視、停止中のリクエストを待たせないためのサーキットブレーカー
+"""
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+# サーキットブレーカーの状態
+CIRCUIT_CLOSED = 'closed'        # 正常（リクエストを送る）
+CIRCUIT_OPEN = 'open'            # 停止中とみなす（リクエストを送らずにすぐフォールバックする）
+CIRCUIT_HALF_OPEN = 'half_open'  # 復旧の確認中（1件だけ試す）
+
+class CircuitBreaker:
+    """
+    連続して失敗したらしばらくリクエストを送らないようにする
+    
+    失敗が failure_threshold 回続くと open になり、reset_timeout 秒後に1件だけ試す（half_open）。
+    成功すれば closed に戻り、失敗すれば再び open になる。死活監視の成功でも closed に戻る。
+    """
+    
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30):
+        """
+        Args:
+            failure_threshold: open にするまでの連続失敗回数
+            reset_timeout: open にしてから再び試すまでの時間（秒）
+        """
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CIRCUIT_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        # half_open で試しているリクエストの開始時刻（結果が記録されないまま終わった場合に備える）
+        self._trial_started_at = None
+        self.last_error = None
+        self.rejected = 0
+        self.opened = 0
+    
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+    
+    def allow(self) -> bool:
+        """リクエストを送ってよいか（送った場合は record_success / record_failure で結果を記録する）"""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == CIRCUIT_CLOSED:
+                return True
+            if self._state == CIRCUIT_OPEN and now - self._opened_at >= self.reset_timeout:
+                self._state = CIRCUIT_HALF_OPEN
+                self._trial_started_at = None
+            if self._state == CIRCUIT_HALF_OPEN and (
+                    self._trial_started_at is None or now - self._trial_started_at >= self.reset_timeout):
+                self._trial_started_at = now
+                return True
+            self.rejected += 1
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            self._state = CIRCUIT_CLOSED
+            self._failures = 0
+            self._trial_started_at = None
+    
+    def record_failure(self, error: Optional[str] = None):
+        with self._lock:
+            self._failures += 1
+            self.last_error = error
+            if self._state == CIRCUIT_HALF_OPEN or (
+                    self._state == CIRCUIT_CLOSED and self._failures >= self.failure_threshold):
+                if self._state == CIRCUIT_CLOSED:
+                    self.opened += 1
+                self._state = CIRCUIT_OPEN
+                self._opened_at = time.monotonic()
+                self._trial_started_at = None
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            retry_in = None
+            if self._state == CIRCUIT_OPEN:
+                retry_in = round(max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at)), 1)
+            return {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_timeout': self.reset_timeout,
+                'retry_in': retry_in,
+                'last_error': self.last_error,
+                'opened': self.opened,
+                'rejected': self.rejected
+            }
+
+class ModelRegistry:
+    """
+    インストール済みモデルの一覧のキャッシュ
+    
+    取得に成功した一覧を ttl 秒間再利用する。取得に失敗した場合はキャッシュせず、
+    以前に取得した一覧があればそれを返す。
+    """
+    
+    def __init__(self, fetch: Callable[[], Optional[List[str]]], ttl: float = 60):
+        """
+        Args:
+            fetch: モデル名の一覧を取得する関数（取得できなければNone）
+            ttl: 一覧を再利用する時間（秒）
+        """
+        self.fetch = fetch
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._models = None
+        self._fetched_at = 0.0
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, refresh: bool = False) -> List[str]:
+        """モデル名の一覧（期限切れ・refresh=True なら取得し直す）"""
+        with self._lock:
+            if not refresh and self._models is not None and time.monotonic() - self._fetched_at < self.ttl:
+                self.hits += 1
+                return list(self._models)
+            self.misses += 1
+        models = self.fetch()
+        with self._lock:
+            if models is not None:
+                self._store(models)
+            return list(self._models or [])
+    
+    def update(self, models: List[str]):
+        """取得済みの一覧を反映（死活監視で一覧を取得した場合など）"""
+        with self._lock:
+            self._store(models)
+    
+    def _store(self, models: List[str]):
+        self._models = list(models)
+        self._fetched_at = time.monotonic()
+    
+    def invalidate(self):
+        """次回の参照で取得し直す（モデルをダウンロードした後など）"""
+        with self._lock:
+            self._fetched_at = 0.0
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            age = time.monotonic() - self._fetched_at if self._models is not None else None
+            return {
+                'models': list(self._models or []),
+                'age': round(age, 1) if age is not None else None,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+class HealthMonitor:
+    """一定間隔で死活確認（またはモデルのウォームアップ）を行うバックグラウンドスレッド"""
+    
+    def __init__(self, probe: Callable[[], bool], interval: float = 10, name: str = 'ollama-health',
+                 initial_delay: bool = False):
+        """
+        Args:
+            probe: 稼働していればTrueを返す関数（結果の記録は probe 側で行う）
+            interval: 確認の間隔（秒）
+            name: スレッド名
+            initial_delay: Trueなら開始直後ではなく interval 秒後に最初の確認を行う
+        """
+        self.probe = probe
+        self.interval = interval
+        self.name = name
+        self.initial_delay = initial_delay
+        self._thread = None
+        self._stop = threading.Event()
+        self.last_checked = None
+        self.last_result = None
+    
+    def start(self):
+        """監視を開始（既に開始済みなら何もしない）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def _run(self):
+        if self.initial_delay:
+            self._stop.wait(self.interval)
+        while not self._stop.is_set():
+            try:
+                self.last_result = self.probe()
+            except Exception as e:
+                print(f"Ollamaの定期処理（{self.name}）のエラー: {e}")
+                self.last_result = False
+            self.last_checked = time.time()
+            self._stop.wait(self.interval)
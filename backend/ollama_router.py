@@ -0,0 +1,221 @@
+"""
+複数のOllamaサーバーへの振り分け
+処理中のリクエスト数（または実測のレイテンシ）と重みで送り先を選び、失敗したら別のサーバーで再試行する
+"""
+import json
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+from ollama_health import CIRCUIT_OPEN, CircuitBreaker
+
+# 振り分け方式
+ROUTE_LEAST_OUTSTANDING = 'least_outstanding'  # 処理中のリクエスト数 ÷ 重み が最小のサーバー
+ROUTE_LATENCY = 'latency'                      # 実測の応答時間 × (処理中の数 + 1) ÷ 重み が最小のサーバー
+ROUTE_STRATEGIES = (ROUTE_LEAST_OUTSTANDING, ROUTE_LATENCY)
+
+# 応答時間の移動平均で直近の値にかける重み
+LATENCY_SMOOTHING = 0.2
+
+def _base_model(model: str) -> str:
+    """タグを除いたモデル名（'tinyllama:latest' → 'tinyllama'）"""
+    return model.split(':')[0]
+
+class Backend:
+    """
+    1台のOllamaサーバー
+    
+    サーバーごとにサーキットブレーカーを持ち、停止しているサーバーには送らない
+    """
+    
+    def __init__(self, url: str, weight: float = 1.0, models: Optional[List[str]] = None,
+                 name: Optional[str] = None, failure_threshold: int = 3, retry_interval: float = 30):
+        """
+        Args:
+            url: ベースURL（例: http://gpu-server:11434）
+            weight: 重み（大きいほど多く振り分ける）
+            models: このサーバーで使うモデル（Noneなら問い合わせたモデル一覧、不明ならすべて）
+            name: 表示・固定の指定に使う名前（省略時はURL）
+            failure_threshold: 停止しているとみなすまでの連続失敗回数
+            retry_interval: 停止しているとみなしてから再び試すまでの時間（秒）
+        """
+        self.url = url.rstrip('/')
+        self.name = name or self.url
+        self.weight = max(float(weight), 0.01)
+        self.models = {_base_model(model) for model in models} if models else None
+        self.api_url = f"{self.url}/api/generate"
+        self.list_url = f"{self.url}/api/tags"
+        self.pull_url = f"{self.url}/api/pull"
+        self.embed_url = f"{self.url}/api/embed"
+        self.embeddings_url = f"{self.url}/api/embeddings"
+        # /api/embed で複数のテキストをまとめて送れるか（古いサーバーで404が返ったらFalse）
+        self.batch_embed = True
+        self.breaker = CircuitBreaker(failure_threshold, retry_interval)
+        # 死活確認で取得したモデル一覧
+        self.installed_models = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.latency = None
+    
+    def serves(self, model: str) -> bool:
+        """指定したモデルのリクエストを送ってよいか"""
+        model = _base_model(model)
+        if self.models is not None:
+            return model in self.models
+        installed = self.installed_models
+        return installed is None or model in installed
+    
+    def begin(self) -> float:
+        """リクエストの開始を記録（戻り値を finish() に渡す）"""
+        with self._lock:
+            self.in_flight += 1
+            self.requests += 1
+        return time.perf_counter()
+    
+    def finish(self, started: float, ok: bool = True, error: Optional[str] = None):
+        """
+        リクエストの終了を記録
+        
+        Args:
+            started: begin() の戻り値
+            ok: 正常に応答したか（Falseでも error がなければサーバーは稼働しているとみなす。4xxなど）
+            error: 接続の失敗・5xxの内容（サーキットブレーカーに失敗として記録する）
+        """
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.in_flight -= 1
+            if ok:
+                self.latency = elapsed if self.latency is None else \
+                    (1 - LATENCY_SMOOTHING) * self.latency + LATENCY_SMOOTHING * elapsed
+            elif error is not None:
+                self.failures += 1
+        self.record_probe(error)
+    
+    def record_probe(self, error: Optional[str] = None):
+        """死活確認などの結果をサーキットブレーカーに記録"""
+        if error is None:
+            self.breaker.record_success()
+            return
+        was_open = self.breaker.state == CIRCUIT_OPEN
+        self.breaker.record_failure(error)
+        if not was_open and self.breaker.state == CIRCUIT_OPEN:
+            print(f"Ollama（{self.name}）に接続できないため、{self.breaker.reset_timeout}秒間は送信しません: {error}")
+    
+    def score(self, strategy: str):
+        """振り分けの優先順位（小さいほど優先。同点なら送信数の少ない方）"""
+        with self._lock:
+            if strategy == ROUTE_LATENCY:
+                primary = (self.latency or 0.0) * (self.in_flight + 1) / self.weight
+            else:
+                primary = self.in_flight / self.weight
+            return primary, self.requests / self.weight
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'name': self.name,
+                'url': self.url,
+                'weight': self.weight,
+                'models': sorted(self.models) if self.models is not None else None,
+                'installed_models': sorted(self.installed_models) if self.installed_models is not None else None,
+                'in_flight': self.in_flight,
+                'requests': self.requests,
+                'failures': self.failures,
+                'latency_seconds': round(self.latency, 3) if self.latency is not None else None,
+                'circuit': self.breaker.stats()
+            }
+
+class BackendRouter:
+    """
+    リクエストの送り先を選ぶ
+    
+    機能タイプごとにモデル・サーバーを固定できる（例: 生産計画だけ大きなモデルのサーバーに送る）。
+    固定したサーバーが使えない場合は、同じモデルを使える他のサーバーに送る。
+    """
+    
+    def __init__(self, backends: List[Backend], strategy: str = ROUTE_LEAST_OUTSTANDING,
+                 routes: Optional[Dict[str, Dict]] = None):
+        """
+        Args:
+            backends: サーバーの一覧
+            strategy: 振り分け方式（'least_outstanding' または 'latency'）
+            routes: 機能タイプごとの固定 {機能タイプ: {'model': モデル名, 'backend': サーバー名}}
+        """
+        if not backends:
+            raise ValueError('Ollamaのサーバーが指定されていません')
+        if strategy not in ROUTE_STRATEGIES:
+            raise ValueError(f"未対応の振り分け方式です: {strategy}")
+        self.backends = backends
+        self.strategy = strategy
+        self.routes = routes or {}
+        self.retries = 0
+    
+    def model_for(self, function_type: Optional[str], default: str) -> str:
+        """機能タイプで使うモデル"""
+        return self.routes.get(function_type, {}).get('model') or default
+    
+    def candidates(self, model: str, function_type: Optional[str] = None,
+                   prefer: Optional[str] = None) -> List[Backend]:
+        """
+        送り先の候補（優先順。固定されたサーバー、prefer で指定したサーバーの順に先頭）
+        
+        Args:
+            prefer: 優先するサーバー名（会話を続ける場合に、前回応答したサーバーを指定する）
+        """
+        pinned = self.routes.get(function_type, {}).get('backend')
+        serving = [backend for backend in self.backends if backend.serves(model)]
+        if not serving:
+            # どのサーバーもモデルを持っていない場合はすべてに試す（Ollama側でエラーになる）
+            serving = list(self.backends)
+        serving.sort(key=lambda backend: (pinned is not None and backend.name != pinned,
+                                          prefer is not None and backend.name != prefer,
+                                          backend.score(self.strategy)))
+        return serving
+    
+    def attempts(self, model: str, function_type: Optional[str] = None,
+                 prefer: Optional[str] = None) -> Iterator[Backend]:
+        """
+        送信を試すサーバーを順に返す（停止しているとみなしているサーバーは飛ばす）
+        
+        2台目以降を返した場合は再試行として数える
+        """
+        tried = 0
+        for backend in self.candidates(model, function_type, prefer):
+            if not backend.breaker.allow():
+                continue
+            if tried:
+                self.retries += 1
+            tried += 1
+            yield backend
+    
+    @property
+    def available(self) -> bool:
+        """いずれかのサーバーが使えるか"""
+        return any(backend.breaker.state != CIRCUIT_OPEN for backend in self.backends)
+    
+    def stats(self) -> Dict:
+        return {
+            'strategy': self.strategy,
+            'routes': self.routes,
+            'retries': self.retries,
+            'backends': [backend.stats() for backend in self.backends]
+        }
+
+def parse_backends(value: str, failure_threshold: int = 3, retry_interval: float = 30) -> List[Backend]:
+    """
+    環境変数の値からサーバーの一覧を作成
+    
+    カンマ区切りのURL、または {"url", "weight", "models", "name"} のJSON配列
+    （例: [{"url": "http://gpu:11434", "weight": 3, "models": ["llama3"], "name": "gpu"}]）
+    """
+    value = (value or '').strip()
+    if not value:
+        return []
+    if value.startswith('['):
+        entries = json.loads(value)
+    else:
+        entries = [{'url': url.strip()} for url in value.split(',') if url.strip()]
+    return [Backend(entry['url'], entry.get('weight', 1.0), entry.get('models'), entry.get('name'),
+                    failure_threshold, retry_interval) for entry in entries]
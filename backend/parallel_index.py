@@ -0,0 +1,110 @@
+"""
+ドキュメントの並列取り込み
+ファイルの読み込み・チャンク分割・語の切り出しを複数のプロセスで行い、
+作成した部分インデックス（ポスティング）を呼び出し元でまとめる
+"""
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from document_text import DocumentText
+from ingest import ingest_file
+from search_index import build_postings
+
+# 1つのワーカーに同時に割り当てるファイル数（プロセス間の受け渡しの待ちを減らす）
+FILES_PER_WORKER = 2
+
+def default_workers() -> int:
+    """既定のワーカー数（CPUのコア数）"""
+    return os.cpu_count() or 1
+
+def index_file(path: str, name: str) -> Tuple:
+    """
+    1つのファイルを取り込み、チャンクごとのポスティングを作成（ワーカープロセスで実行）
+    
+    プロセス間で受け渡すデータを減らすため、小文字化した本文は返さない
+    
+    Returns:
+        (本文, 行の開始位置, チャンク, ファイルの内容のSHA-256, {チャンクID: (ポスティング, 語の出現数の合計)})
+    """
+    doc, digest = ingest_file(path, name)
+    postings = {}
+    for chunk in doc.chunks:
+        postings[chunk.id] = build_postings(doc.folded_lines(chunk.start_line - 1, chunk.end_line),
+                                            chunk.start_line - 1)
+    return doc.text, doc.starts, doc.chunks, digest, postings
+
+def ingest_files(docs_dir: str, filenames: List[str], workers: int = 1
+                 ) -> Iterator[Tuple[str, Optional[DocumentText], Optional[str], Optional[Dict], Optional[Exception]]]:
+    """
+    ファイルを取り込み、終わった順に返すジェネレータ
+    
+    workers が1以下、またはファイルが1件だけの場合は同じプロセスで順に読み込む。
+    プロセスを起動できない環境（サーバーレスなど）でも順次処理で続行する。
+    
+    Args:
+        docs_dir: ドキュメントのディレクトリ
+        filenames: 取り込むファイル名
+        workers: ワーカープロセス数
+    
+    Yields:
+        (ファイル名, DocumentText, SHA-256, ポスティング, エラー)
+        ポスティングは並列処理の場合だけ作成済み（順次処理ではNone）。失敗した場合はエラー以外がNone
+    """
+    remaining = list(filenames)
+    if workers > 1 and len(remaining) > 1:
+        try:
+            executor = ProcessPoolExecutor(max_workers=min(workers, len(remaining)))
+        except (OSError, NotImplementedError) as e:
+            print(f"ワーカープロセスを起動できないため順に読み込みます: {e}")
+            executor = None
+        if executor is not None:
+            finished = set()
+            try:
+                yield from _ingest_parallel(executor, docs_dir, remaining, workers, finished)
+            except BrokenProcessPool as e:
+                print(f"ワーカープロセスが停止したため残りを順に読み込みます: {e}")
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+            remaining = [filename for filename in remaining if filename not in finished]
+    
+    for filename in remaining:
+        try:
+            doc, digest = ingest_file(os.path.join(docs_dir, filename), filename)
+        except Exception as e:
+            yield filename, None, None, None, e
+            continue
+        yield filename, doc, digest, None, None
+
+def _ingest_parallel(executor: ProcessPoolExecutor, docs_dir: str, filenames: List[str], workers: int,
+                     finished: set):
+    """
+    ワーカープロセスで取り込む（終わったファイルは finished に追加する）
+    
+    未処理のファイルを一度にすべて送らず、ワーカー数に応じた件数ずつ割り当てる
+    """
+    queue = iter(filenames)
+    pending = {}
+    limit = workers * FILES_PER_WORKER
+    while True:
+        for filename in queue:
+            pending[executor.submit(index_file, os.path.join(docs_dir, filename), filename)] = filename
+            if len(pending) >= limit:
+                break
+        if not pending:
+            return
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            filename = pending.pop(future)
+            try:
+                text, starts, chunks, digest, postings = future.result()
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                finished.add(filename)
+                yield filename, None, None, None, e
+                continue
+            finished.add(filename)
+            # 小文字化はここで行う（行の開始位置は計算済みのものを使う）
+            yield filename, DocumentText(filename, text, starts, chunks), digest, postings, None
@@ -0,0 +1,113 @@
+"""
+機能タイプごとのプロンプトのテンプレートと生成オプション
+テンプレートは起動時に一度だけ組み立て、リクエストごとには入力を埋め込むだけにする
+"""
+from typing import Dict, Optional, Tuple
+
+# 入力を埋め込む位置
+INPUT_PLACEHOLDER = '{input}'
+
+# /api/generate の options として送る生成オプション
+GENERATION_OPTIONS = ('temperature', 'num_predict', 'num_ctx')
+
+DEFAULT_OPTIONS = {
+    'temperature': 0.7,
+    'num_predict': 500  # 最大トークン数を制限して高速化
+}
+
+class PromptTemplate:
+    """1つの機能タイプのシステムプロンプト・プロンプトの形式・生成オプション"""
+    
+    def __init__(self, system_prompt: str, prompt_format: str = INPUT_PLACEHOLDER, options: Optional[Dict] = None):
+        """
+        Args:
+            system_prompt: システムプロンプト
+            prompt_format: プロンプトの形式（{input} の位置に入力を埋め込む）
+            options: 生成オプション（temperature / num_predict / num_ctx。省略した項目は DEFAULT_OPTIONS）
+        """
+        if INPUT_PLACEHOLDER not in prompt_format:
+            raise ValueError(f"プロンプトの形式に {INPUT_PLACEHOLDER} がありません: {prompt_format}")
+        self.system_prompt = system_prompt
+        self.prompt_format = prompt_format
+        # 入力の前後の固定部分（format() の解析をリクエストごとに行わない）
+        self._prefix, self._suffix = prompt_format.split(INPUT_PLACEHOLDER, 1)
+        self.options = dict(DEFAULT_OPTIONS)
+        self.update_options(options or {})
+    
+    def update_options(self, options: Dict):
+        """生成オプションを上書き（値がNoneの項目は削除してOllamaの既定値を使う）"""
+        for name, value in options.items():
+            if name not in GENERATION_OPTIONS:
+                raise ValueError(f"未対応の生成オプションです: {name}")
+            if value is None:
+                self.options.pop(name, None)
+            else:
+                self.options[name] = value
+    
+    def render(self, input_data) -> Tuple[str, str]:
+        """
+        入力を埋め込んだプロンプトを作成
+        
+        Returns:
+            (prompt, system_prompt)
+        """
+        return f"{self._prefix}{input_data}{self._suffix}", self.system_prompt
+
+def default_templates() -> Dict[str, PromptTemplate]:
+    """標準のテンプレート"""
+    return {
+        'chatbot': PromptTemplate(
+            "あなたは製造現場の熟練作業員のノウハウを継承するAIアシスタントです。提供されたドキュメントの内容を正確に理解し、その内容に基づいて質問に答えてください。必ず日本語で回答してください。ドキュメントに記載されていない内容については推測せず、正直に「ドキュメントに記載がありません」と答えてください。",
+            # メッセージに既にコンテキストが含まれているためそのまま使用
+            INPUT_PLACEHOLDER
+        ),
+        'daily_report': PromptTemplate(
+            "あなたは製造現場の日報を作成するアシスタントです。提供された音声入力や設備データを基に、日報フォーマットに整理してください。必ず日本語で回答してください。",
+            "入力データ: {input}\n\n日報（日本語で）:"
+        ),
+        'anomaly_detection': PromptTemplate(
+            "あなたは製造現場の異常検知システムです。提供されたマルチモーダルな入力データ（画像、センサーデータなど）を分析し、通常と異なる状態を発見してください。必ず日本語で回答してください。",
+            "入力データ: {input}\n\n分析結果（日本語で）:"
+        ),
+        'production_plan': PromptTemplate(
+            "あなたは製造現場の生産計画を動的に生成するアシスタントです。組立員のシフト、部材の仕入れ状況、設備の稼働状況などの情報を基に、最適な生産計画を提案してください。必ず日本語で回答してください。",
+            "入力情報: {input}\n\n生産計画（日本語で）:"
+        )
+    }
+
+class PromptRegistry:
+    """
+    機能タイプごとのテンプレート
+    
+    登録されていない機能タイプはチャットボットのテンプレートを使う
+    """
+    
+    def __init__(self, templates: Optional[Dict[str, PromptTemplate]] = None, options: Optional[Dict] = None):
+        """
+        Args:
+            templates: {機能タイプ: PromptTemplate}（Noneなら標準のテンプレート）
+            options: 機能タイプごとの生成オプションの上書き {機能タイプ: {'num_ctx': 4096, ...}}
+        """
+        self.templates = templates if templates is not None else default_templates()
+        for function_type, overrides in (options or {}).items():
+            self.get(function_type, strict=True).update_options(overrides)
+    
+    def get(self, function_type: Optional[str], strict: bool = False) -> PromptTemplate:
+        """機能タイプのテンプレート（strict=True なら未登録の機能タイプで KeyError）"""
+        template = self.templates.get(function_type)
+        if template is None:
+            if strict:
+                raise KeyError(f"未登録の機能タイプです: {function_type}")
+            template = self.templates['chatbot']
+        return template
+    
+    def render(self, function_type: Optional[str], input_data) -> Tuple[str, str]:
+        """(prompt, system_prompt)"""
+        return self.get(function_type).render(input_data)
+    
+    def options(self, function_type: Optional[str]) -> Dict:
+        """生成オプション（呼び出し元が書き換えても影響しないようコピーを返す）"""
+        return dict(self.get(function_type).options)
+    
+    def stats(self) -> Dict:
+        return {function_type: dict(template.options) for function_type, template in self.templates.items()}
@@ -0,0 +1,153 @@
+"""
+LLM応答のキャッシュ
+同じ（モデル, システムプロンプト, プロンプト, オプション）の生成結果を再利用する
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+class ResponseCache:
+    """
+    件数上限付きLRU + TTLの応答キャッシュ
+    
+    pathを指定するとSQLiteファイルにも保存し、再起動後もキャッシュを引き継ぐ。
+    エントリにはタグ（参照したドキュメント名など）を付けられ、タグ単位で無効化できる。
+    """
+    
+    def __init__(self, max_entries: int = 256, ttl: float = 3600, path: Optional[str] = None):
+        """
+        Args:
+            max_entries: 保持する最大件数（超えたら最も古く使われたものから削除）
+            ttl: 有効期限（秒）
+            path: 永続化に使うSQLiteファイルのパス（Noneならメモリのみ）
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        # {key: (value, 有効期限, タグ)}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT, expires_at REAL, tags TEXT, used_at REAL)"
+            )
+            self._db.commit()
+            self._load_from_disk()
+    
+    @staticmethod
+    def make_key(model: str, system_prompt: Optional[str], prompt: str, options: Optional[Dict]) -> str:
+        """キャッシュキーを作成"""
+        raw = json.dumps([model, system_prompt or '', prompt, options or {}],
+                         ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    def _load_from_disk(self):
+        """有効期限内のエントリを最近使われた順に読み込む"""
+        now = time.time()
+        self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        rows = self._db.execute(
+            "SELECT key, value, expires_at, tags FROM responses ORDER BY used_at DESC LIMIT ?",
+            (self.max_entries,)
+        ).fetchall()
+        for key, value, expires_at, tags in reversed(rows):
+            self._entries[key] = (value, expires_at, tuple(json.loads(tags)))
+        self._db.commit()
+    
+    def get(self, key: str) -> Optional[str]:
+        """キャッシュを参照（なければNone）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, _ = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if self._db is not None:
+                self._db.execute("UPDATE responses SET used_at = ? WHERE key = ?", (time.time(), key))
+                self._db.commit()
+            return value
+    
+    def set(self, key: str, value: str, tags: Iterable[str] = ()):
+        """キャッシュに保存"""
+        tags = tuple(tags)
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._entries[key] = (value, expires_at, tags)
+            self._entries.move_to_end(key)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, expires_at, tags, used_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, expires_at, json.dumps(tags, ensure_ascii=False), time.time())
+                )
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            if self._db is not None:
+                self._db.commit()
+    
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        """
+        指定したタグのいずれかを持つエントリを削除
+        
+        Returns:
+            削除した件数
+        """
+        tags = set(tags)
+        if not tags:
+            return 0
+        with self._lock:
+            keys = [key for key, (_, _, entry_tags) in self._entries.items() if tags.intersection(entry_tags)]
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+            if self._db is not None:
+                self._db.commit()
+            return len(keys)
+    
+    def clear(self):
+        """すべてのエントリを削除"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+    
+    def _remove(self, key: str):
+        """エントリを削除（ロック取得済みで呼び出す）"""
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+    
+    def stats(self) -> Dict:
+        """ヒット率などの統計情報"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'persistent': self._db is not None,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
@@ -0,0 +1,83 @@
+"""
+検索結果のキャッシュ
+同じ（または表記だけが異なる）質問の検索結果を、インデックスが変わるまで再利用する
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
+
+class SearchCache:
+    """
+    件数上限付きLRUの検索結果キャッシュ
+    
+    エントリは作成元のインデックスの世代（ドキュメントのバージョンなど）に結び付け、
+    世代が変わったら最初の参照時にすべて破棄する（再読み込み時に明示的に消す必要はない）。
+    """
+    
+    def __init__(self, max_entries: int = 256):
+        """
+        Args:
+            max_entries: 保持する最大件数（0ならキャッシュしない）
+        """
+        self.max_entries = max_entries
+        # {key: 検索結果}
+        self._entries = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def _check_generation(self, generation: Hashable):
+        """世代が変わっていればエントリを破棄（ロック取得済みで呼び出す）"""
+        if generation != self._generation:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._generation = generation
+    
+    def get(self, generation: Hashable, key: Hashable) -> Optional[List[Dict]]:
+        """キャッシュを参照（なければNone）。結果の各要素はコピーを返す"""
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            self._check_generation(generation)
+            results = self._entries.get(key)
+            if results is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return [dict(result) for result in results]
+    
+    def set(self, generation: Hashable, key: Hashable, results: List[Dict]):
+        """キャッシュに保存（呼び出し元が結果を書き換えても影響しないようコピーする）"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._check_generation(generation)
+            self._entries[key] = [dict(result) for result in results]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        """すべてのエントリを削除"""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict:
+        """ヒット率などの統計情報"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
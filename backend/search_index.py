@@ -0,0 +1,213 @@
+"""
+ドキュメント検索用の転置インデックス
+日本語は文字バイグラム/トライグラム、英数字はトークン単位で (ドキュメント, 行) の位置を保持する
+"""
+import re
+from array import array
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# インデックスの作り方のバージョン（語の抽出方法を変えたら上げる。保存済みのスナップショットが無効になる）
+INDEX_VERSION = 2
+
+# 日本語の文字（検索クエリのキーワード抽出と同じ文字クラス）
+JAPANESE_RUN_PATTERN = re.compile(r'[ぁ-んァ-ヶー一-龠々]+')
+# 英数字などのトークン（日本語の文字を除く単語構成文字）
+TOKEN_PATTERN = re.compile(r'[^\Wぁ-んァ-ヶー一-龠々]+')
+
+
+def _ngrams(run: str, n: int) -> Iterable[str]:
+    return (run[i:i + n] for i in range(len(run) - n + 1))
+
+
+def line_terms(line_lower: str) -> List[str]:
+    """
+    1行（小文字化済み）からインデックス用の語を抽出
+    
+    同じ語が複数回現れた場合はその回数だけ含まれる（出現頻度として使用）
+    """
+    terms = []
+    for run in JAPANESE_RUN_PATTERN.findall(line_lower):
+        terms.extend(_ngrams(run, 2))
+        terms.extend(_ngrams(run, 3))
+    terms.extend(TOKEN_PATTERN.findall(line_lower))
+    return terms
+
+
+def query_terms(keyword_lower: str) -> List[str]:
+    """
+    検索キーワードの候補絞り込みに使う語を抽出
+    
+    日本語部分は3文字以上ならトライグラム、2文字ならバイグラムを使う。
+    1文字だけの日本語部分は絞り込みに使えないため無視する。
+    """
+    terms = []
+    for run in JAPANESE_RUN_PATTERN.findall(keyword_lower):
+        if len(run) >= 3:
+            terms.extend(_ngrams(run, 3))
+        elif len(run) == 2:
+            terms.append(run)
+    terms.extend(TOKEN_PATTERN.findall(keyword_lower))
+    # 重複を除き、順序は保つ
+    return list(dict.fromkeys(terms))
+
+
+def build_postings(lines_lower: Iterable[str], first_line: int = 0) -> Tuple[Dict[str, array], int]:
+    """
+    1つのドキュメント（またはチャンク）のポスティングを作成
+    
+    Returns:
+        ({語: 行番号の配列}, 語の出現数の合計)
+    """
+    doc_postings: Dict[str, array] = {}
+    length = 0
+    for line_no, line in enumerate(lines_lower, first_line):
+        for term in line_terms(line):
+            length += 1
+            positions = doc_postings.get(term)
+            if positions is None:
+                positions = doc_postings[term] = array('I')
+            positions.append(line_no)
+    return doc_postings, length
+
+
+class InvertedIndex:
+    """
+    語 → {ドキュメント名: 行番号の配列} の転置インデックス
+    
+    DocumentSearchではチャンクIDを名前として登録する（行番号はドキュメント内の位置）
+    
+    行番号の配列は array('I')、またはスナップショットのメモリマップ上の memoryview
+    """
+    
+    def __init__(self):
+        # 行番号の配列は出現ごとに1要素（同じ行に2回出現すれば2要素）
+        self.postings: Dict[str, Dict[str, array]] = {}
+        # ドキュメントごとに含まれる語（削除時に使用）
+        self.doc_terms: Dict[str, List[str]] = {}
+        # BM25用の統計量（ドキュメント長 = 語の出現数の合計）
+        self.doc_lengths: Dict[str, int] = {}
+        self.total_length = 0
+        # スナップショットから読み込んだ場合、ポスティングが参照するメモリマップ
+        self.buffer = None
+    
+    @property
+    def document_count(self) -> int:
+        return len(self.doc_lengths)
+    
+    @property
+    def average_length(self) -> float:
+        if not self.doc_lengths:
+            return 0.0
+        return self.total_length / len(self.doc_lengths)
+    
+    def copy(self) -> 'InvertedIndex':
+        """
+        差分更新用のコピーを作成
+        
+        語ごとの辞書だけを複製し、行番号の配列は共有する（配列は作成後に変更しない）
+        """
+        other = InvertedIndex()
+        other.postings = {term: dict(docs) for term, docs in self.postings.items()}
+        other.doc_terms = dict(self.doc_terms)
+        other.doc_lengths = dict(self.doc_lengths)
+        other.total_length = self.total_length
+        other.buffer = self.buffer
+        return other
+    
+    def add_document(self, name: str, lines_lower: Iterable[str], first_line: int = 0):
+        """
+        ドキュメント（またはチャンク）を追加（同名のものがあれば置き換え）
+        
+        Args:
+            name: 名前
+            lines_lower: 小文字化済みの行
+            first_line: 最初の行の行番号（チャンクの場合はドキュメント内の位置）
+        """
+        doc_postings, length = build_postings(lines_lower, first_line)
+        self.add_postings(name, doc_postings, length)
+    
+    def add_postings(self, name: str, doc_postings: Dict[str, array], length: int):
+        """
+        build_postings() で作成済みのポスティングを追加（同名のものがあれば置き換え）
+        
+        別プロセスで作成した部分インデックスをまとめるときに使う
+        """
+        if name in self.doc_terms:
+            self.remove_document(name)
+        
+        for term, positions in doc_postings.items():
+            self.postings.setdefault(term, {})[name] = positions
+        self.doc_terms[name] = list(doc_postings)
+        self.doc_lengths[name] = length
+        self.total_length += length
+    
+    def remove_document(self, name: str):
+        """ドキュメントをインデックスから削除"""
+        self.total_length -= self.doc_lengths.pop(name, 0)
+        for term in self.doc_terms.pop(name, ()):
+            docs = self.postings.get(term)
+            if docs is None:
+                continue
+            docs.pop(name, None)
+            if not docs:
+                del self.postings[term]
+    
+    def find(self, keyword_lower: str,
+             get_line: Callable[[str, int], str]) -> Dict[str, Dict[int, int]]:
+        """
+        キーワードを含む行を検索
+        
+        Args:
+            keyword_lower: 小文字化済みのキーワード
+            get_line: (ドキュメント名, 行番号) から小文字化済みの行を返す関数
+        
+        Returns:
+            {ドキュメント名: {行番号: 出現回数}}
+        """
+        # 英数字だけのキーワードはトークンのポスティングをそのまま使う
+        if TOKEN_PATTERN.fullmatch(keyword_lower):
+            docs = self.postings.get(keyword_lower, {})
+            matches = {}
+            for name, positions in docs.items():
+                counts: Dict[int, int] = {}
+                for line_no in positions:
+                    counts[line_no] = counts.get(line_no, 0) + 1
+                matches[name] = counts
+            return matches
+        
+        terms = query_terms(keyword_lower)
+        if not terms:
+            return {}
+        
+        # ポスティングの短い語から順に候補を絞り込む
+        term_docs = []
+        for term in terms:
+            docs = self.postings.get(term)
+            if not docs:
+                return {}
+            term_docs.append(docs)
+        term_docs.sort(key=len)
+        
+        matches = {}
+        for name, positions in term_docs[0].items():
+            candidates = set(positions)
+            for docs in term_docs[1:]:
+                other = docs.get(name)
+                if other is None:
+                    candidates = None
+                    break
+                candidates.intersection_update(other)
+                if not candidates:
+                    break
+            if not candidates:
+                continue
+            
+            # n-gramの一致は候補にすぎないため、実際の行で部分文字列を確認する
+            counts = {}
+            for line_no in sorted(candidates):
+                count = get_line(name, line_no).count(keyword_lower)
+                if count:
+                    counts[line_no] = count
+            if counts:
+                matches[name] = counts
+        return matches
@@ -0,0 +1,530 @@
+"""
+異常検知の前処理
+数値の時系列データ（CSV・JSON）を解析し、ローリングz値・変化率・しきい値で異常の候補を決定的に絞り込む。
+モデルには要約と異常候補の区間だけを渡し、判断が明らかな場合はモデルを使わずに結果を返す。
+"""
+import csv
+import io
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 時刻として扱う列名（数値でない列がこの名前ならラベルに使う）
+TIME_COLUMNS = ('time', 'timestamp', 'datetime', 'date', 'ts', 't', '時刻', '日時', '日付', '時間')
+# 入力全体のうち、表の前後にある文章をメモとして残す最大文字数
+MAX_NOTE_CHARS = 300
+# 1列だけの表で、値の直前の行を見出し（列名）とみなす最大文字数
+MAX_HEADER_CHARS = 30
+# ロバストな標準偏差の推定（正規分布で中央絶対偏差 × 1.4826 が標準偏差）
+MAD_SCALE = 1.4826
+# 浮動小数点の誤差とみなす差（値の大きさに対する割合）
+RELATIVE_EPSILON = 1e-9
+# 値の分解能とみなす差の最小の出現回数（1回だけの大きな変化を分解能としないため）
+MIN_RESOLUTION_COUNT = 3
+# 近い異常候補を1つの区間にまとめる間隔（行数）
+WINDOW_GAP = 2
+# 水準の変化（ドリフト）の判定で比べる先頭・末尾の区間の割合
+DRIFT_SEGMENT_RATIO = 0.1
+
+_NUMBER_PATTERN = re.compile(r'^[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?$')
+
+class SensorData:
+    """解析対象の時系列（列ごとの数値とラベル）"""
+    
+    def __init__(self, columns: Dict[str, np.ndarray], labels: Optional[List[str]] = None,
+                 limits: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None, note: str = ''):
+        """
+        Args:
+            columns: {列名: 値の配列}（欠損はNaN）
+            labels: 行ごとのラベル（時刻など。Noneなら行番号）
+            limits: 列ごとのしきい値 {列名: (下限, 上限)}（Noneの側は判定しない）
+            note: 表の前後にあった文章
+        """
+        self.columns = columns
+        self.labels = labels
+        self.limits = limits or {}
+        self.note = note
+    
+    @property
+    def rows(self) -> int:
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+    
+    def label(self, index: int) -> str:
+        return self.labels[index] if self.labels else f"{index + 1}行目"
+
+def _is_number(value: str) -> bool:
+    return bool(_NUMBER_PATTERN.match(value.strip()))
+
+def _to_float(value) -> float:
+    """数値に変換（変換できない値・空欄はNaN）"""
+    if isinstance(value, bool):
+        return float('nan')
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str) and _is_number(value):
+        return float(value)
+    return float('nan')
+
+def _from_records(records: List[Dict], min_rows: int) -> Optional[Tuple[Dict[str, np.ndarray], Optional[List[str]]]]:
+    """
+    行（{列名: 値}）のリストから数値の列とラベルを取り出す
+    
+    半分以上の行が数値の列を数値の列とし、時刻の列（なければ最初の数値でない列）をラベルにする
+    """
+    if len(records) < min_rows or not all(isinstance(record, dict) for record in records):
+        return None
+    names = list(dict.fromkeys(name for record in records for name in record))
+    columns = {}
+    label_column = None
+    for name in names:
+        values = np.array([_to_float(record.get(name)) for record in records], dtype=np.float64)
+        if np.count_nonzero(~np.isnan(values)) * 2 >= len(values):
+            columns[str(name)] = values
+        elif label_column is None or str(name).lower() in TIME_COLUMNS:
+            if label_column is None or str(label_column).lower() not in TIME_COLUMNS:
+                label_column = name
+    for name in list(columns):
+        # 時刻が数値（UNIX時間など）の場合もラベルとして扱う
+        if name.lower() in TIME_COLUMNS and label_column is None:
+            label_column = name
+            del columns[name]
+    if not columns:
+        return None
+    labels = [str(record.get(label_column, '')) for record in records] if label_column is not None else None
+    return columns, labels
+
+def _parse_limits(value) -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+    """{列名: [下限, 上限]} または {列名: {"min": 下限, "max": 上限}}"""
+    limits = {}
+    if not isinstance(value, dict):
+        return limits
+    for name, limit in value.items():
+        if isinstance(limit, dict):
+            low, high = limit.get('min'), limit.get('max')
+        elif isinstance(limit, (list, tuple)) and len(limit) == 2:
+            low, high = limit
+        else:
+            continue
+        limits[str(name)] = (None if low is None else float(low), None if high is None else float(high))
+    return limits
+
+def _parse_json(text: str, min_rows: int) -> Optional[SensorData]:
+    """
+    JSONの時系列を読み込む
+    
+    行のリスト [{"time": ..., "temp": ...}]、列の辞書 {"temp": [...]}、
+    またはそれらを readings / data に入れてしきい値（limits）を付けた形式に対応
+    """
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    limits = {}
+    if isinstance(data, dict):
+        limits = _parse_limits(data.get('limits'))
+        for key in ('readings', 'data', 'records'):
+            if key in data:
+                data = data[key]
+                break
+    if isinstance(data, dict):
+        # 列の辞書: 同じ長さのリストを行のリストに変換する
+        lengths = {len(values) for values in data.values() if isinstance(values, list)}
+        if len(lengths) != 1:
+            return None
+        length = lengths.pop()
+        data = [{name: values[i] for name, values in data.items() if isinstance(values, list)} for i in range(length)]
+    if not isinstance(data, list):
+        return None
+    if data and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in data):
+        data = [{'value': value} for value in data]
+    parsed = _from_records(data, min_rows)
+    if parsed is None:
+        return None
+    return SensorData(parsed[0], parsed[1], limits)
+
+def _parse_csv(text: str, min_rows: int) -> Optional[SensorData]:
+    """
+    CSV（またはタブ区切り）の時系列を読み込む
+    
+    入力の中で、見出し行と同じ列数の行が続く最も長い部分を表とし、前後の文章はメモとして残す。
+    1行に1つの値を出力した形式（1列だけの表）は、数値の行が続く部分とその直前の見出し行を表とする。
+    """
+    lines = text.splitlines()
+    best = None
+    for delimiter in (',', '\t'):
+        counts = [len(next(csv.reader([line], delimiter=delimiter))) if line.strip() else 0 for line in lines]
+        start = 0
+        while start < len(lines):
+            end = start + 1
+            while end < len(lines) and counts[end] == counts[start]:
+                end += 1
+            if counts[start] >= 2 and end - start - 1 >= min_rows and \
+                    (best is None or end - start > best[1] - best[0]):
+                best = (start, end, delimiter)
+            start = end
+    
+    # 1列だけの表（文章の行も1列になるため、数値の行が続く部分に限る）
+    numeric = [_is_number(line) for line in lines]
+    start = 0
+    while start < len(lines):
+        if not numeric[start]:
+            start += 1
+            continue
+        end = start
+        while end < len(lines) and numeric[end]:
+            end += 1
+        head = start
+        previous = lines[start - 1].strip() if start > 0 else ''
+        if previous and len(previous) <= MAX_HEADER_CHARS and previous[-1] not in '。：:' and \
+                ',' not in previous and '\t' not in previous:
+            head = start - 1
+        if end - start >= min_rows and (best is None or end - head > best[1] - best[0]):
+            best = (head, end, ',')
+        start = end
+    if best is None:
+        return None
+    start, end, delimiter = best
+    rows = list(csv.reader(io.StringIO('\n'.join(lines[start:end])), delimiter=delimiter))
+    header = [name.strip() for name in rows[0]]
+    if any(_is_number(name) for name in header if name):
+        # 見出し行がない場合は列番号を列名にする
+        header = [f"列{i + 1}" for i in range(len(header))]
+    else:
+        rows = rows[1:]
+    records = [dict(zip(header, (value.strip() for value in row))) for row in rows]
+    parsed = _from_records(records, min_rows)
+    if parsed is None:
+        return None
+    note = '\n'.join(lines[:start] + lines[end:]).strip()
+    return SensorData(parsed[0], parsed[1], note=note[:MAX_NOTE_CHARS])
+
+def parse_sensor_data(text: str, min_rows: int = 10) -> Optional[SensorData]:
+    """
+    入力から数値の時系列を読み込む（時系列でなければNone）
+    
+    Args:
+        text: 入力（JSONまたはCSV。CSVの前後に文章があってもよい）
+        min_rows: 時系列として扱う最小の行数
+    """
+    if not isinstance(text, str) or not text.strip():
+        return None
+    stripped = text.strip()
+    if stripped[0] in '[{':
+        data = _parse_json(stripped, min_rows)
+        if data is not None:
+            return data
+    return _parse_csv(text, min_rows)
+
+def _robust_std(values: np.ndarray) -> float:
+    """外れ値の影響を受けにくい標準偏差の推定（中央絶対偏差 × MAD_SCALE）"""
+    return float(np.median(np.abs(values - np.median(values))) * MAD_SCALE)
+
+def _epsilon(values: np.ndarray) -> float:
+    """浮動小数点の誤差とみなす差（値の大きさに比例させる）"""
+    level = float(np.median(np.abs(values))) if len(values) else 0.0
+    return max(level, 1.0) * RELATIVE_EPSILON
+
+def _round_diffs(diffs: np.ndarray, epsilon: float) -> np.ndarray:
+    """
+    差を epsilon の刻みに丸める
+    
+    20.1 - 20.0 と 20.2 - 20.1 のように本来同じ差が誤差でわずかに異なり、
+    中央絶対偏差が 1e-15 程度になってz値が極端に大きくなるのを防ぐ
+    """
+    return np.round(diffs / epsilon) * epsilon
+
+def resolution(values: np.ndarray) -> float:
+    """
+    値の分解能（隣り合う値の差のうち、繰り返し現れる0でない最小の絶対値）
+    
+    量子化されたセンサーの値（0.1刻みなど）では、ばらつきが0と推定されても1刻みの変化を異常としないよう、
+    z値の分母の下限に使う。繰り返し現れる差がなければ（一定の値が続く、連続的な値など）
+    値の大きさに比例した小さな値を返す。
+    """
+    valid = values[~np.isnan(values)]
+    epsilon = _epsilon(valid)
+    if len(valid) < 2:
+        return epsilon
+    diffs = np.abs(_round_diffs(np.diff(valid), epsilon))
+    steps, counts = np.unique(diffs[diffs > epsilon / 2], return_counts=True)
+    repeated = steps[counts >= max(MIN_RESOLUTION_COUNT, len(diffs) // 100)]
+    return float(repeated[0]) if len(repeated) else epsilon
+
+def rolling_zscores(values: np.ndarray, window: int, min_periods: int = 5) -> np.ndarray:
+    """
+    直前の window 件の平均・標準偏差に対する各値のz値（累積和でまとめて計算する）
+    
+    比較対象に自分自身を含めないため、突発的な値がそのまま大きなz値になる。
+    欠損（NaN）は平均・標準偏差の計算から除き、z値もNaNにする。
+    """
+    n = len(values)
+    valid = ~np.isnan(values)
+    # 桁落ちを避けるため、全体の平均を引いてから累積する
+    center = np.nanmean(values) if valid.any() else 0.0
+    shifted = np.where(valid, values - center, 0.0)
+    counts = np.concatenate(([0], np.cumsum(valid)))
+    sums = np.concatenate(([0.0], np.cumsum(shifted)))
+    squares = np.concatenate(([0.0], np.cumsum(shifted * shifted)))
+    index = np.arange(n)
+    start = np.maximum(0, index - window)
+    count = counts[index] - counts[start]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (sums[index] - sums[start]) / count
+        variance = (squares[index] - squares[start]) / count - mean * mean
+        std = np.sqrt(np.maximum(variance, 0.0))
+        # 直前の件数が少ないと標準偏差を小さく見積もりやすいため、全体のばらつき（中央絶対偏差）の半分と
+        # 値の分解能を下限にする
+        floor = max(_robust_std(values[valid]) * 0.5, resolution(values)) if valid.any() else 1.0
+        z = (shifted - mean) / np.maximum(std, floor)
+    z[(count < min_periods) | ~valid] = np.nan
+    return z
+
+def rate_zscores(values: np.ndarray) -> np.ndarray:
+    """
+    変化量（前の値との差）のロバストなz値（中央値と中央絶対偏差を使う。最初の値はNaN）
+    """
+    z = np.full(len(values), np.nan)
+    diffs = _round_diffs(np.diff(values), _epsilon(values[~np.isnan(values)]))
+    valid = ~np.isnan(diffs)
+    if np.count_nonzero(valid) < 2:
+        return z
+    median = np.median(diffs[valid])
+    spread = _robust_std(diffs[valid])
+    if spread <= 0:
+        # 変化がほとんど一定の場合は平均絶対偏差で代用する
+        spread = np.mean(np.abs(diffs[valid] - median)) * MAD_SCALE
+    # 1刻みの変化を異常としないよう、値の分解能を下限にする
+    spread = max(spread, resolution(values))
+    with np.errstate(invalid='ignore'):
+        z[1:] = (diffs - median) / spread
+    return z
+
+def drift_zscore(values: np.ndarray, segment: int) -> Tuple[float, float, float]:
+    """
+    先頭と末尾の segment 件の水準の差（ドリフト）
+    
+    ローリングz値は直前の値に合わせて基準が動くため、ゆっくりした上昇・下降や段差の後の状態を異常としない。
+    先頭と末尾の中央値の差を、それぞれの区間のばらつきで割って全体の基準に対する変化を評価する。
+    
+    Returns:
+        (先頭の中央値, 末尾の中央値, 差のz値)（値が足りなければz値は0）
+    """
+    valid = values[~np.isnan(values)]
+    if len(valid) < 2 * segment or segment < 2:
+        return float('nan'), float('nan'), 0.0
+    first, last = valid[:segment], valid[-segment:]
+    first_level, last_level = float(np.median(first)), float(np.median(last))
+    spread = max(_robust_std(first), _robust_std(last), float(np.std(first)), float(np.std(last)))
+    if spread <= 0:
+        # 一定の値が続く場合は水準が変わったかどうかだけを見る
+        return first_level, last_level, 0.0 if first_level == last_level else float('inf')
+    return first_level, last_level, (last_level - first_level) / spread
+
+def _format(value: float) -> str:
+    if value is None or np.isnan(value):
+        return '-'
+    return f"{value:.4g}"
+
+class SensorAnalysis:
+    """時系列の要約と異常候補の区間"""
+    
+    def __init__(self, data: SensorData, summaries: List[Dict], windows: List[Dict], window: int,
+                 z_threshold: float, drifts: Optional[List[Dict]] = None):
+        self.data = data
+        self.summaries = summaries
+        self.windows = windows
+        # 先頭と末尾で水準が大きく変わった列（summaries の要素）
+        self.drifts = drifts or []
+        self.window = window
+        self.z_threshold = z_threshold
+    
+    @property
+    def clear_cut(self) -> bool:
+        """
+        モデルを使わずに結果を返せるか
+        
+        異常の候補がない場合と、すべての候補が指定されたしきい値を超えている場合（水準の変化がない場合のみ）
+        """
+        if self.drifts:
+            return False
+        return not self.windows or all(window['limit'] for window in self.windows)
+    
+    def _summary_lines(self) -> List[str]:
+        lines = []
+        for summary in self.summaries:
+            lines.append(
+                f"- {summary['column']}: 平均 {_format(summary['mean'])} / 標準偏差 {_format(summary['std'])}"
+                f" / 最小 {_format(summary['min'])} / 最大 {_format(summary['max'])} / 最新 {_format(summary['last'])}"
+                f" / 傾き {summary['slope']:+.3g}/件 / 異常候補 {summary['flagged']}件"
+            )
+        return lines
+    
+    def _drift_lines(self) -> List[str]:
+        return [
+            f"- {summary['column']}: 先頭 {_format(summary['first_level'])} → 末尾 {_format(summary['last_level'])}"
+            f"（z値 {summary['drift_z']:+.1f}）"
+            for summary in self.drifts
+        ]
+    
+    def _window_lines(self, max_windows: int) -> List[str]:
+        lines = []
+        for number, window in enumerate(self.windows[:max_windows], 1):
+            reasons = []
+            if window['max_z'] is not None:
+                reasons.append(f"z値 {window['max_z']:+.1f}")
+            if window['max_rate_z'] is not None:
+                reasons.append(f"変化率z値 {window['max_rate_z']:+.1f}")
+            if window['limit']:
+                reasons.append(f"しきい値超過（{window['limit']}）")
+            span = window['start_label'] if window['start'] == window['end'] else \
+                f"{window['start_label']}〜{window['end_label']}"
+            lines.append(f"{number}. {window['column']} {span}: ピーク {_format(window['peak'])}（{'、'.join(reasons)}）")
+            lines.append(f"   前後の値: {', '.join(_format(value) for value in window['values'])}")
+        if len(self.windows) > max_windows:
+            lines.append(f"（ほか {len(self.windows) - max_windows} 区間）")
+        return lines
+    
+    def _header(self) -> str:
+        return (f"センサーデータの前処理結果（{self.data.rows}件 × {len(self.summaries)}項目。"
+                f"直前{self.window}件に対するz値が±{self.z_threshold:g}を超える値・急な変化・しきい値超過、"
+                f"先頭と末尾の水準の変化を異常の候補としています）")
+    
+    def to_prompt(self, max_windows: int = 10) -> str:
+        """モデルに渡す要約（元のデータの代わりに使う）"""
+        lines = [self._header()] + self._summary_lines()
+        if self.drifts:
+            lines.append('水準の変化（ゆっくりした上昇・下降や段差）:')
+            lines.extend(self._drift_lines())
+        lines.append('異常候補の区間:')
+        lines.extend(self._window_lines(max_windows) or ['なし'])
+        if self.data.note:
+            lines.append(f"メモ: {self.data.note}")
+        lines.append('異常候補の区間と水準の変化について、考えられる原因と確認すべき点を説明してください。')
+        return '\n'.join(lines)
+    
+    def report(self, max_windows: int = 20) -> str:
+        """モデルを使わずに返す結果（clear_cut の場合）"""
+        if not self.windows:
+            lines = [f"異常の候補は見つかりませんでした（{self.data.rows}件を統計的に確認しました）。"]
+        else:
+            lines = [f"しきい値を超えた値が {len(self.windows)} 区間で見つかりました。"]
+            lines.extend(self._window_lines(max_windows))
+        lines.append('')
+        lines.append(self._header())
+        lines.extend(self._summary_lines())
+        return '\n'.join(lines)
+    
+    def stats(self) -> Dict:
+        return {
+            'rows': self.data.rows,
+            'columns': len(self.summaries),
+            'windows': len(self.windows),
+            'drifts': len(self.drifts),
+            'clear_cut': self.clear_cut
+        }
+
+class SensorAnalyzer:
+    """数値の時系列から異常の候補を絞り込む"""
+    
+    def __init__(self, window: int = 30, z_threshold: float = 4.0, min_rows: int = 10, context: int = 2,
+                 drift_threshold: Optional[float] = None):
+        """
+        Args:
+            window: ローリングz値の計算に使う直前の件数
+            z_threshold: 異常の候補とするz値（変化率のz値にも使う）
+            min_rows: 時系列として扱う最小の行数（少ない場合は前処理せずにモデルに渡す）
+            context: 異常候補の区間の前後に含める値の件数
+            drift_threshold: 水準の変化とする先頭と末尾の差のz値（Noneなら z_threshold の半分）
+        """
+        self.window = window
+        self.z_threshold = z_threshold
+        # 区間の中央値どうしの比較は1点ずつの比較よりばらつきが小さいため、低いしきい値で判定する
+        self.drift_threshold = drift_threshold if drift_threshold is not None else z_threshold / 2
+        self.min_rows = min_rows
+        self.context = context
+    
+    def analyze_text(self, text: str) -> Optional[SensorAnalysis]:
+        """入力が数値の時系列なら解析する（時系列でなければNone）"""
+        data = parse_sensor_data(text, self.min_rows)
+        if data is None:
+            return None
+        return self.analyze(data)
+    
+    def analyze(self, data: SensorData) -> SensorAnalysis:
+        summaries = []
+        windows = []
+        drifts = []
+        segment = max(self.window, int(data.rows * DRIFT_SEGMENT_RATIO))
+        for name, values in data.columns.items():
+            z = rolling_zscores(values, self.window)
+            rate_z = rate_zscores(values)
+            low, high = data.limits.get(name, (None, None))
+            with np.errstate(invalid='ignore'):
+                over_z = np.abs(z) > self.z_threshold
+                over_rate = np.abs(rate_z) > self.z_threshold
+                below = values < low if low is not None else np.zeros(len(values), dtype=bool)
+                above = values > high if high is not None else np.zeros(len(values), dtype=bool)
+            flagged = over_z | over_rate | below | above
+            column_windows = self._windows(data, name, values, z, rate_z, flagged, below, above, low, high)
+            windows.extend(column_windows)
+            valid = values[~np.isnan(values)]
+            index = np.flatnonzero(~np.isnan(values))
+            first_level, last_level, drift_z = drift_zscore(values, segment)
+            summary = {
+                'column': name,
+                'mean': float(np.mean(valid)) if len(valid) else float('nan'),
+                'std': float(np.std(valid)) if len(valid) else float('nan'),
+                'min': float(np.min(valid)) if len(valid) else float('nan'),
+                'max': float(np.max(valid)) if len(valid) else float('nan'),
+                'last': float(valid[-1]) if len(valid) else float('nan'),
+                # 1件あたりの変化の傾向（最小二乗法の傾き）
+                'slope': float(np.polyfit(index, valid, 1)[0]) if len(valid) >= 2 else 0.0,
+                'flagged': int(np.count_nonzero(flagged)),
+                'first_level': first_level,
+                'last_level': last_level,
+                'drift_z': drift_z
+            }
+            summaries.append(summary)
+            if abs(drift_z) > self.drift_threshold:
+                drifts.append(summary)
+        # 逸脱の大きい区間から順にモデルに渡す
+        windows.sort(key=lambda window: (not window['limit'], -window['score']))
+        return SensorAnalysis(data, summaries, windows, self.window, self.z_threshold, drifts)
+    
+    def _windows(self, data, name, values, z, rate_z, flagged, below, above, low, high) -> List[Dict]:
+        """連続する（WINDOW_GAP 行以内の）異常候補を区間にまとめる"""
+        indices = np.flatnonzero(flagged)
+        if not len(indices):
+            return []
+        breaks = np.flatnonzero(np.diff(indices) > WINDOW_GAP + 1)
+        starts = np.concatenate(([indices[0]], indices[breaks + 1]))
+        ends = np.concatenate((indices[breaks], [indices[-1]]))
+        windows = []
+        for start, end in zip(starts, ends):
+            span = slice(start, end + 1)
+            span_z = z[span]
+            span_rate = rate_z[span]
+            max_z = float(span_z[np.nanargmax(np.abs(span_z))]) if not np.isnan(span_z).all() else None
+            max_rate_z = float(span_rate[np.nanargmax(np.abs(span_rate))]) if not np.isnan(span_rate).all() else None
+            limit = []
+            if below[span].any():
+                limit.append(f"下限 {_format(low)}")
+            if above[span].any():
+                limit.append(f"上限 {_format(high)}")
+            peak_index = start + int(np.nanargmax(np.abs(np.nan_to_num(span_z)) + np.abs(np.nan_to_num(span_rate))))
+            windows.append({
+                'column': name,
+                'start': int(start),
+                'end': int(end),
+                'start_label': data.label(int(start)),
+                'end_label': data.label(int(end)),
+                'peak': float(values[peak_index]),
+                'max_z': max_z,
+                'max_rate_z': max_rate_z,
+                'limit': '、'.join(limit),
+                'score': max(abs(max_z or 0), abs(max_rate_z or 0)),
+                'values': values[max(0, start - self.context):end + self.context + 1].tolist()[:2 * self.context + 8]
+            })
+        return windows
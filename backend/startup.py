@@ -0,0 +1,93 @@
+"""
+起動処理の管理
+ドキュメントの読み込みやモデルの確認をバックグラウンドで実行し、進捗を記録する
+"""
+import threading
+import time
+from typing import Callable, Dict
+
+PENDING = 'pending'
+RUNNING = 'running'
+READY = 'ready'
+FAILED = 'failed'
+
+class Readiness:
+    """起動処理の各コンポーネント（documents, model など）の準備状況"""
+    
+    def __init__(self):
+        self._components: Dict[str, Dict] = {}
+        self._lock = threading.RLock()
+    
+    def _set(self, name, **fields):
+        with self._lock:
+            component = self._components.setdefault(name, {
+                'state': PENDING,
+                'detail': '',
+                'progress': 0.0,
+                'started_at': None,
+                'finished_at': None
+            })
+            component.update(fields)
+    
+    def start(self, name: str, task: Callable[[Callable[[str, float], None]], None]):
+        """
+        コンポーネントの準備処理をバックグラウンドで開始
+        
+        Args:
+            name: コンポーネント名
+            task: 準備処理。進捗報告用の関数 report(detail, progress) を受け取る。
+                  例外を送出した場合は失敗として記録する。
+        """
+        with self._lock:
+            if name in self._components and self._components[name]['state'] != PENDING:
+                return  # 既に開始済み
+            self._set(name, state=RUNNING, started_at=time.time())
+        
+        def report(detail: str, progress: float = None):
+            fields = {'detail': detail}
+            if progress is not None:
+                fields['progress'] = progress
+            self._set(name, **fields)
+        
+        def run():
+            try:
+                task(report)
+                self._set(name, state=READY, progress=1.0, finished_at=time.time())
+            except Exception as e:
+                print(f"起動処理エラー ({name}): {e}")
+                self._set(name, state=FAILED, detail=str(e), finished_at=time.time())
+        
+        threading.Thread(target=run, name=f'startup-{name}', daemon=True).start()
+    
+    def mark_ready(self, name: str, detail: str = ''):
+        """準備処理が不要なコンポーネントを準備完了にする"""
+        now = time.time()
+        self._set(name, state=READY, detail=detail, progress=1.0, started_at=now, finished_at=now)
+    
+    def is_pending(self, name: str) -> bool:
+        """
+        準備処理が完了していないか
+        
+        失敗した場合も処理は終わっているためFalse（フォールバックで動作を続ける）
+        """
+        with self._lock:
+            component = self._components.get(name)
+            return component is not None and component['state'] in (PENDING, RUNNING)
+    
+    @property
+    def ready(self) -> bool:
+        """すべてのコンポーネントの準備処理が終わったか"""
+        with self._lock:
+            return all(c['state'] in (READY, FAILED) for c in self._components.values())
+    
+    def status(self) -> Dict[str, Dict]:
+        """各コンポーネントの状態（経過時間付き）"""
+        now = time.time()
+        with self._lock:
+            result = {}
+            for name, component in self._components.items():
+                info = dict(component)
+                if info['started_at'] is not None:
+                    info['elapsed'] = round((info['finished_at'] or now) - info['started_at'], 3)
+                result[name] = info
+            return result
@@ -0,0 +1,227 @@
+"""
+意味検索用のベクトルインデックス
+ドキュメントのチャンクごとの埋め込みベクトルを、正規化した行列として保存する
+"""
+import bisect
+import hashlib
+import json
+import os
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 1回の埋め込みリクエストでまとめて送るチャンク数
+EMBED_BATCH_SIZE = 32
+
+METADATA_FILE = 'chunks.json'
+# 保存するチャンクの情報
+CHUNK_FIELDS = ('id', 'document', 'start_line', 'end_line', 'heading', 'hash')
+
+def chunk_hash(text: str) -> str:
+    """チャンクの内容のハッシュ（内容が同じなら埋め込みを再利用する）"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def document_chunks(documents: Dict) -> List[Dict]:
+    """
+    全ドキュメントのチャンク（取り込み時に分割したもの）を列挙
+    
+    Returns:
+        [{'id', 'document', 'start_line', 'end_line', 'heading', 'hash', 'text'}]
+    """
+    chunks = []
+    for name, doc in documents.items():
+        for chunk in doc.chunks:
+            text = doc.slice_lines(chunk.start_line - 1, chunk.end_line)
+            chunks.append({
+                'id': chunk.id,
+                'document': name,
+                'start_line': chunk.start_line,
+                'end_line': chunk.end_line,
+                'heading': chunk.heading,
+                'hash': chunk_hash(text),
+                'text': text
+            })
+    return chunks
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    """各行を長さ1にする（内積がコサイン類似度になる）"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+class VectorIndex:
+    """
+    チャンクの埋め込みベクトル（正規化済みのfloat32行列）
+    
+    読み取り専用として扱い、更新時は updated() で新しいインデックスを作る
+    """
+    
+    def __init__(self, chunks: Optional[List[Dict]] = None, vectors: Optional[np.ndarray] = None,
+                 model: str = '', document_version: int = -1):
+        """
+        Args:
+            chunks: チャンク情報 [{'id', 'document', 'start_line', 'end_line', 'heading', 'hash'}]
+            vectors: チャンクと同じ順序の正規化済みベクトル（len(chunks) × 次元数）
+            model: 埋め込みに使ったモデル（モデルが変わった場合は再利用しない）
+            document_version: 作成元のドキュメントのバージョン
+        """
+        self.chunks = chunks if chunks is not None else []
+        self.vectors = vectors if vectors is not None else np.zeros((0, 0), dtype=np.float32)
+        self.model = model
+        self.document_version = document_version
+        # {ドキュメント名: ([開始行], [チャンク番号])}（行からチャンクを探すため）
+        self._by_document = {}
+        for i, chunk in enumerate(self.chunks):
+            starts, indexes = self._by_document.setdefault(chunk['document'], ([], []))
+            starts.append(chunk['start_line'])
+            indexes.append(i)
+    
+    def __len__(self):
+        return len(self.chunks)
+    
+    def chunk_at(self, document: str, line: int) -> Optional[int]:
+        """指定した行を含むチャンクの番号（なければNone）"""
+        entry = self._by_document.get(document)
+        if entry is None:
+            return None
+        starts, indexes = entry
+        pos = bisect.bisect_right(starts, line) - 1
+        if pos < 0:
+            return None
+        i = indexes[pos]
+        return i if line <= self.chunks[i]['end_line'] else None
+    
+    def updated(self, chunks: List[Dict], embedder, model: str, document_version: int,
+                progress=None) -> 'VectorIndex':
+        """
+        チャンクの一覧に合わせた新しいインデックスを作成
+        
+        内容のハッシュが既存のチャンクと同じものはベクトルを再利用し、
+        新しい（変更された）チャンクだけを埋め込む。
+        
+        Args:
+            chunks: document_chunks() の戻り値
+            embedder: embed(テキストのリスト) でベクトルのリストを返すオブジェクト
+            model: 埋め込みモデル名
+            document_version: 作成元のドキュメントのバージョン
+            progress: 進捗を受け取る関数 progress(埋め込み済み件数, 埋め込みが必要な件数)
+        """
+        metadata = [{key: chunk[key] for key in CHUNK_FIELDS} for chunk in chunks]
+        if model == self.model and metadata == self.chunks:
+            # チャンクが変わっていなければベクトル（メモリマップ）をそのまま使う
+            return VectorIndex(self.chunks, self.vectors, model, document_version)
+        
+        reusable = {}
+        if model == self.model:
+            for i, chunk in enumerate(self.chunks):
+                reusable.setdefault(chunk['hash'], i)
+        
+        # 埋め込みが必要なチャンク（同じ内容は1回だけ）
+        pending = {}
+        for chunk in chunks:
+            if chunk['hash'] not in reusable and chunk['hash'] not in pending:
+                pending[chunk['hash']] = chunk['text']
+        
+        embedded = {}
+        texts = list(pending.items())
+        for offset in range(0, len(texts), EMBED_BATCH_SIZE):
+            batch = texts[offset:offset + EMBED_BATCH_SIZE]
+            vectors = _normalize(np.asarray(embedder.embed([text for _, text in batch]), dtype=np.float32))
+            for (digest, _), vector in zip(batch, vectors):
+                embedded[digest] = vector
+            if progress:
+                progress(min(offset + EMBED_BATCH_SIZE, len(texts)), len(texts))
+        
+        if embedded:
+            dim = len(next(iter(embedded.values())))
+        else:
+            dim = self.vectors.shape[1] if len(self.vectors) else 0
+        matrix = np.empty((len(chunks), dim), dtype=np.float32)
+        for row, chunk in enumerate(chunks):
+            digest = chunk['hash']
+            matrix[row] = embedded[digest] if digest in embedded else self.vectors[reusable[digest]]
+        
+        return VectorIndex(metadata, matrix, model, document_version)
+    
+    def similarities(self, query_vector) -> np.ndarray:
+        """全チャンクとのコサイン類似度（チャンクと同じ順序）"""
+        if not len(self.chunks):
+            return np.zeros(0, dtype=np.float32)
+        query = _normalize(np.asarray([query_vector], dtype=np.float32))[0]
+        if query.shape[0] != self.vectors.shape[1]:
+            raise ValueError('埋め込みベクトルの次元数がインデックスと一致しません')
+        return self.vectors @ query
+    
+    def search(self, query_vector, top_k: int, scores: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        コサイン類似度の高いチャンクを取得
+        
+        Args:
+            query_vector: クエリの埋め込みベクトル
+            top_k: 取得する件数
+            scores: 計算済みの similarities() の結果（あれば再計算しない）
+        
+        Returns:
+            [(チャンク番号, 類似度)]（類似度の高い順）
+        """
+        if not len(self.chunks) or top_k <= 0:
+            return []
+        if scores is None:
+            scores = self.similarities(query_vector)
+        k = min(top_k, len(scores))
+        # 全件をソートせず上位k件だけを取り出してから並べ替える
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(i), float(scores[i])) for i in top]
+    
+    def save(self, directory: str):
+        """
+        ディレクトリに保存（ベクトルは .npy、チャンク情報は JSON）
+        
+        ベクトルは毎回新しいファイル名で書き出し、メタデータの差し替えで切り替える。
+        読み込み中（メモリマップ中）のファイルは上書きしない。
+        """
+        os.makedirs(directory, exist_ok=True)
+        vectors_file = f"vectors-{uuid.uuid4().hex[:12]}.npy"
+        np.save(os.path.join(directory, vectors_file), np.ascontiguousarray(self.vectors))
+        
+        metadata_path = os.path.join(directory, METADATA_FILE)
+        tmp_path = metadata_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'model': self.model,
+                'dim': int(self.vectors.shape[1]) if self.vectors.ndim == 2 else 0,
+                'vectors_file': vectors_file,
+                'chunks': self.chunks
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, metadata_path)
+        
+        # 古いベクトルファイルを削除（使用中で削除できない場合は次回に持ち越す）
+        for filename in os.listdir(directory):
+            if filename.startswith('vectors-') and filename.endswith('.npy') and filename != vectors_file:
+                try:
+                    os.remove(os.path.join(directory, filename))
+                except OSError:
+                    pass
+    
+    @classmethod
+    def load(cls, directory: str) -> 'VectorIndex':
+        """
+        保存済みのインデックスを読み込む（ベクトルはメモリマップで参照する）
+        
+        ファイルがない・壊れている場合は空のインデックスを返す
+        """
+        metadata_path = os.path.join(directory, METADATA_FILE)
+        if not os.path.exists(metadata_path):
+            return cls()
+        try:
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+            vectors = np.load(os.path.join(directory, metadata['vectors_file']), mmap_mode='r')
+            if vectors.shape[0] != len(metadata['chunks']):
+                raise ValueError('チャンク数とベクトル数が一致しません')
+            return cls(metadata['chunks'], vectors, metadata['model'])
+        except Exception as e:
+            print(f"ベクトルインデックス読み込みエラー ({directory}): {e}")
+            return cls()
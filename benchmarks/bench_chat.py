@@ -0,0 +1,189 @@
+"""
+/api/chat の負荷試験
+Ollamaのスタブサーバーと合成ドキュメントでアプリを起動し、同時に質問を送ってレイテンシとスループットを計測する
+
+使い方:
+    python benchmarks/bench_chat.py [--requests 200] [--concurrency 8] [--tokens-per-second 50] [--stream] [--json result.json]
+
+OLLAMA_WORKERS・OLLAMA_QUEUE_SIZE などの環境変数はそのままアプリに渡される（サーバーの設定の比較に使う）
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from common import setup_path, summarize, write_results
+from corpus import generate_corpus, generate_queries
+from stub_ollama import StubConfig, start_stub
+
+# 起動処理（ドキュメントの読み込み）の完了を待つ最大時間（秒）
+READY_TIMEOUT = 600
+
+def start_app(docs_dir: str, work_dir: str, ollama_url: str):
+    """
+    スタブを使うように環境変数を設定してアプリを起動
+    
+    Returns:
+        (サーバー, ベースURL)
+    """
+    os.environ['OLLAMA_API_URL'] = ollama_url
+    os.environ['DOCS_DIR'] = docs_dir
+    os.environ['SEARCH_INDEX_PATH'] = os.path.join(work_dir, 'search-index.bin')
+    os.environ['VECTOR_INDEX_DIR'] = os.path.join(work_dir, 'vectors')
+    # 同じ質問の応答キャッシュは使わない（毎回生成する）
+    os.environ['RESPONSE_CACHE_SIZE'] = '0'
+    os.environ['DOCS_WATCH_INTERVAL'] = '0'
+    setup_path()
+    
+    from werkzeug.serving import make_server
+    from app import app
+    
+    # リクエストごとのアクセスログは出さない
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def wait_ready(base_url: str) -> float:
+    """起動処理が終わるまで待つ（待った時間を返す）"""
+    started_at = time.perf_counter()
+    while time.perf_counter() - started_at < READY_TIMEOUT:
+        try:
+            if requests.get(f"{base_url}/api/ready", timeout=5).status_code == 200:
+                return time.perf_counter() - started_at
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('起動処理が時間内に終わりませんでした')
+
+def send_chat(session: requests.Session, base_url: str, message: str) -> dict:
+    """1回の質問（応答全体を受け取るまで）"""
+    started_at = time.perf_counter()
+    response = session.post(f"{base_url}/api/chat", json={'message': message}, timeout=300)
+    return {'status': response.status_code, 'seconds': time.perf_counter() - started_at}
+
+def send_chat_stream(session: requests.Session, base_url: str, message: str) -> dict:
+    """1回の質問（ストリーミング。最初のトークンまでの時間も計測する）"""
+    started_at = time.perf_counter()
+    first_token = None
+    tokens = 0
+    status = None
+    with session.post(f"{base_url}/api/chat/stream", json={'message': message}, stream=True,
+                      timeout=300) as response:
+        status = response.status_code
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith('event: '):
+                event = line[len('event: '):]
+            elif line.startswith('data: ') and event == 'token':
+                tokens += 1
+                if first_token is None:
+                    first_token = time.perf_counter() - started_at
+            elif line.startswith('data: ') and event == 'error':
+                status = 'error'
+    return {'status': status, 'seconds': time.perf_counter() - started_at,
+            'first_token': first_token, 'tokens': tokens}
+
+def run_load(base_url: str, questions, concurrency: int, stream: bool) -> dict:
+    """質問を同時に送って集計"""
+    local = threading.local()
+    
+    def send(message):
+        # 接続はスレッドごとに使い回す
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        try:
+            if stream:
+                return send_chat_stream(local.session, base_url, message)
+            return send_chat(local.session, base_url, message)
+        except requests.exceptions.RequestException as e:
+            return {'status': type(e).__name__, 'seconds': 0.0}
+    
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, questions))
+    elapsed = time.perf_counter() - started_at
+    
+    statuses = {}
+    for result in results:
+        statuses[str(result['status'])] = statuses.get(str(result['status']), 0) + 1
+    succeeded = [result for result in results if result['status'] == 200]
+    summary = {
+        'requests': len(results),
+        'concurrency': concurrency,
+        'stream': stream,
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_rps': round(len(succeeded) / elapsed, 3) if elapsed else 0.0,
+        'statuses': statuses,
+        'latency': summarize([result['seconds'] for result in succeeded])
+    }
+    if stream:
+        summary['first_token'] = summarize([result['first_token'] for result in succeeded
+                                            if result.get('first_token') is not None])
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description='/api/chat に同時に質問を送って性能を計測します')
+    parser.add_argument('--documents', type=int, default=200, help='合成ドキュメント数')
+    parser.add_argument('--chars', type=int, default=2000, help='1ドキュメントあたりの文字数')
+    parser.add_argument('--requests', type=int, default=100, help='送る質問の数')
+    parser.add_argument('--concurrency', default='1,4,8', help='同時に送る数（カンマ区切りで複数指定すると順に計測）')
+    parser.add_argument('--tokens-per-second', type=float, default=50, help='スタブが1秒あたりに生成するトークン数')
+    parser.add_argument('--tokens', type=int, default=50, help='スタブの1回の応答のトークン数')
+    parser.add_argument('--load-delay', type=float, default=0.05, help='スタブが最初のトークンを返すまでの時間（秒）')
+    parser.add_argument('--stream', action='store_true', help='/api/chat/stream を使う（最初のトークンまでの時間も計測）')
+    parser.add_argument('--json', help='結果をJSONで保存するパス')
+    args = parser.parse_args()
+    
+    concurrency_levels = [int(value) for value in args.concurrency.split(',') if value.strip()]
+    with tempfile.TemporaryDirectory() as work_dir:
+        docs_dir = os.path.join(work_dir, 'docs')
+        generate_corpus(docs_dir, args.documents, args.chars)
+        stub, ollama_url = start_stub(0, StubConfig(args.tokens_per_second, args.tokens, args.load_delay))
+        server, base_url = start_app(docs_dir, work_dir, ollama_url)
+        try:
+            startup_seconds = wait_ready(base_url)
+            print(f"起動処理: {startup_seconds:.2f} 秒（ドキュメント {args.documents} 件）")
+            results = []
+            for concurrency in concurrency_levels:
+                # 質問は毎回変えて、検索結果のキャッシュの効果も実際の利用に近づける
+                questions = generate_queries(args.requests, seed=concurrency)
+                result = run_load(base_url, questions, concurrency, args.stream)
+                results.append(result)
+                latency = result['latency']
+                line = (f"同時 {concurrency:>3}: {result['throughput_rps']} 件/秒"
+                        f" / p50 {latency.get('p50_ms')} ms, p95 {latency.get('p95_ms')} ms"
+                        f" / 応答 {json.dumps(result['statuses'])}")
+                if args.stream:
+                    line += f" / 最初のトークン p50 {result['first_token'].get('p50_ms')} ms"
+                print(line)
+            queue = requests.get(f"{base_url}/api/queue/stats", timeout=5).json()
+            search_cache = requests.get(f"{base_url}/api/search/cache/stats", timeout=5).json()
+        finally:
+            server.shutdown()
+            stub.shutdown()
+    
+    if args.json:
+        write_results(args.json, 'chat', {
+            'documents': args.documents,
+            'chars_per_document': args.chars,
+            'requests': args.requests,
+            'tokens_per_second': args.tokens_per_second,
+            'tokens': args.tokens,
+            'load_delay': args.load_delay,
+            'ollama_workers': queue.get('workers'),
+            'ollama_queue_size': queue.get('max_queue')
+        }, {
+            'startup_seconds': round(startup_seconds, 3),
+            'runs': results,
+            'search_cache': search_cache
+        })
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+インデックス作成のベンチマーク
+合成ドキュメントを作成し、ワーカープロセス数を1からNまで変えてすべて読み込む時間を比較する
+
+使い方:
+    python benchmarks/bench_indexing.py [--documents 200] [--chars 20000] [--max-workers 4] [--json result.json]
+"""
+import argparse
+import tempfile
+import time
+
+from common import setup_path, write_results
+from corpus import generate_corpus
+
+setup_path()
+
+from document_search import DocumentSearch
+from parallel_index import default_workers
+
+def measure(docs_dir: str, workers: int, repeat: int) -> dict:
+    """スナップショットを使わずにすべて読み込む時間を計測（repeat回のうち最短）"""
+    times = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        document_search = DocumentSearch(docs_dir, autoload=False, workers=workers)
+        document_search.reload()
+        times.append(time.perf_counter() - started_at)
+    return {
+        'workers': workers,
+        'seconds': round(min(times), 3),
+        'documents': len(document_search.documents_cache),
+        'chunks': len(document_search.index.doc_lengths),
+        'terms': len(document_search.index.postings)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='ワーカープロセス数ごとのインデックス作成時間を計測します')
+    parser.add_argument('--documents', type=int, default=200, help='作成するドキュメント数')
+    parser.add_argument('--chars', type=int, default=20000, help='1ドキュメントあたりの文字数')
+    parser.add_argument('--max-workers', type=int, default=default_workers(), help='計測する最大のワーカー数')
+    parser.add_argument('--repeat', type=int, default=3, help='各ワーカー数での計測回数（最短の時間を使用）')
+    parser.add_argument('--json', help='結果をJSONで保存するパス')
+    args = parser.parse_args()
+    
+    worker_counts = sorted({1, *[n for n in (2, 4, 8, 16, 32) if n < args.max_workers], args.max_workers})
+    with tempfile.TemporaryDirectory() as docs_dir:
+        generate_corpus(docs_dir, args.documents, args.chars)
+        print(f"ドキュメント: {args.documents} 件 × 約{args.chars:,} 文字（CPU: {default_workers()} コア）")
+        results = []
+        for workers in worker_counts:
+            result = measure(docs_dir, workers, args.repeat)
+            result['speedup'] = round(results[0]['seconds'] / result['seconds'], 2) if results else 1.0
+            results.append(result)
+            print(f"ワーカー {workers:>2}: {result['seconds']:.3f} 秒（{result['speedup']:.2f} 倍）"
+                  f" チャンク {result['chunks']} / 語 {result['terms']}")
+    
+    if args.json:
+        write_results(args.json, 'indexing', {
+            'documents': args.documents,
+            'chars_per_document': args.chars,
+            'repeat': args.repeat
+        }, results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+検索のベンチマーク
+合成ドキュメントの件数ごとに、インデックスの作成時間・メモリ使用量と検索のレイテンシ（パーセンタイル）を計測する
+
+使い方:
+    python benchmarks/bench_search.py [--sizes 100,1000,10000] [--chars 2000] [--queries 500] [--json result.json]
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from common import peak_memory_mb, setup_path, summarize, write_results
+from corpus import generate_corpus, generate_queries
+
+setup_path()
+
+from document_search import SEARCH_MODES, DocumentSearch
+from index_snapshot import save_snapshot, snapshot_file
+
+def measure_size(documents: int, chars: int, queries: int, max_results: int, mode: str, workers: int) -> dict:
+    """
+    1つの件数について計測（最大メモリ使用量を分けるため、件数ごとに別のプロセスで実行する）
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        docs_dir = os.path.join(work_dir, 'docs')
+        generate_corpus(docs_dir, documents, chars)
+        memory_before = peak_memory_mb()
+        
+        started_at = time.perf_counter()
+        # 検索結果のキャッシュは使わずに毎回検索する
+        document_search = DocumentSearch(docs_dir, autoload=False, workers=workers, cache_size=0)
+        document_search.reload()
+        build_seconds = time.perf_counter() - started_at
+        memory_after = peak_memory_mb()
+        
+        snapshot_path = os.path.join(work_dir, 'search-index.bin')
+        snapshot = document_search._snapshot
+        save_snapshot(snapshot_path, snapshot.documents, snapshot.index, snapshot.fingerprints)
+        # snapshot_path は本体のファイル名を書いたポインタなので、本体の大きさを測る
+        snapshot_bytes = os.path.getsize(snapshot_file(snapshot_path))
+        
+        questions = generate_queries(queries)
+        # 初回の呼び出し（キーワード分割のキャッシュなど）を計測から除く
+        for question in questions[:10]:
+            document_search.search(question, max_results, mode)
+        latencies = []
+        hits = 0
+        for question in questions:
+            started_at = time.perf_counter()
+            results = document_search.search(question, max_results, mode)
+            latencies.append(time.perf_counter() - started_at)
+            hits += bool(results)
+    
+    return {
+        'documents': documents,
+        'chunks': len(snapshot.chunks),
+        'terms': len(snapshot.index.postings),
+        'build_seconds': round(build_seconds, 3),
+        'peak_memory_mb': memory_after,
+        'index_memory_mb': round(memory_after - memory_before, 1) if memory_after is not None else None,
+        'snapshot_mb': round(snapshot_bytes / (1024 * 1024), 2),
+        'queries_with_results': hits,
+        'search': summarize(latencies)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='ドキュメント数ごとのインデックス作成・検索の性能を計測します')
+    parser.add_argument('--sizes', default='100,1000,10000', help='ドキュメント数（カンマ区切り、最大100000程度）')
+    parser.add_argument('--chars', type=int, default=2000, help='1ドキュメントあたりの文字数')
+    parser.add_argument('--queries', type=int, default=500, help='計測する検索の回数')
+    parser.add_argument('--max-results', type=int, default=3, help='1回の検索の最大結果数')
+    parser.add_argument('--mode', default='keyword', choices=SEARCH_MODES,
+                        help='検索方式（埋め込みを使わないため semantic・hybrid もキーワード検索になる）')
+    parser.add_argument('--workers', type=int, default=1, help='インデックス作成に使うプロセス数')
+    parser.add_argument('--json', help='結果をJSONで保存するパス')
+    args = parser.parse_args()
+    
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    results = []
+    for size in sizes:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            result = executor.submit(measure_size, size, args.chars, args.queries, args.max_results,
+                                     args.mode, args.workers).result()
+        results.append(result)
+        search = result['search']
+        memory = f"{result['index_memory_mb']} MB" if result['index_memory_mb'] is not None else '計測不可'
+        print(f"{size:>7} 件: 作成 {result['build_seconds']:.2f} 秒 / メモリ {memory}"
+              f" / スナップショット {result['snapshot_mb']} MB"
+              f" / 検索 p50 {search['p50_ms']} ms, p95 {search['p95_ms']} ms, p99 {search['p99_ms']} ms")
+    
+    if args.json:
+        write_results(args.json, 'search', {
+            'sizes': sizes,
+            'chars_per_document': args.chars,
+            'queries': args.queries,
+            'max_results': args.max_results,
+            'mode': args.mode,
+            'workers': args.workers
+        }, results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+ベンチマークの共通処理
+計測値の集計と、コミット間で比較できるJSON形式での保存
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windowsでは最大メモリ使用量を計測しない
+    resource = None
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def setup_path():
+    """backendディレクトリをパスに追加"""
+    backend_dir = os.path.join(root_dir, 'backend')
+    if backend_dir not in sys.path:
+        sys.path.insert(0, backend_dir)
+
+def summarize(seconds: List[float]) -> Dict:
+    """
+    処理時間の集計（ミリ秒）
+    
+    Returns:
+        {'count', 'mean_ms', 'p50_ms', 'p90_ms', 'p95_ms', 'p99_ms', 'max_ms'}
+    """
+    if not seconds:
+        return {'count': 0}
+    values = sorted(seconds)
+    
+    def percentile(p):
+        # 最近傍法（件数が少なくても実際の計測値のいずれかになる）
+        index = min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))
+        return round(values[index] * 1000, 3)
+    
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 3),
+        'p50_ms': percentile(50),
+        'p90_ms': percentile(90),
+        'p95_ms': percentile(95),
+        'p99_ms': percentile(99),
+        'max_ms': round(values[-1] * 1000, 3)
+    }
+
+def peak_memory_mb() -> Optional[float]:
+    """このプロセスの最大メモリ使用量（MB、計測できない環境ではNone）"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOSはバイト、Linuxはキロバイト単位
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def _git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root_dir,
+                                capture_output=True, text=True, timeout=5)
+        return result.stdout.strip() or None
+    except Exception:
+        return None
+
+def environment() -> Dict:
+    """計測環境（結果を比較するときの前提条件）"""
+    return {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    }
+
+def write_results(path: str, benchmark: str, params: Dict, results) -> None:
+    """結果をJSONで保存"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'benchmark': benchmark,
+            'environment': environment(),
+            'params': params,
+            'results': results
+        }, f, ensure_ascii=False, indent=2)
+    print(f"保存先: {path}")
@@ -0,0 +1,98 @@
+"""
+ベンチマーク用の合成ドキュメント
+製造現場のマニュアル・手順書に似た日本語・英語のMarkdownを、指定した件数・大きさで作成する
+"""
+import os
+import random
+from typing import List
+
+JA_SUBJECTS = ['プレス機', '溶接ロボット', '搬送コンベア', '射出成形機', '検査装置', '冷却ユニット',
+               '油圧ポンプ', '塗装ブース', '組立ライン', '包装機', 'ボイラー', 'コンプレッサー']
+JA_ACTIONS = ['点検する', '清掃する', '交換する', '調整する', '記録する', '確認する', '停止する', '再起動する']
+JA_DETAILS = ['異常音がないこと', '温度が規定範囲内であること', '油漏れがないこと', '振動値が基準以下であること',
+              'センサーの表示が正常であること', '安全カバーが閉じていること', '圧力が0.5MPa以上であること']
+JA_SECTIONS = ['概要', '作業手順', '日常点検', '定期保全', 'トラブルシューティング', '安全上の注意', '品質基準']
+
+EN_SUBJECTS = ['press', 'welding robot', 'conveyor', 'injection molder', 'inspection camera', 'chiller',
+               'hydraulic pump', 'paint booth', 'assembly line', 'packaging machine', 'boiler', 'compressor']
+EN_ACTIONS = ['inspect', 'clean', 'replace', 'calibrate', 'log', 'verify', 'shut down', 'restart']
+EN_DETAILS = ['no abnormal noise is present', 'temperature stays within limits', 'there is no oil leakage',
+              'vibration is below the threshold', 'the sensor display is normal', 'the safety cover is closed']
+EN_SECTIONS = ['Overview', 'Procedure', 'Daily inspection', 'Preventive maintenance', 'Troubleshooting',
+               'Safety notes', 'Quality criteria']
+
+def _ja_sentence(rng: random.Random) -> str:
+    return (f"{rng.choice(JA_SUBJECTS)}を{rng.choice(JA_ACTIONS)}前に、"
+            f"{rng.choice(JA_DETAILS)}を確認してください。")
+
+def _en_sentence(rng: random.Random) -> str:
+    return (f"Before you {rng.choice(EN_ACTIONS)} the {rng.choice(EN_SUBJECTS)}, "
+            f"check that {rng.choice(EN_DETAILS)}.")
+
+def generate_document(rng: random.Random, title: str, target_chars: int, language: str = 'ja') -> str:
+    """
+    見出し・段落・番号付きリストを含む1つのドキュメントを作成
+    
+    Args:
+        rng: 乱数生成器（同じシードなら同じ内容になる）
+        title: ドキュメントの見出し
+        target_chars: おおよその文字数
+        language: 'ja' または 'en'
+    """
+    sentence = _ja_sentence if language == 'ja' else _en_sentence
+    sections = JA_SECTIONS if language == 'ja' else EN_SECTIONS
+    lines = [f"# {title}", '']
+    size = 0
+    section_no = 0
+    while size < target_chars:
+        section_no += 1
+        lines.append(f"## {section_no}. {sections[section_no % len(sections)]}")
+        lines.append('')
+        for _ in range(rng.randint(2, 5)):
+            paragraph = ' '.join(sentence(rng) for _ in range(rng.randint(1, 4)))
+            lines.append(paragraph)
+            lines.append('')
+            size += len(paragraph)
+        if rng.random() < 0.5:
+            for item_no in range(1, rng.randint(3, 6)):
+                lines.append(f"{item_no}. {sentence(rng)}")
+            lines.append('')
+    return '\n'.join(lines)
+
+def generate_corpus(directory: str, documents: int = 200, chars_per_document: int = 20000,
+                    seed: int = 0) -> List[str]:
+    """
+    ディレクトリに合成ドキュメントを作成（日本語と英語が半数ずつ）
+    
+    Returns:
+        作成したファイル名のリスト
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    filenames = []
+    for i in range(documents):
+        language = 'ja' if i % 2 == 0 else 'en'
+        subject = rng.choice(JA_SUBJECTS if language == 'ja' else EN_SUBJECTS)
+        title = f"{subject} 保守マニュアル {i:04d}" if language == 'ja' else f"{subject} maintenance manual {i:04d}"
+        filename = f"manual_{i:04d}_{language}.md"
+        with open(os.path.join(directory, filename), 'w', encoding='utf-8') as f:
+            f.write(generate_document(rng, title, chars_per_document, language))
+        filenames.append(filename)
+    return filenames
+
+def generate_queries(count: int, seed: int = 1) -> List[str]:
+    """
+    検索・チャットのベンチマーク用の質問を作成（日本語と英語が半数ずつ）
+    
+    合成ドキュメントと同じ語彙を使うため、ほとんどの質問に該当する部分がある
+    """
+    rng = random.Random(seed)
+    queries = []
+    for i in range(count):
+        if i % 2 == 0:
+            # 日本語は連続した文字列が1つのキーワードになるため、語を空白で区切る
+            queries.append(f"{rng.choice(JA_SUBJECTS)} {rng.choice(JA_SECTIONS)} {rng.choice(JA_DETAILS)}")
+        else:
+            queries.append(f"How do I {rng.choice(EN_ACTIONS)} the {rng.choice(EN_SUBJECTS)} "
+                           f"during {rng.choice(EN_SECTIONS).lower()}?")
+    return queries
@@ -0,0 +1,164 @@
+"""
+ベンチマーク用のOllamaのスタブサーバー
+実際のモデルを使わずに、指定した速度でトークンを返す（/api/chat の負荷試験用）
+
+単体で起動する場合:
+    python benchmarks/stub_ollama.py [--port 11435] [--tokens-per-second 50] [--tokens 100]
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_MODELS = ('tinyllama', 'nomic-embed-text')
+EMBEDDING_DIM = 64
+
+class StubConfig:
+    """スタブの応答速度"""
+    
+    def __init__(self, tokens_per_second: float = 50, tokens: int = 100, load_delay: float = 0.0):
+        """
+        Args:
+            tokens_per_second: 1秒あたりに生成するトークン数（0以下なら待たずに返す）
+            tokens: 1回の応答のトークン数
+            load_delay: 最初のトークンを返すまでの時間（プロンプトの処理時間、秒）
+        """
+        self.tokens_per_second = tokens_per_second
+        self.tokens = tokens
+        self.load_delay = load_delay
+
+def _embedding(text: str):
+    """テキストから決まる疑似的な埋め込みベクトル"""
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    return [(digest[i % len(digest)] - 128) / 128 for i in range(EMBEDDING_DIM)]
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config: StubConfig = StubConfig()
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+    
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self._send_json({'models': [{'name': f"{name}:latest"} for name in STUB_MODELS]})
+        else:
+            self._send_json({'error': 'not found'}, 404)
+    
+    def do_POST(self):
+        data = self._read_json()
+        if self.path == '/api/generate':
+            self._generate(data)
+        elif self.path == '/api/embed':
+            texts = data.get('input', '')
+            texts = [texts] if isinstance(texts, str) else texts
+            self._send_json({'embeddings': [_embedding(text) for text in texts]})
+        elif self.path == '/api/embeddings':
+            self._send_json({'embedding': _embedding(data.get('prompt', ''))})
+        elif self.path == '/api/pull':
+            self._send_json({'status': 'success'})
+        else:
+            self._send_json({'error': 'not found'}, 404)
+    
+    def _generate(self, data):
+        config = self.config
+        started_at = time.perf_counter()
+        if not data.get('prompt'):
+            # 空のプロンプトはモデルの読み込み（ウォームアップ）のみ
+            self._send_json({'model': data.get('model', ''), 'response': '', 'done': True,
+                             'done_reason': 'load', 'load_duration': int((time.perf_counter() - started_at) * 1e9)})
+            return
+        prompt_tokens = len(data.get('prompt', '')) // 4
+        interval = 1 / config.tokens_per_second if config.tokens_per_second > 0 else 0
+        if config.load_delay:
+            time.sleep(config.load_delay)
+        prompt_done_at = time.perf_counter()
+        
+        def stats(tokens):
+            now = time.perf_counter()
+            return {
+                'done': True,
+                'total_duration': int((now - started_at) * 1e9),
+                'prompt_eval_count': prompt_tokens,
+                'prompt_eval_duration': int((prompt_done_at - started_at) * 1e9),
+                'eval_count': tokens,
+                'eval_duration': int((now - prompt_done_at) * 1e9),
+                # 会話を引き継ぐためのトークン列（受け取った context の後ろに今回の分を追加する）
+                'context': list(data.get('context') or []) + list(range(prompt_tokens + tokens))
+            }
+        
+        if not data.get('stream', True):
+            time.sleep(interval * config.tokens)
+            result = stats(config.tokens)
+            result['response'] = ' '.join(f"token{i}" for i in range(config.tokens))
+            self._send_json(result)
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for i in range(config.tokens):
+                if interval:
+                    time.sleep(interval)
+                self._write_chunk({'response': f"token{i} ", 'done': False})
+            self._write_chunk(stats(config.tokens))
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアントが切断した
+            self.close_connection = True
+    
+    def _write_chunk(self, data):
+        line = json.dumps(data).encode('utf-8') + b'\n'
+        self.wfile.write(f"{len(line):x}\r\n".encode('ascii') + line + b'\r\n')
+        self.wfile.flush()
+
+def start_stub(port: int = 0, config: StubConfig = None):
+    """
+    スタブサーバーをバックグラウンドのスレッドで起動
+    
+    Args:
+        port: 待ち受けるポート（0なら空いているポート）
+        config: 応答速度
+    
+    Returns:
+        (サーバー, ベースURL)。終了するときは server.shutdown() を呼ぶ
+    """
+    handler = type('StubHandler', (_Handler,), {'config': config or StubConfig()})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='stub-ollama', daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description='ベンチマーク用のOllamaのスタブサーバーを起動します')
+    parser.add_argument('--port', type=int, default=11435, help='待ち受けるポート')
+    parser.add_argument('--tokens-per-second', type=float, default=50, help='1秒あたりに生成するトークン数')
+    parser.add_argument('--tokens', type=int, default=100, help='1回の応答のトークン数')
+    parser.add_argument('--load-delay', type=float, default=0.0, help='最初のトークンを返すまでの時間（秒）')
+    args = parser.parse_args()
+    
+    server, url = start_stub(args.port, StubConfig(args.tokens_per_second, args.tokens, args.load_delay))
+    print(f"スタブサーバー: {url}（OLLAMA_API_URL に設定してください。Ctrl+Cで終了）")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
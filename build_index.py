@@ -0,0 +1,49 @@
+"""
+検索インデックスのスナップショット作成スクリプト
+デプロイ前に実行しておくと、起動時にドキュメントを読み込み直さずにスナップショットから復元できる
+
+使い方:
+    python build_index.py [--docs docs] [--output index/search-index.bin] [--workers 4]
+"""
+import argparse
+import os
+import sys
+import time
+
+# backendディレクトリをパスに追加
+root_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(root_dir, 'backend'))
+
+from document_search import DocumentSearch
+from index_snapshot import snapshot_file
+from parallel_index import default_workers
+
+def main():
+    parser = argparse.ArgumentParser(description='検索インデックスのスナップショットを作成します')
+    parser.add_argument('--docs', default=os.path.join(root_dir, 'docs'), help='ドキュメントのディレクトリ')
+    parser.add_argument('--output', default=os.getenv('SEARCH_INDEX_PATH', os.path.join(root_dir, 'index', 'search-index.bin')),
+                        help='スナップショットの保存先')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('INDEX_WORKERS', '1')),
+                        help='読み込み・インデックス作成に使うプロセス数（0でCPUのコア数）')
+    parser.add_argument('--rebuild', action='store_true', help='既存のスナップショットを使わずにすべて読み込み直す')
+    args = parser.parse_args()
+    
+    if args.rebuild and os.path.exists(args.output):
+        os.remove(args.output)
+    
+    started_at = time.perf_counter()
+    document_search = DocumentSearch(args.docs, autoload=False, index_path=args.output,
+                                     workers=args.workers or default_workers())
+    changes = document_search.reload()
+    elapsed = time.perf_counter() - started_at
+    
+    print(f"ドキュメント: {len(document_search.documents_cache)} 件"
+          f"（追加 {len(changes['added'])} / 更新 {len(changes['updated'])} / 削除 {len(changes['removed'])}）")
+    print(f"語の種類: {len(document_search.index.postings)}")
+    data_path = snapshot_file(args.output)
+    if data_path is not None and os.path.exists(data_path):
+        print(f"保存先: {data_path}（{os.path.getsize(data_path):,} バイト）")
+    print(f"処理時間: {elapsed:.2f} 秒")
+
+if __name__ == '__main__':
+    main()
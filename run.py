@@ -8,7 +8,7 @@ import sys
 backend_dir = os.path.join(os.path.dirname(__file__), 'backend')
 sys.path.insert(0, backend_dir)
 
-# Flaskアプリをインポート（この時点でモデル確認が実行される）
+# Flaskアプリをインポート（ドキュメント読み込みとモデル確認はバックグラウンドで実行される）
 from app import app
 
 if __name__ == '__main__':
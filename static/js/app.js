@@ -1,6 +1,14 @@
 // 現在の機能タイプ
 let currentFunctionType = 'chatbot';
 
+// 会話セッションのID（サーバー側で前回までのやり取りを引き継ぐ。ページを読み込み直すと新しい会話になる）
+const sessionId = (window.crypto && crypto.randomUUID)
+    ? crypto.randomUUID()
+    : Date.now().toString(36) + Math.random().toString(36).slice(2);
+
+// ストリーミングAPIが使えないことを示すステータス（この場合のみ通常のAPIで送り直す）
+const STREAM_UNSUPPORTED_STATUS = [404, 405, 501];
+
 // 機能の説明
 const functionDescriptions = {
     chatbot: '社内文書を参照しながら質問にお答えします',
@@ -87,33 +95,40 @@ async function sendMessage() {
     const loadingId = addMessage('考え中...', 'bot', true);
     
     try {
-        const response = await fetch('/api/chat', {
+        const response = await fetch('/api/chat/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
             body: JSON.stringify({
                 message: message,
-                function_type: currentFunctionType
+                function_type: currentFunctionType,
+                session_id: sessionId
             })
         });
         
-        const data = await response.json();
+        // 混雑（429）・起動処理中（503）の場合は再送せずにすぐその旨を表示（サーバーの負荷を増やさない）
+        if (response.status === 429 || response.status === 503) {
+            const data = await response.json().catch(() => ({}));
+            removeMessage(loadingId);
+            addMessage(retryMessage(data.error, response.headers.get('Retry-After') || data.retry_after), 'bot');
+            return;
+        }
         
-        // ローディングメッセージを削除
-        removeMessage(loadingId);
+        // ストリーミングに対応していない場合のみ通常のAPIを使用
+        if (STREAM_UNSUPPORTED_STATUS.includes(response.status) || (response.ok && !response.body)) {
+            await sendMessageBlocking(message, loadingId);
+            return;
+        }
         
-        if (data.success) {
-            // ボットの応答を表示
-            addMessage(data.response, 'bot');
-            
-            // 参照元を表示
-            if (data.sources && data.sources.length > 0) {
-                displaySources(data.sources);
-            }
-        } else {
-            addMessage('エラーが発生しました: ' + (data.error || '不明なエラー'), 'bot');
+        if (!response.ok) {
+            const data = await response.json().catch(() => ({}));
+            removeMessage(loadingId);
+            addMessage('エラーが発生しました: ' + (data.error || `HTTP ${response.status}`), 'bot');
+            return;
         }
+        
+        await readChatStream(response, loadingId);
     } catch (error) {
         removeMessage(loadingId);
         addMessage('通信エラーが発生しました: ' + error.message, 'bot');
@@ -122,6 +137,123 @@ async function sendMessage() {
     }
 }
 
+// ストリーミング応答（Server-Sent Events）を読み取り、トークンを順に表示
+async function readChatStream(response, loadingId) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+    let contentDiv = null;
+    
+    const handleEvent = (event, data) => {
+        if (event === 'sources') {
+            // 参照元は回答より先に届く
+            if (data.sources && data.sources.length > 0) {
+                displaySources(data.sources);
+            }
+        } else if (event === 'token') {
+            if (!contentDiv) {
+                // 最初のトークンが届いたらローディングメッセージを置き換える
+                removeMessage(loadingId);
+                contentDiv = createBotMessage();
+            }
+            contentDiv.textContent += data.text;
+            chatMessages.scrollTop = chatMessages.scrollHeight;
+        } else if (event === 'error') {
+            removeMessage(loadingId);
+            if (data.retry_after) {
+                addMessage(retryMessage(data.error, data.retry_after), 'bot');
+            } else {
+                addMessage('エラーが発生しました: ' + (data.error || '不明なエラー'), 'bot');
+            }
+        } else if (event === 'done') {
+            removeMessage(loadingId);
+        }
+    };
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        // イベントは空行で区切られる
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            
+            let event = 'message';
+            let dataText = '';
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) {
+                    event = line.slice(7);
+                } else if (line.startsWith('data: ')) {
+                    dataText += line.slice(6);
+                }
+            });
+            if (dataText) {
+                handleEvent(event, JSON.parse(dataText));
+            }
+        }
+    }
+    removeMessage(loadingId);
+}
+
+// 通常（非ストリーミング）のチャットAPIで送信
+async function sendMessageBlocking(message, loadingId) {
+    const response = await fetch('/api/chat', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            message: message,
+            function_type: currentFunctionType,
+            session_id: sessionId
+        })
+    });
+    
+    const data = await response.json();
+    
+    // ローディングメッセージを削除
+    removeMessage(loadingId);
+    
+    if (response.status === 429 || response.status === 503) {
+        addMessage(retryMessage(data.error, response.headers.get('Retry-After') || data.retry_after), 'bot');
+    } else if (data.success) {
+        // ボットの応答を表示
+        addMessage(data.response, 'bot');
+        
+        // 参照元を表示
+        if (data.sources && data.sources.length > 0) {
+            displaySources(data.sources);
+        }
+    } else {
+        addMessage('エラーが発生しました: ' + (data.error || '不明なエラー'), 'bot');
+    }
+}
+
+// 混雑・起動処理中の場合のメッセージ（Retry-Afterの秒数があれば再試行までの目安を添える）
+function retryMessage(error, retryAfter) {
+    const message = error || 'リクエストが混み合っています。しばらくしてから再度お試しください。';
+    const seconds = parseInt(retryAfter, 10);
+    return seconds > 0 ? `${message}（約${seconds}秒後に再度お試しください）` : message;
+}
+
+// ストリーミング表示用の空のボットメッセージを追加し、本文の要素を返す
+function createBotMessage() {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = 'message bot-message';
+    
+    const contentDiv = document.createElement('div');
+    contentDiv.className = 'message-content';
+    
+    messageDiv.appendChild(contentDiv);
+    chatMessages.appendChild(messageDiv);
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+    
+    return contentDiv;
+}
+
 // メッセージを追加
 function addMessage(content, type, isTemporary = false) {
     const messageDiv = document.createElement('div');
@@ -0,0 +1,53 @@
+"""
+異常検知の前処理（sensor_analysis）のテスト
+量子化された値・周期的な値で、1刻みの変化を異常としないことを確認する
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from sensor_analysis import SensorAnalyzer, SensorData, rate_zscores, resolution, rolling_zscores
+
+def _analyze(values):
+    return SensorAnalyzer().analyze(SensorData({'value': np.asarray(values, dtype=np.float64)}))
+
+def test_resolution_of_quantized_values():
+    values = np.tile([20.0, 20.1, 20.2, 20.3, 20.4], 20)
+    assert np.isclose(resolution(values), 0.1)
+
+def test_resolution_of_constant_values():
+    assert 0 < resolution(np.full(50, 20.0)) < 1e-6
+
+def test_quantized_steps_are_not_anomalies():
+    # ほとんどが同じ値（中央絶対偏差が0）で、ときどき1刻みだけ変わる
+    rng = np.random.default_rng(0)
+    values = np.full(215, 20.0)
+    values[rng.choice(215, 15, replace=False)] = 20.1
+    analysis = _analyze(values)
+    assert analysis.windows == []
+    assert analysis.clear_cut
+    assert np.nanmax(np.abs(rolling_zscores(values, 30))) < 4
+
+def test_periodic_signal_is_not_anomalous():
+    # 差が浮動小数点の誤差でわずかに異なっても、同じ変化として扱う
+    values = np.tile([20.0, 20.1, 20.2, 20.3, 20.4], 60)
+    analysis = _analyze(values)
+    assert analysis.windows == []
+    assert analysis.clear_cut
+    assert np.nanmax(np.abs(rate_zscores(values))) < 4
+
+def test_spike_in_quantized_values_is_detected():
+    values = np.full(215, 20.0)
+    values[100] = 23.0
+    analysis = _analyze(values)
+    assert [window['start'] for window in analysis.windows] == [100]
+    assert not analysis.clear_cut
+
+def test_spike_in_periodic_signal_is_detected():
+    values = np.tile([20.0, 20.1, 20.2, 20.3, 20.4], 60)
+    values[150] = 25.0
+    analysis = _analyze(values)
+    assert any(window['start'] <= 150 <= window['end'] for window in analysis.windows)